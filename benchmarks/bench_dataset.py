@@ -0,0 +1,51 @@
+"""
+Benchmark of the behavior cloning dataset generation:
+vectorized builder vs. stepping through the reference trajectories point by point,
+and of the reference trajectory and observation normalization statistics.
+"""
+import numpy as np
+from benchmarks.bench_utils import time_func
+
+
+def bench_bc_dataset(fly=False, n_repeats=3):
+    from scripts.behavior_cloning import dataset
+    refs = dataset.get_refs()
+    x_vec, y_vec = dataset.build_data(refs, fly)
+    x_step, y_step = dataset._get_data_stepwise(refs, fly)
+    vectorized = time_func(lambda: dataset.build_data(refs, fly), n_repeats=n_repeats)
+    stepwise = time_func(lambda: dataset._get_data_stepwise(refs, fly), n_repeats=1, n_warmup=0)
+    return {'n_points': len(x_vec), 'vectorized': vectorized, 'stepwise': stepwise,
+            'speedup': stepwise['mean_s'] / vectorized['mean_s'],
+            'equal_output': bool(np.array_equal(x_vec, x_step) and np.array_equal(y_vec, y_step))}
+
+
+def bench_obs_rms(n_repeats=10):
+    """ Loading the saved obs_rms from the pickle and calculating it from the refs. """
+    from scripts.behavior_cloning import obs_rms
+    def load_uncached():
+        obs_rms._obs_rms_cache.clear()
+        obs_rms.load_obs_rms()
+    return {'load_saved': time_func(load_uncached, n_repeats=n_repeats),
+            'from_refs': time_func(obs_rms.get_refs_obs_stats, n_repeats=n_repeats)}
+
+
+def bench_refs_stats(n_repeats=3):
+    """ Single pass statistics of the refs against the former dense data matrix. """
+    from scripts.behavior_cloning import dataset
+    from scripts.mocap.ref_stats import calculate_refs_stats
+    refs = dataset.get_refs()
+    def dense_stats():
+        data = dataset.build_data_matrix(refs)
+        return np.mean(data, axis=0), np.var(data, axis=0), np.std(data, axis=0)
+    stats = calculate_refs_stats(refs)
+    max_abs_error = float(np.max(np.abs(stats['global_var'] - dense_stats()[1])))
+    return {'streamed': time_func(lambda: calculate_refs_stats(refs), n_repeats=n_repeats),
+            'dense': time_func(dense_stats, n_repeats=n_repeats),
+            'max_abs_var_error': max_abs_error}
+
+
+def run(quick=False):
+    return {'bc_dataset': bench_bc_dataset(n_repeats=1 if quick else 3),
+            'bc_dataset_fly': bench_bc_dataset(fly=True, n_repeats=1 if quick else 3),
+            'obs_rms': bench_obs_rms(n_repeats=3 if quick else 10),
+            'refs_stats': bench_refs_stats(n_repeats=1 if quick else 3)}
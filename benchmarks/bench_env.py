@@ -0,0 +1,236 @@
+"""
+Benchmarks of the environment side of the training:
+env startup, raw step rate, VecEnv throughput, reference trajectory access, reward evaluation,
+streaming the trajectories of an evaluation to disk and the headless reference playback.
+"""
+import os, time
+import numpy as np
+from benchmarks.bench_utils import make_env, make_run_config, time_func
+
+
+def bench_env_startup(env_id, n_repeats=3):
+    """ Time to construct the environment including loading the reference trajectories. """
+    def create_and_close():
+        make_env(env_id).close()
+    return time_func(create_and_close, n_repeats=n_repeats, n_warmup=0)
+
+
+def bench_env_step(env_id, n_steps=5000, seed=33):
+    """ Raw step rate of a single environment with random actions
+        including the resets after terminal states. """
+    env = make_env(env_id, seed=seed)
+    env.action_space.seed(seed)
+    actions = [env.action_space.sample() for _ in range(n_steps)]
+    obs = env.reset()
+    n_resets = 0
+    t_start = time.perf_counter()
+    for action in actions:
+        _, _, done, _ = env.step(action)
+        if done:
+            env.reset()
+            n_resets += 1
+    duration = time.perf_counter() - t_start
+
+    # measure the time split between the step phases as well
+    profiler = env.activate_step_profiling()
+    env.reset()
+    for action in actions[:1000]:
+        _, _, done, _ = env.step(action)
+        if done: env.reset()
+    env.close()
+    step_phases_ms = {phase: ms for phase, (ms, _) in profiler.report().items()}
+
+    return {'n_steps': n_steps, 'n_resets': n_resets, 'duration_s': duration,
+            'steps_per_s': n_steps / duration, 'step_phases_ms': step_phases_ms,
+            'obs_dtype': obs.dtype.name}
+
+
+def bench_vec_env(env_id, n_envs_list=(1, 2, 4, 8), n_steps=1000, seed=33):
+    """ Throughput of the normalized (Subproc)VecEnv used during training
+        dependent on the number of parallel environments. """
+    from scripts.common.utils import vec_env
+    results = {}
+    for n_envs in n_envs_list:
+        if n_envs > 1 and n_envs > (os.cpu_count() or 1): continue
+        run_cfg = make_run_config(env_id, n_envs=n_envs)
+        env = vec_env(env_id, num_envs=n_envs, seed=seed, run_cfg=run_cfg)
+        env.reset()
+        rng = np.random.RandomState(seed)
+        actions = rng.normal(0, 0.5, (n_steps, n_envs) + env.action_space.shape)
+        t_start = time.perf_counter()
+        for action in actions:
+            # the VecEnv resets the envs automatically
+            env.step(action)
+        duration = time.perf_counter() - t_start
+        env.close()
+        results[n_envs] = {'duration_s': duration,
+                           'samples_per_s': n_envs * n_steps / duration}
+    return results
+
+
+def bench_refs(env_id, n_calls=20000):
+    """ Access of the reference trajectories required every step. """
+    env = make_env(env_id)
+    env.reset()
+    refs = env.refs
+    calls = {'next': refs.next,
+             'get_ref_kinmeatics': refs.get_ref_kinmeatics,
+             'get_phase_variable': refs.get_phase_variable,
+             'get_step_velocity': refs.get_step_velocity,
+             'is_step_left': refs.is_step_left,
+             'get_random_init_state': refs.get_random_init_state}
+    results = {}
+    for name, func in calls.items():
+        def call_n_times():
+            for _ in range(n_calls): func()
+        stats = time_func(call_n_times, n_repeats=3)
+        results[name] = {'us_per_call': 1e6 * stats['mean_s'] / n_calls}
+
+    # prioritized RSI: sampling and recording the episode outcome are O(log n)
+    refs.activate_adaptive_rsi()
+    def adaptive_init_n_times():
+        for _ in range(n_calls):
+            refs.get_random_init_state()
+            refs.record_rsi_outcome(True)
+    stats = time_func(adaptive_init_n_times, n_repeats=3)
+    results['get_random_init_state_adaptive'] = {'us_per_call': 1e6 * stats['mean_s'] / n_calls}
+    refs.rsi_sampler = None
+
+    # interpolated kinematics at a control frequency that is no divider of 400Hz
+    refs.set_sampling_frequency(120)
+    def next_and_get_n_times():
+        for _ in range(n_calls):
+            refs.next()
+            refs.get_ref_kinmeatics()
+    stats = time_func(next_and_get_n_times, n_repeats=3)
+    results['next_and_get_interpolated_120hz'] = {'us_per_call': 1e6 * stats['mean_s'] / n_calls}
+    env.close()
+    return results
+
+
+def bench_reset(env_id, n_resets=2000, rsi_phase_bins=50):
+    """ Resets with uniform RSI, with RSI snapped to a phase grid restored from cached
+        sim states and with the deterministic evaluation init states (cached as well). """
+    results = {}
+    for name, phase_bins, evaluation in [('rsi_uniform', 0, False),
+                                         (f'rsi_cached_{rsi_phase_bins}_bins', rsi_phase_bins, False),
+                                         ('deterministic_cached', 0, True)]:
+        env = make_env(env_id, make_run_config(env_id, rsi_phase_bins=phase_bins))
+        if evaluation: env.activate_evaluation()
+        env.reset()
+        def reset_n_times():
+            for _ in range(n_resets): env.reset()
+        stats = time_func(reset_n_times, n_repeats=3)
+        results[name] = {'us_per_reset': 1e6 * stats['mean_s'] / n_resets,
+                         'n_cached_states': len(env.unwrapped._init_states_cache)}
+        env.close()
+    return results
+
+
+def bench_reward(env_id, n_calls=5000):
+    """ Evaluation of the imitation reward and the early termination conditions. """
+    env = make_env(env_id)
+    env.reset()
+    results = {}
+    for name, func in {'get_imitation_reward': env.get_imitation_reward,
+                       'do_terminate_early': env.do_terminate_early,
+                       'get_obs': env._obs_fn,
+                       'has_ground_contact': env.has_ground_contact,
+                       'get_ground_reaction_forces': env.get_ground_reaction_forces}.items():
+        def call_n_times():
+            for _ in range(n_calls): func()
+        stats = time_func(call_n_times, n_repeats=3)
+        results[name] = {'us_per_call': 1e6 * stats['mean_s'] / n_calls}
+    env.close()
+    return results
+
+
+def bench_recorder(env_id, n_steps=20000, chunk_size=5000, seed=33):
+    """ Overhead of recording each step and reading the episodes back memory-mapped. """
+    import tempfile
+    from scripts.common.trajec_recorder import TrajecRecorder, TrajecReader
+    env = make_env(env_id, seed=seed)
+    env.action_space.seed(seed)
+    action = env.action_space.sample()
+    env.reset()
+    results = {}
+    for compress in [False, True]:
+        with tempfile.TemporaryDirectory() as dir:
+            recorder = TrajecRecorder(dir, chunk_size=chunk_size, compress=compress)
+            t_start = time.perf_counter()
+            for i_step in range(n_steps):
+                # record the same state, only the recording is timed
+                done = i_step % 500 == 499
+                recorder.record_step(env, action, 1.0, done)
+                if done: recorder.end_episode()
+            recorder.close()
+            record_duration = time.perf_counter() - t_start
+
+            reader = TrajecReader(dir)
+            def read_all_episodes():
+                for i_ep in range(reader.n_episodes):
+                    reader.get_episode('qpos', i_ep)
+            read_stats = time_func(read_all_episodes, n_repeats=3)
+            n_bytes = sum(os.path.getsize(os.path.join(root, file))
+                          for root, _, files in os.walk(dir) for file in files)
+        results['compressed' if compress else 'npy'] = {
+            'us_per_recorded_step': 1e6 * record_duration / n_steps,
+            'ms_read_qpos_all_episodes': 1e3 * read_stats['mean_s'],
+            'bytes_per_step': n_bytes / n_steps}
+    env.close()
+    return results
+
+
+# run config overrides of the walkers actuated by PD position servos
+PD_ENV_CONFIGS = {'MimicWalker2d-v0': dict(env_abbrev='mim2d', env_out_torque=False),
+                  'MimicWalker3d-v0': dict(env_abbrev='mim3d', env_out_torque=False)}
+
+
+def bench_playback(env_id, max_steps=None, gain_scales=(0.5, 1, 1.5, 2), n_workers=4):
+    """
+    Pure simulation throughput without a policy and the tracking quality of the references:
+    kinematic playback, PD tracking with the gains of the MJCF model
+    and PD tracking with scaled gains sequentially and in parallel processes.
+    """
+    from gym_mimic_envs.ref_playback import playback, playback_gain_configs
+    def summary(stats):
+        errors = stats.pop('tracking_error')
+        stats['max_joint_mae'] = max(error['mae'] for error in errors.values())
+        return stats
+
+    results = {}
+    env = make_env(env_id)
+    results['kinematic'] = summary(playback(env.unwrapped, 'kinematic', max_steps))
+    env.close()
+
+    run_cfg = make_run_config(env_id, **PD_ENV_CONFIGS[env_id])
+    env = make_env(env_id, run_cfg)
+    results['pd'] = playback(env.unwrapped, 'pd', max_steps)
+    gains = env.unwrapped.model.actuator_gainprm[:, 0].copy()
+    dampings = env.unwrapped.model.dof_damping[3:].copy()
+    env.close()
+
+    gain_configs = [(scale * gains, dampings) for scale in gain_scales]
+    for name, workers in [('gain_configs_sequential', 1), ('gain_configs_parallel', n_workers)]:
+        t_start = time.perf_counter()
+        stats = playback_gain_configs(run_cfg, gain_configs, max_steps, workers)
+        results[name] = {'duration_s': time.perf_counter() - t_start, 'n_workers': workers,
+                         'configs': {str(scale): summary(config_stats)
+                                     for scale, config_stats in zip(gain_scales, stats)}}
+    return results
+
+
+def run(env_ids=('MimicWalker2d-v0', 'MimicWalker3d-v0'), quick=False):
+    scale = 0.1 if quick else 1
+    results = {}
+    for env_id in env_ids:
+        results[env_id] = {
+            'startup': bench_env_startup(env_id, n_repeats=1 if quick else 3),
+            'step': bench_env_step(env_id, n_steps=int(5000 * scale)),
+            'vec_env': bench_vec_env(env_id, n_steps=int(1000 * scale)),
+            'refs': bench_refs(env_id, n_calls=int(20000 * scale)),
+            'reset': bench_reset(env_id, n_resets=int(2000 * scale)),
+            'reward': bench_reward(env_id, n_calls=int(5000 * scale)),
+            'recorder': bench_recorder(env_id, n_steps=int(20000 * scale)),
+            'playback': bench_playback(env_id, max_steps=2000 if quick else None)}
+    return results
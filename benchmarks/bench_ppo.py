@@ -0,0 +1,181 @@
+"""
+Benchmarks of the learning side of the training:
+experience mirroring, model startup, a single CustomPPO2 update
+and the forward/backward pass of the phase-gated expert networks.
+"""
+import time
+import numpy as np
+from benchmarks.bench_utils import make_run_config, time_func
+
+
+def _fake_rollout(batch_size, obs_dim, act_dim, seed=33, dtype=np.float32):
+    """ Random experiences with the shapes of a CustomPPO2 rollout. """
+    rng = np.random.RandomState(seed)
+    obs = rng.normal(size=(batch_size, obs_dim)).astype(dtype)
+    returns = rng.normal(size=batch_size).astype(dtype)
+    masks = np.zeros(batch_size, dtype=bool)
+    actions = rng.normal(size=(batch_size, act_dim)).astype(dtype)
+    values = rng.normal(size=batch_size).astype(dtype)
+    neglogpacs = rng.normal(size=batch_size).astype(dtype)
+    true_reward = rng.normal(size=batch_size).astype(dtype)
+    return obs, returns, masks, actions, values, neglogpacs, None, [], true_reward
+
+
+def bench_mirror_experiences(env_id, n_repeats=10):
+    from scripts.algos.custom_ppo2 import mirror_experiences
+    run_cfg = make_run_config(env_id)
+    obs_dim, act_dim = (29, 8) if run_cfg.env_is3d else (19, 6)
+    rollout = _fake_rollout(run_cfg.batch_size, obs_dim, act_dim)
+    stats = time_func(lambda: mirror_experiences(rollout, run_cfg=run_cfg), n_repeats=n_repeats)
+    stats['batch_size'] = run_cfg.batch_size
+    return stats
+
+
+def bench_exps_dtype(env_id, n_repeats=10):
+    """
+    Memory and throughput of the rollout to TF boundary with float64 and float32 experiences:
+    size of the mirrored batch, mirroring and feeding all minibatches into a float32 graph.
+    """
+    import tensorflow as tf
+    from scripts.algos.custom_ppo2 import mirror_experiences
+    run_cfg = make_run_config(env_id)
+    obs_dim, act_dim = (29, 8) if run_cfg.env_is3d else (19, 6)
+    mb_size = run_cfg.minibatch_size
+
+    graph = tf.Graph()
+    with graph.as_default():
+        obs_ph = tf.placeholder(tf.float32, [None, obs_dim])
+        acts_ph = tf.placeholder(tf.float32, [None, act_dim])
+        weight = tf.Variable(np.ones((obs_dim, act_dim), dtype=np.float32))
+        loss = tf.reduce_mean(tf.square(tf.matmul(obs_ph, weight) - acts_ph))
+        sess = tf.Session(graph=graph)
+        sess.run(tf.global_variables_initializer())
+
+    results = {}
+    for dtype in [np.float64, np.float32]:
+        rollout = mirror_experiences(_fake_rollout(run_cfg.batch_size, obs_dim, act_dim, dtype=dtype),
+                                     run_cfg=run_cfg)
+        obs, actions = rollout[0], rollout[3]
+        def feed_minibatches():
+            for start in range(0, obs.shape[0], mb_size):
+                sess.run(loss, {obs_ph: obs[start:start + mb_size],
+                                acts_ph: actions[start:start + mb_size]})
+        mirror_stats = time_func(lambda: mirror_experiences(
+            _fake_rollout(run_cfg.batch_size, obs_dim, act_dim, dtype=dtype), run_cfg=run_cfg),
+            n_repeats=n_repeats)
+        results[np.dtype(dtype).name] = {
+            'batch_mbytes': sum(array.nbytes for array in rollout
+                                if isinstance(array, np.ndarray)) / 1e6,
+            'mirror_s': mirror_stats['mean_s'],
+            'feed_s': time_func(feed_minibatches, n_repeats=n_repeats)['mean_s']}
+    sess.close()
+    return results
+
+
+def _create_model(env_id, n_envs):
+    """ Sets up the environments and the model the same way as train.py does. """
+    import tensorflow as tf
+    from scripts.common import config as cfg, utils
+    from scripts.common.policies import CustomPolicy
+    from scripts.algos.custom_ppo2 import CustomPPO2
+
+    run_cfg = make_run_config(env_id, n_envs=n_envs, debug=False, perf_timing=True)
+    env = utils.vec_env(env_id, norm_rew=True, num_envs=n_envs, run_cfg=run_cfg)
+    model = CustomPPO2(CustomPolicy, env, verbose=0, n_steps=int(run_cfg.batch_size/n_envs),
+                       policy_kwargs={'run_cfg': run_cfg}, learning_rate=cfg.lr_start,
+                       ent_coef=cfg.ent_coef, gamma=run_cfg.gamma, noptepochs=cfg.noptepochs,
+                       cliprange=cfg.cliprange, cliprange_vf=cfg.cliprange, run_cfg=run_cfg)
+    return model, env
+
+
+def bench_ppo_update(env_id, n_envs=4):
+    """ Time of model creation and of a single PPO update (rollout + optimization)
+        at the configured batch and minibatch size. """
+    from scripts.common import perf
+
+    t_start = time.perf_counter()
+    model, env = _create_model(env_id, n_envs)
+    startup_duration = time.perf_counter() - t_start
+
+    perf.pop_stats()
+    t_start = time.perf_counter()
+    # a single update as the number of timesteps equals the batch size
+    model.learn(total_timesteps=model.n_batch)
+    update_duration = time.perf_counter() - t_start
+    stats = perf.pop_stats()
+    env.close()
+
+    spans = {name: {'total_s': duration, 'n_calls': count}
+             for name, (duration, count) in stats.items()}
+    return {'n_envs': n_envs, 'batch_size': model.n_batch,
+            'minibatch_size': model.run_cfg.minibatch_size,
+            'model_startup_s': startup_duration, 'update_s': update_duration,
+            'spans': spans}
+
+
+def _phase_masks(batch_size, rng):
+    """ Raw gait phase flags as appended to the observations with MOD_3_PHASES:
+        [left, right, double], mostly single stance. """
+    phases = rng.choice(3, size=batch_size, p=[0.4, 0.4, 0.2])
+    masks = np.zeros((batch_size, 3), dtype=np.float32)
+    masks[np.arange(batch_size), phases] = 1
+    # double stance flags the two single stance experts as well
+    masks[phases == 2, :2] = 1
+    return masks
+
+
+def bench_phase_gating(batch_sizes=(4, 64, 1024), obs_dim=32, n_repeats=20, seed=33):
+    """
+    Forward and backward pass of the phase-gated mixture of 512x2 expert MLPs
+    blending all experts, routing the samples to their experts and with grouped matmuls.
+    Also reports the differences of the outputs and gradients to the blended ones,
+    see benchmarks/checks.py for the asserted equivalence.
+    """
+    import tensorflow as tf
+    from scripts.common import config as cfg
+    from scripts.common.phase_gating import blended_mixture, routed_mixture, grouped_mixture
+    mixtures = {'blended': blended_mixture, 'routed': routed_mixture, 'grouped': grouped_mixture}
+    rng = np.random.RandomState(seed)
+    results = {}
+    for batch_size in batch_sizes:
+        graph = tf.Graph()
+        with graph.as_default():
+            input = tf.placeholder(tf.float32, [None, obs_dim])
+            masks = tf.placeholder(tf.float32, [None, 3])
+            sizes = [obs_dim] + list(cfg.hid_layer_sizes_vf)
+            experts = [[(tf.Variable(rng.normal(0, 0.1, (n_in, n_out)).astype(np.float32)),
+                         tf.Variable(np.zeros(n_out, dtype=np.float32)))
+                        for n_in, n_out in zip(sizes[:-1], sizes[1:])] for _ in range(3)]
+            params = [param for layers in experts for layer in layers for param in layer]
+            fetches = {}
+            for name, mixture in mixtures.items():
+                output = mixture(input, masks, experts, tf.nn.relu)
+                fetches[name] = (output, tf.gradients(tf.reduce_sum(output), params))
+            sess = tf.Session(graph=graph)
+            sess.run(tf.global_variables_initializer())
+        feed = {input: rng.normal(size=(batch_size, obs_dim)).astype(np.float32),
+                masks: _phase_masks(batch_size, rng)}
+
+        out_ref, grads_ref = sess.run(fetches['blended'], feed)
+        results[batch_size] = {}
+        for name, fetch in fetches.items():
+            output, grads = sess.run(fetch, feed)
+            stats = time_func(lambda: sess.run(fetch, feed), n_repeats=n_repeats)
+            stats['max_abs_diff_output'] = float(np.max(np.abs(output - out_ref)))
+            stats['max_abs_diff_grads'] = float(max(np.max(np.abs(grad - grad_ref))
+                                                    for grad, grad_ref in zip(grads, grads_ref)))
+            results[batch_size][name] = stats
+        sess.close()
+    return results
+
+
+def run(env_ids=('MimicWalker3d-v0',), quick=False):
+    results = {}
+    for env_id in env_ids:
+        results[env_id] = {
+            'mirror_experiences': bench_mirror_experiences(env_id, n_repeats=3 if quick else 10),
+            'exps_dtype': bench_exps_dtype(env_id, n_repeats=3 if quick else 10)}
+        if not quick:
+            results[env_id]['ppo_update'] = bench_ppo_update(env_id)
+    results['phase_gating'] = bench_phase_gating(n_repeats=5 if quick else 20)
+    return results
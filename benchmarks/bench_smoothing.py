@@ -0,0 +1,50 @@
+"""
+Benchmarks of the vectorized smoothing against the former pure-Python implementations.
+"""
+import numpy as np
+from benchmarks.bench_utils import time_func
+from scripts.common import smoothing
+
+
+def _smooth_exponential_loop(data, alpha=0.9):
+    """ The former utils.smooth_exponential(), kept as reference. """
+    smoothed = np.copy(data)
+    for t in range(1, len(data)):
+        smoothed[t] = alpha * data[t] + (1-alpha) * smoothed[t-1]
+    return smoothed
+
+
+def bench_smooth_exponential(length=int(1e6), alpha=0.005, n_repeats=5, seed=33):
+    data = np.random.RandomState(seed).normal(size=length)
+    vectorized = time_func(lambda: smoothing.smooth_exponential(data, alpha), n_repeats=n_repeats)
+    loop = time_func(lambda: _smooth_exponential_loop(data, alpha), n_repeats=1, n_warmup=0)
+    max_abs_error = float(np.max(np.abs(smoothing.smooth_exponential(data, alpha)
+                                        - _smooth_exponential_loop(data, alpha))))
+    return {'length': length, 'vectorized': vectorized, 'loop': loop,
+            'speedup': loop['mean_s'] / vectorized['mean_s'],
+            'max_abs_error': max_abs_error}
+
+
+def bench_cumulative_mean(length=int(1e6), n_repeats=5, seed=33):
+    data = np.random.RandomState(seed).normal(size=length)
+    return time_func(lambda: smoothing.cumulative_mean(data), n_repeats=n_repeats)
+
+
+def bench_smoothers(n_values=int(1e5)):
+    """ Per value cost of the stateful smoothers. """
+    values = np.random.RandomState(33).normal(size=n_values).tolist()
+    results = {}
+    for name, smoother in [('ExponentialSmoother', smoothing.ExponentialSmoother(0.25)),
+                           ('RunningMean', smoothing.RunningMean())]:
+        def update_all():
+            for value in values: smoother.update(value)
+        stats = time_func(update_all, n_repeats=3)
+        results[name] = {'us_per_update': 1e6 * stats['mean_s'] / n_values}
+    return results
+
+
+def run(quick=False):
+    length = int(1e5) if quick else int(1e6)
+    return {'smooth_exponential': bench_smooth_exponential(length),
+            'cumulative_mean': bench_cumulative_mean(length),
+            'smoothers': bench_smoothers()}
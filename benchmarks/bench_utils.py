@@ -0,0 +1,81 @@
+"""
+Helpers shared by the benchmarks: timing, machine metadata and saving results as JSON.
+"""
+import os, sys, json, time, platform, subprocess
+import numpy as np
+from os import path
+
+# results are saved here if not specified otherwise
+RESULTS_DIR = path.join(path.dirname(path.abspath(__file__)), 'results')
+
+# run config overrides to create the walker environments outside of the training
+ENV_CONFIGS = {'MimicWalker2d-v0': dict(env_abbrev='mim_trq2d', env_is3d=False, env_out_torque=True),
+               'MimicWalker3d-v0': dict(env_abbrev='mim_trq_ff3d', env_is3d=True, env_out_torque=True)}
+
+
+def make_run_config(env_id, **overrides):
+    """ :returns a RunConfig for the specified walker environment. """
+    from scripts.common import config as cfg
+    params = dict(ENV_CONFIGS[env_id], env_id=env_id)
+    params.update(overrides)
+    return cfg.build_run_config(run_id='bench', **params)
+
+
+def make_env(env_id, run_cfg=None, seed=33):
+    import gym, gym_mimic_envs
+    if run_cfg is None: run_cfg = make_run_config(env_id)
+    env = gym.make(env_id, run_cfg=run_cfg)
+    env.seed(seed)
+    return env
+
+
+def time_func(func, n_repeats=10, n_warmup=1):
+    """ Calls the function n_warmup + n_repeats times
+        and returns statistics of the durations of the last n_repeats calls in seconds. """
+    for _ in range(n_warmup):
+        func()
+    durations = np.zeros(n_repeats)
+    for i in range(n_repeats):
+        t_start = time.perf_counter()
+        func()
+        durations[i] = time.perf_counter() - t_start
+    return {'mean_s': float(np.mean(durations)), 'std_s': float(np.std(durations)),
+            'min_s': float(np.min(durations)), 'median_s': float(np.median(durations)),
+            'n_repeats': n_repeats}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=path.dirname(RESULTS_DIR),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def machine_info():
+    """ Metadata to compare benchmark results across machines and commits. """
+    info = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'git_commit': _git_commit(),
+            'hostname': platform.node(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__}
+    for module in ['scipy', 'gym', 'mujoco_py', 'tensorflow', 'stable_baselines']:
+        try: info[module] = __import__(module).__version__
+        except Exception: info[module] = None
+    return info
+
+
+def save_results(results, name, out_dir=RESULTS_DIR):
+    """ Saves the results together with the machine metadata in a JSON file.
+        :returns the path of the saved file """
+    os.makedirs(out_dir, exist_ok=True)
+    meta = machine_info()
+    file_name = f"{name}_{meta['git_commit'] or 'nogit'}_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    file_path = path.join(out_dir, file_name)
+    with open(file_path, 'w') as file:
+        json.dump({'meta': meta, 'results': results}, file, indent=2)
+    return file_path
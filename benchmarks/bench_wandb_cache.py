@@ -0,0 +1,55 @@
+"""
+Benchmark of fetching wandb run histories with a simulated network latency (FakeApi):
+serial download vs. parallel download into the local cache vs. reading from the cache.
+"""
+import shutil, tempfile, time
+import numpy as np
+from scripts.plots.wandb_api import Api, FakeApi, FakeRun
+
+METRIC_LABELS = ['_det_eval/1. AUC stable walks count', 'rew/1. mean step reward']
+
+
+def _fake_runs(n_runs, n_rows, latency_s, seed=33):
+    rng = np.random.RandomState(seed)
+    return [FakeRun(f'run{i}', 'approach', latency_s=latency_s,
+                    rows=[{'_step': step, **{label: float(rng.normal()) for label in METRIC_LABELS}}
+                          for step in range(n_rows)])
+            for i in range(n_runs)]
+
+
+def bench_fetch(n_runs=12, n_rows=2000, latency_s=0.5):
+    runs = _fake_runs(n_runs, n_rows, latency_s)
+    cache_path = tempfile.mkdtemp() + '/'
+    try:
+        api = Api('bench', api=FakeApi(runs), cache_path=cache_path)
+
+        t_start = time.perf_counter()
+        for run in runs: run.history(samples=int(1e5), pandas=False)
+        serial = time.perf_counter() - t_start
+
+        t_start = time.perf_counter()
+        api.fetch_histories(runs)
+        parallel = time.perf_counter() - t_start
+
+        t_start = time.perf_counter()
+        entries = api.fetch_histories(runs)
+        columns = [entry.get_column(label) for entry in entries for label in METRIC_LABELS]
+        cached = time.perf_counter() - t_start
+
+        # a single run logged new rows: only these are fetched again
+        runs[0].log({label: 1.0 for label in METRIC_LABELS})
+        t_start = time.perf_counter()
+        api.fetch_histories(runs)
+        incremental = time.perf_counter() - t_start
+        n_rows_updated = len(api.cache.get(runs[0].id).get_column(METRIC_LABELS[0]))
+    finally:
+        shutil.rmtree(cache_path)
+
+    return {'n_runs': n_runs, 'n_rows': n_rows, 'latency_s': latency_s,
+            'serial_s': serial, 'parallel_s': parallel, 'cached_s': cached,
+            'incremental_s': incremental, 'n_columns_read': len(columns),
+            'incremental_update_correct': n_rows_updated == n_rows + 1}
+
+
+def run(quick=False):
+    return {'fetch': bench_fetch(latency_s=0.1 if quick else 0.5)}
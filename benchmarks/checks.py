@@ -0,0 +1,136 @@
+"""
+Equivalence checks of the optimized implementations against their reference versions.
+Unlike the benchmarks, which only report the differences, the checks raise an AssertionError
+on the first mismatch and are meant to be run after changing any of the implementations.
+
+Usage (from the project root):
+    python -m benchmarks.checks                 # all checks
+    python -m benchmarks.checks --only smoothing bc_dataset
+"""
+import argparse, os
+
+# check on the CPU only
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+import numpy as np
+
+
+def _random_phase_masks(batch_size, n_experts, rng):
+    """ Random binary flags with at least one active flag per row,
+        so also rows with several active experts (e.g. double stance) are covered. """
+    masks = (rng.uniform(size=(batch_size, n_experts)) < 0.5).astype(np.float64)
+    inactive = np.sum(masks, axis=1) == 0
+    masks[inactive, rng.randint(n_experts, size=np.sum(inactive))] = 1
+    # make sure each combination of two and all flags is present
+    n_fixed = min(batch_size, n_experts + 1)
+    masks[:n_fixed] = 1
+    for k in range(n_fixed - 1):
+        masks[k, k] = 0
+    return masks
+
+
+def check_phase_gating(batch_sizes=(1, 5, 64, 300), obs_dim=12, hid_sizes=(16, 8),
+                       n_experts=3, seed=33, rtol=1e-9, atol=1e-9):
+    """ Routed and grouped mixture (and phase_gated_mixture() with both batch sizes)
+        produce the same outputs and gradients wrt. inputs and parameters
+        as the blended reference on random inputs. """
+    import tensorflow as tf
+    from scripts.common.phase_gating import blended_mixture, routed_mixture, \
+        grouped_mixture, phase_gated_mixture
+    rng = np.random.RandomState(seed)
+    graph = tf.Graph()
+    with graph.as_default():
+        input = tf.placeholder(tf.float64, [None, obs_dim])
+        masks = tf.placeholder(tf.float64, [None, n_experts])
+        sizes = [obs_dim] + list(hid_sizes)
+        experts = [[(tf.Variable(rng.normal(0, 0.5, (n_in, n_out))),
+                     tf.Variable(rng.normal(0, 0.1, n_out)))
+                    for n_in, n_out in zip(sizes[:-1], sizes[1:])] for _ in range(n_experts)]
+        params = [param for layers in experts for layer in layers for param in layer]
+        # non-uniform output weights to not only check the gradients of the sum
+        out_weights = tf.constant(rng.normal(size=(1, hid_sizes[-1])))
+        mixtures = {'blended': blended_mixture, 'routed': routed_mixture,
+                    'grouped': grouped_mixture,
+                    'gated_small': lambda *args: phase_gated_mixture(*args, batch_size=1),
+                    'gated_unknown': lambda *args: phase_gated_mixture(*args)}
+        fetches = {}
+        for name, mixture in mixtures.items():
+            output = mixture(input, masks, experts, tf.nn.tanh)
+            loss = tf.reduce_sum(out_weights * output)
+            fetches[name] = [output] + tf.gradients(loss, [input] + params)
+        with tf.Session(graph=graph) as sess:
+            sess.run(tf.global_variables_initializer())
+            for batch_size in batch_sizes:
+                feed = {input: rng.normal(size=(batch_size, obs_dim)),
+                        masks: _random_phase_masks(batch_size, n_experts, rng)}
+                expected = sess.run(fetches['blended'], feed)
+                for name, fetch in fetches.items():
+                    for label, actual, desired in zip(['output', 'input grad'] +
+                                                      [f'param {i} grad' for i in range(len(params))],
+                                                      sess.run(fetch, feed), expected):
+                        np.testing.assert_allclose(
+                            actual, desired, rtol=rtol, atol=atol,
+                            err_msg=f'{name} mixture, batch size {batch_size}: {label}')
+
+
+def check_smoothing(seed=33, rtol=1e-9, atol=1e-10):
+    """ Vectorized smoothing equals the former loops, also for multi-dimensional data,
+        other axes and integer inputs, and the stateful smoothers match on the same series. """
+    from scripts.common import smoothing
+    from benchmarks.bench_smoothing import _smooth_exponential_loop
+    rng = np.random.RandomState(seed)
+    for alpha in [0.005, 0.25, 0.9, 1.0]:
+        for data in [rng.normal(size=1000), rng.normal(size=(500, 3)),
+                     rng.randint(-10, 10, size=200), rng.normal(size=1), np.zeros(0)]:
+            np.testing.assert_allclose(smoothing.smooth_exponential(data, alpha),
+                                       _smooth_exponential_loop(data.astype(np.float64), alpha),
+                                       rtol=rtol, atol=atol, err_msg=f'alpha {alpha}')
+        data = rng.normal(size=(4, 300))
+        np.testing.assert_allclose(smoothing.smooth_exponential(data, alpha, axis=1),
+                                   _smooth_exponential_loop(data.T, alpha).T,
+                                   rtol=rtol, atol=atol, err_msg=f'alpha {alpha}, axis 1')
+        values = rng.normal(size=300)
+        smoother = smoothing.ExponentialSmoother(alpha)
+        np.testing.assert_allclose([smoother.update(value) for value in values],
+                                   _smooth_exponential_loop(values, alpha),
+                                   rtol=rtol, atol=atol, err_msg=f'ExponentialSmoother {alpha}')
+
+    data = rng.normal(size=(1000, 2))
+    expected = np.array([np.mean(data[:t+1], axis=0) for t in range(len(data))])
+    np.testing.assert_allclose(smoothing.cumulative_mean(data), expected, rtol=rtol, atol=atol)
+    running_mean = smoothing.RunningMean()
+    np.testing.assert_allclose([running_mean.update(value) for value in data[:, 0]],
+                               expected[:, 0], rtol=rtol, atol=atol, err_msg='RunningMean')
+
+
+def check_bc_dataset():
+    """ The vectorized behavior cloning dataset equals the point by point one,
+        with and without the fly mode. Each builder gets its own refs
+        as both change the state of the refs while iterating through them. """
+    from scripts.behavior_cloning import dataset
+    for fly in [False, True]:
+        x_vec, y_vec = dataset.build_data(dataset.get_refs(), fly)
+        x_step, y_step = dataset._get_data_stepwise(dataset.get_refs(), fly)
+        np.testing.assert_array_equal(x_vec, x_step, err_msg=f'x data, fly={fly}')
+        np.testing.assert_array_equal(y_vec, y_step, err_msg=f'y data, fly={fly}')
+
+
+CHECKS = {'phase_gating': check_phase_gating, 'smoothing': check_smoothing,
+          'bc_dataset': check_bc_dataset}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=list(CHECKS), default=list(CHECKS),
+                        help='run only the specified checks')
+    args = parser.parse_args()
+
+    for name in args.only:
+        print(f'Running check: {name}')
+        CHECKS[name]()
+    print('All checks passed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Runs the benchmarks on the CPU and saves the results with machine metadata as JSON
+to track performance regressions across commits.
+
+Usage (from the project root):
+    python -m benchmarks.run                # all benchmarks
+    python -m benchmarks.run --quick        # reduced number of repetitions
+    python -m benchmarks.run --only env ppo smoothing dataset wandb_cache
+"""
+import argparse, os
+
+# benchmark on the CPU only
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+from benchmarks import bench_env, bench_ppo, bench_smoothing, bench_dataset, bench_wandb_cache
+from benchmarks.bench_utils import save_results, RESULTS_DIR
+
+BENCHMARKS = {'env': bench_env.run, 'ppo': bench_ppo.run,
+              'smoothing': bench_smoothing.run, 'dataset': bench_dataset.run,
+              'wandb_cache': bench_wandb_cache.run}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='run only the specified benchmarks')
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer repetitions, skips the PPO update')
+    parser.add_argument('--out', default=RESULTS_DIR, help='directory to save the JSON file in')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only:
+        print(f'Running benchmark: {name}')
+        results[name] = BENCHMARKS[name](quick=args.quick)
+
+    file_path = save_results(results, 'bench', args.out)
+    print('Saved benchmark results to', file_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Ground contact sensing of the walker's feet.
+
+The foot and floor geoms as well as the touch sensors are resolved by their names
+in the MJCF file once. If the model declares a touch sensor for each foot,
+contacts and ground reaction forces are read from the sensor data without iterating
+over the contacts in python. Otherwise the active contacts are checked
+and the forces calculated with mj_contactForce.
+"""
+import numpy as np
+from mujoco_py import functions as mj_functions
+
+# a foot has ground contact when its touch sensor measures a higher normal force [N]
+MIN_CONTACT_FORCE = 1e-3
+
+
+class ContactSensor:
+    def __init__(self, sim, foot_geoms, touch_sensors=None, floor_geom='floor',
+                 three_phases=False, one_hot=False, ground_contact_nns=False):
+        """
+        :param foot_geoms: names of the (left, right) foot geoms
+        :param touch_sensors: names of the (left, right) touch sensors,
+                              the contacts are checked without sensors if None or not in the model
+        :param three_phases, one_hot, ground_contact_nns: encoding of the gait phase,
+                              see get_encoding_table()
+        """
+        self.sim = sim
+        model = sim.model
+        self.floor_id = model.geom_name2id(floor_geom)
+        self.foot_ids = np.array([model.geom_name2id(name) for name in foot_geoms])
+        self.sensor_adrs = None
+        if touch_sensors is not None and all(name in model.sensor_names for name in touch_sensors):
+            self.sensor_adrs = np.array([model.sensor_adr[model.sensor_name2id(name)]
+                                         for name in touch_sensors])
+        self.encodings = get_encoding_table(three_phases, one_hot, ground_contact_nns)
+        self._contact_force = np.zeros(6)
+
+    def get_grfs(self):
+        """ :returns the normal ground reaction forces of the (left, right) foot """
+        if self.sensor_adrs is not None:
+            return self.sim.data.sensordata[self.sensor_adrs]
+        return self._get_contact_grfs()
+
+    def _get_contact_grfs(self):
+        """ Sums the normal forces of all foot-floor contacts calculated with mj_contactForce. """
+        data = self.sim.data
+        grfs = np.zeros(2)
+        for i_contact in range(data.ncon):
+            contact = data.contact[i_contact]
+            if contact.geom1 == self.floor_id: foot_geom = contact.geom2
+            elif contact.geom2 == self.floor_id: foot_geom = contact.geom1
+            else: continue
+            is_foot = self.foot_ids == foot_geom
+            if not is_foot.any(): continue
+            mj_functions.mj_contactForce(self.sim.model, data, i_contact, self._contact_force)
+            # first component is the normal force in the contact frame
+            grfs[is_foot] += np.abs(self._contact_force[0])
+        return grfs
+
+    def get_contacts(self):
+        """ :returns two booleans indicating ground contact of the (left, right) foot """
+        return self.get_grfs() > MIN_CONTACT_FORCE
+
+    def get_encoding(self):
+        """ :returns the gait phase encoding of the current foot contacts (see get_encoding_table) """
+        left, right = self.get_contacts()
+        return self.encodings[int(left) + 2 * int(right)]
+
+
+def get_mirrored_flag_indices(first_index, n_flags):
+    """ :returns the indices of the gait phase flags at first_index in the observations
+                 of the mirrored gait: the left and right flags are swapped """
+    if n_flags == 0: return []
+    return [first_index + 1, first_index] + list(range(first_index + 2, first_index + n_flags))
+
+
+def get_encoding_table(three_phases=False, one_hot=False, ground_contact_nns=False):
+    """
+    Precomputes the encoding of each of the four combinations of left and right foot contact,
+    indexed by left + 2*right.
+    - default: [left, right]
+    - three_phases: [left, right, double stance]
+    - three_phases and one_hot: [left, right, False] or [False, False, True] in double stance
+    - ground_contact_nns: left and right flags are set when both feet have no ground contact
+      to let the left and right foot networks handle this situation
+    """
+    table = []
+    for right in [False, True]:
+        for left in [False, True]:
+            double_stance = left and right
+            encoding = [left, right]
+            if three_phases:
+                if one_hot and double_stance: encoding = [False, False, True]
+                else: encoding += [double_stance and not one_hot]
+            if ground_contact_nns and not (left or right):
+                encoding[0] = encoding[1] = True
+            table.append(encoding)
+    return np.array(table, dtype=bool)
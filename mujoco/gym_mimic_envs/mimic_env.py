@@ -1,20 +1,25 @@
 '''
 Interface for environments using reference trajectories.
 '''
-import gym, mujoco_py
+import gym
 import numpy as np
+from time import perf_counter
 from os.path import join, dirname
 from gym.envs.mujoco.mujoco_env import MujocoEnv
-from scripts import config_light as cfgl
-from scripts.common import config as cfg
-from scripts.common.utils import log, is_remote, \
-    exponential_running_smoothing as smooth, resetExponentialRunningSmoothing as reset_smooth
+from scripts.common import config as cfg, perf
+from scripts.common.utils import log, is_remote
+from scripts.common.smoothing import ExponentialSmoother
 from scripts.mocap.ref_trajecs import ReferenceTrajectories as RefTrajecs
+from scripts.mocap import rsi_sampler
+from gym_mimic_envs.contact_sensing import ContactSensor, get_mirrored_flag_indices
 
 
 
-# flag if ref trajectories are played back
-_play_ref_trajecs = False
+# names of the (left, right) foot touch sensors declared in the MJCF files
+TOUCH_SENSORS = ('touch_left', 'touch_right')
+
+# observations are float32 all the way from the env to the TF feed
+OBS_DTYPE = np.float32
 
 # pause sim on startup to be able to change rendering speed, camera perspective etc.
 pause_mujoco_viewer_on_start = True and not is_remote()
@@ -23,19 +28,48 @@ pause_mujoco_viewer_on_start = True and not is_remote()
 step_count = 0
 ep_dur = 0
 
+
+class StepProfiler:
+    """ Accumulates the time spent in the individual phases of MimicEnv.step().
+        Activate with MimicEnv.activate_step_profiling(). """
+    PHASES = ('rescale', 'simulation', 'refs_next', 'obs', 'reward', 'termination')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.durations = dict.fromkeys(self.PHASES, 0.0)
+        self.n_steps = 0
+
+    def report(self):
+        """:returns a dict mapping each phase to its mean duration per step in ms
+                    and its share of the total step duration. """
+        total = sum(self.durations.values())
+        n_steps = max(1, self.n_steps)
+        return {phase: (1e3 * dur / n_steps, dur / total if total > 0 else 0)
+                for phase, dur in self.durations.items()}
+
+    def __str__(self):
+        lines = [f'{phase:<12} {ms:8.4f} ms  {100*share:5.1f} %'
+                 for phase, (ms, share) in self.report().items()]
+        return f'Step profile over {self.n_steps} steps:\n' + '\n'.join(lines)
+
+
 class MimicEnv(MujocoEnv, gym.utils.EzPickle):
     """ The base class to derive from to train an environment using the DeepMimic Approach."""
-    def __init__(self: MujocoEnv, xml_path, ref_trajecs:RefTrajecs):
+    def __init__(self: MujocoEnv, xml_path, ref_trajecs:RefTrajecs, run_cfg:cfg.RunConfig=None):
         '''@param: self: gym environment class extending the MimicEnv class
            @param: xml_path: path to the mujoco environment XML file
-           @param: ref_trajecs: Instance of the ReferenceTrajectory'''
+           @param: ref_trajecs: Instance of the ReferenceTrajectory
+           @param: run_cfg: configuration of the current run, uses the default config if None'''
 
+        self._cfg = run_cfg if run_cfg is not None else cfg.default_run_config()
         self.refs = ref_trajecs
         # set simulation and control frequency
         self._sim_freq, self._frame_skip = self.get_sim_freq_and_frameskip()
 
         # keep the body in the air for testing purposes
-        self._FLY = False or cfg.is_mod(cfg.MOD_FLY)
+        self._FLY = False or self._cfg.fly
         # when we evaluate a model during or after the training,
         # we might want to weaken ET conditions or monitor and plot data
         self._EVAL_MODEL = False
@@ -45,13 +79,41 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
         # track individual reward components
         self.pos_rew, self.vel_rew, self.com_rew = 0,0,0
         self.mean_epret_smoothed = 0
+        self._epret_smoother = ExponentialSmoother(0.5)
         # track running mean of the return and use it for ET reward
         self.ep_rews = []
+        # parse the reward weights once instead of every step
+        self._rew_weights = [float(digit)/10 for digit in self._cfg.rew_weights]
+        # scale normalized actions with joint peak torques (same for both sides)
+        self._peak_torques = np.array(list(self._cfg.peak_joint_torques) * 2)
+        # is the action space of a 3D walker?
+        self._acts_are_3d = '3d' in self._cfg.env_abbrev or '3pd' in self._cfg.env_abbrev
+        # choose the step functions depending on the active modes once
+        # instead of checking the modes every step
+        self._setup_step_functions()
+        # collects step phase durations when profiling is activated
+        self.step_profiler = None
+        self._profile_steps = False
+        # created after the initial step of MujocoEnv.__init__()
+        self.contacts = None
+        # raw gait phase flags appended to the observations
+        self._n_phase_flags = self._cfg.n_phase_flags
+        # simulation states after initializing at a reference position, (i_step, pos) -> MjSimState
+        self._init_states_cache = {}
+        if self._cfg.adaptive_rsi:
+            self.refs.activate_adaptive_rsi(self._cfg.rsi_phase_bins or rsi_sampler.N_PHASE_BINS,
+                                            self._cfg.rsi_uniform_mix)
+        if self._cfg.perf_timing:
+            perf.enable()
+            self.activate_step_profiling()
 
         # initialize Mujoco Environment
         MujocoEnv.__init__(self, xml_path, self._frame_skip)
         # init EzPickle (think it is required to be able to save and load models)
-        gym.utils.EzPickle.__init__(self)
+        gym.utils.EzPickle.__init__(self, run_cfg)
+        # the runner allocates its observation buffers with the dtype of the observation space
+        assert self.observation_space.dtype == OBS_DTYPE, \
+            f'Observation space has dtype {self.observation_space.dtype} instead of {OBS_DTYPE}'
         # make sure simulation and control run at the desired frequency
         self.model.opt.timestep = 1 / self._sim_freq
         self.control_freq = self._sim_freq / self._frame_skip
@@ -59,10 +121,113 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
         self.refs.set_sampling_frequency(self.control_freq)
         # The motor torque ranges should always be specified in the config file
         # and overwrite the forcerange in the .MJCF file
-        self.model.actuator_forcerange[:, :] = cfg.TORQUE_RANGES
+        self.model.actuator_forcerange[:, :] = self._cfg.torque_ranges
+        # foot contacts and ground reaction forces, geoms and sensors resolved by their names
+        self.contacts = ContactSensor(self.sim, self._get_foot_geom_names(), TOUCH_SENSORS,
+                                      three_phases=self._cfg.three_phases,
+                                      one_hot=self._cfg.grnd_contact_one_hot,
+                                      ground_contact_nns=self._cfg.ground_contact_nns)
+
+
+    def _setup_step_functions(self):
+        """ Selects the specialised functions to rescale the actions and
+            to get the observations based on the modes of the run config.
+            Only private names are assigned, overriding methods in subclasses still works. """
+        if self._cfg.env_out_torque:
+            self._rescale_fn = self._rescale_torques
+        elif self._cfg.pi_out_deltas:
+            self._rescale_fn = self._rescale_qpos_deltas
+        else:
+            self._rescale_fn = self._rescale_qpos_targets
+
+        # when we're mirroring the policy (phase based mirroring),
+        # mirror the actions and observations during the left step
+        if self._cfg.mirr_phase:
+            self._prepare_action = self._rescale_and_mirror_action
+            self._obs_fn = self._get_mirrored_obs
+        else:
+            self._prepare_action = self.rescale_actions
+            self._obs_fn = self._get_obs
+
+        # the COM height is needed every step
+        self._com_z_index = self._get_COM_indices()[-1]
 
 
     def step(self, action):
+        if self._profile_steps: return self._step_profiled(action)
+        self._before_step()
+
+        action = self._prepare_action(action)
+
+        # execute simulation with desired action for multiple steps
+        self.do_simulation(action, self._frame_skip)
+
+        # increment the current position on the reference trajectories
+        self.refs.next()
+
+        # get state observation after simulation step
+        obs = self._obs_fn()
+
+        # get imitation reward
+        reward = self.get_imitation_reward()
+
+        reward, done = self._check_termination(reward)
+        return obs, reward, done, {}
+
+
+    def _step_profiled(self, action):
+        """ Same as step() but measures the duration of each step phase. """
+        self._before_step()
+        durs = self.step_profiler.durations
+
+        t0 = perf_counter()
+        action = self._prepare_action(action)
+        t1 = perf_counter()
+        self.do_simulation(action, self._frame_skip)
+        t2 = perf_counter()
+        self.refs.next()
+        t3 = perf_counter()
+        obs = self._obs_fn()
+        t4 = perf_counter()
+        reward = self.get_imitation_reward()
+        t5 = perf_counter()
+        reward, done = self._check_termination(reward)
+        t6 = perf_counter()
+
+        durs['rescale'] += t1 - t0
+        durs['simulation'] += t2 - t1
+        durs['refs_next'] += t3 - t2
+        durs['obs'] += t4 - t3
+        durs['reward'] += t5 - t4
+        durs['termination'] += t6 - t5
+        self.step_profiler.n_steps += 1
+
+        return obs, reward, done, {}
+
+
+    def activate_step_profiling(self, profiler:StepProfiler=None):
+        """ Measures the duration of the step phases from now on.
+            :returns the StepProfiler collecting the durations """
+        self.step_profiler = profiler if profiler is not None else StepProfiler()
+        self._profile_steps = True
+        return self.step_profiler
+
+    def deactivate_step_profiling(self):
+        self._profile_steps = False
+        return self.step_profiler
+
+    def get_perf_stats(self):
+        """ :returns the timing statistics collected in this (sub)process
+                     since the last call, including the step phases. """
+        profiler = self.step_profiler
+        if profiler is not None and profiler.n_steps > 0:
+            for phase, duration in profiler.durations.items():
+                perf.add('env/' + phase, duration, profiler.n_steps)
+            profiler.reset()
+        return perf.pop_stats()
+
+
+    def _before_step(self):
         # when rendering: pause sim on startup to change rendering speed, camera perspective etc.
         global pause_mujoco_viewer_on_start
         if pause_mujoco_viewer_on_start:
@@ -86,29 +251,16 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
             qvel_set[[0, 1, 2, ]] = [0, 0, 0]
             self.set_joint_kinematics_in_sim(qpos_set, qvel_set)
 
-        action = self.rescale_actions(action)
-
-        # when we're mirroring the policy (phase based mirroring), mirror the action
-        if cfg.is_mod(cfg.MOD_MIRR_PHASE) and self.refs.is_step_left():
-            action = self.mirror_action(action)
-
-        # execute simulation with desired action for multiple steps
-        self.do_simulation(action, self._frame_skip)
-
-        # increment the current position on the reference trajectories
-        self.refs.next()
 
-        # get state observation after simulation step
-        obs = self._get_obs()
-
-        # get imitation reward
-        reward = self.get_imitation_reward()
-
-        # check if we entered a terminal state
-        com_z_pos = self.sim.data.qpos[self._get_COM_indices()[-1]]
+    def _check_termination(self, reward):
+        """ Checks if we entered a terminal state and adjusts the reward accordingly.
+            :returns reward, done """
+        global ep_dur
+        com_z_pos = self.sim.data.qpos[self._com_z_index]
         walked_distance = self.sim.data.qpos[0]
         # was max episode duration or max walking distance reached?
-        max_eplen_reached = ep_dur >= cfg.ep_dur_max or walked_distance > cfg.max_distance + 0.01
+        max_eplen_reached = ep_dur >= self._cfg.ep_dur_max \
+                            or walked_distance > self._cfg.max_distance + 0.01
         # terminate the episode?
         done = com_z_pos < 0.5 or max_eplen_reached
 
@@ -117,6 +269,7 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
         else:
             terminate_early, _, _, _ = self.do_terminate_early()
             done = done or terminate_early
+            if done: self.refs.record_rsi_outcome(not max_eplen_reached)
             if done:
                 # if episode finished, recalculate the reward
                 # to punish falling hard and rewarding reaching episode's end a lot
@@ -125,16 +278,16 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
         # reset episode duration if episode has finished
         if done: ep_dur = 0
         # add alive bonus else
-        else: reward += cfg.alive_bonus
+        else: reward += self._cfg.alive_bonus
 
-        return obs, reward, done, {}
+        return reward, done
 
 
     def get_ET_reward(self, max_eplen_reached, terminate_early):
         """ Punish falling hard and reward reaching episode's end a lot. """
 
         # calculate a running mean of the ep_return
-        self.mean_epret_smoothed = smooth('mimic_env_epret', np.sum(self.ep_rews), 0.5)
+        self.mean_epret_smoothed = self._epret_smoother.update(np.sum(self.ep_rews))
         self.ep_rews = []
 
         # reward reaching the end of the episode without falling
@@ -142,7 +295,7 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
         if max_eplen_reached:
             # estimate future cumulative reward expecting getting the mean reward per step
             mean_step_rew = self.mean_epret_smoothed / ep_dur
-            act_ret_est = np.sum(mean_step_rew * np.power(cfg.gamma, np.arange(ep_dur)))
+            act_ret_est = np.sum(mean_step_rew * np.power(self._cfg.gamma, np.arange(ep_dur)))
             reward = act_ret_est
         # punish for ending the episode early
         else:
@@ -153,26 +306,35 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
 
     def rescale_actions(self, a):
         """Policy samples actions from normal Gaussian distribution around 0 with init std of 0.5.
-           In this method, we rescale the actions to the actual action ranges."""
+           In this method, we rescale the actions to the actual action ranges
+           with the _rescale_* method chosen in _setup_step_functions()."""
+        return self._rescale_fn(a)
+
+    def _rescale_torques(self, a):
         # policy outputs (normalized) joint torques
-        if cfg.env_out_torque:
-            # clip the actions to the range of [-1,1]
-            a = np.clip(a, -1, 1)
-            # scale the actions with joint peak torques
-            # *2: peak torques are the same for both sides
-            a *= cfgl.PEAK_JOINT_TORQUES * 2
+        # clip the actions to the range of [-1,1]
+        a = np.clip(a, -1, 1)
+        # scale the actions with joint peak torques
+        a *= self._peak_torques
+        return a
+
+    def _rescale_qpos_deltas(self, a):
+        # policy outputs deltas to the current angles for PD position controllers
+        # qpos of actuated joints
+        qpos_act_before_step = self.get_qpos(True, True)
+        # unnormalize the normalized deltas
+        a *= self.get_max_qpos_deltas()
+        # add the deltas to current position
+        return qpos_act_before_step + a
 
+    def _rescale_qpos_targets(self, a):
         # policy outputs target angles for PD position controllers
-        else:
-            if cfg.is_mod(cfg.MOD_PI_OUT_DELTAS):
-                # qpos of actuated joints
-                qpos_act_before_step = self.get_qpos(True, True)
-                # unnormalize the normalized deltas
-                a *= self.get_max_qpos_deltas()
-                # add the deltas to current position
-                a = qpos_act_before_step + a
         return a
 
+    def _rescale_and_mirror_action(self, a):
+        a = self.rescale_actions(a)
+        return self.mirror_action(a) if self.refs.is_step_left() else a
+
 
 
     def get_sim_freq_and_frameskip(self):
@@ -180,12 +342,13 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
         What is the frequency the simulation is running at
         and how many frames should be skipped during step(action)?
         """
-        skip_n_frames = cfg.SIM_FREQ/cfg.CTRL_FREQ
+        sim_freq, ctrl_freq = self._cfg.sim_freq, self._cfg.ctrl_freq
+        skip_n_frames = sim_freq/ctrl_freq
         assert skip_n_frames.is_integer(), \
             f"Please check the simulation and control frequency in the config! " \
             f"The simulation frequency should be an integer multiple of the control frequency." \
-            f"Your simulation frequency is {cfg.SIM_FREQ} and control frequency is {cfg.CTRL_FREQ}"
-        return cfg.SIM_FREQ, int(skip_n_frames)
+            f"Your simulation frequency is {sim_freq} and control frequency is {ctrl_freq}"
+        return sim_freq, int(skip_n_frames)
 
     def get_joint_kinematics(self, exclude_com=False, concat=False):
         '''Returns qpos and qvel of the agent.'''
@@ -257,90 +420,22 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
         return max_qpos_deltas
 
 
-    def playback_ref_trajectories(self, timesteps=2000, pd_pos_control=False):
-        global _play_ref_trajecs
-        _play_ref_trajecs = True
-
-        from gym_mimic_envs.monitor import Monitor
-        env = Monitor(self)
-
-        env.reset()
-        if pd_pos_control:
-            for i in range(timesteps):
-                # hold com x and z position and trunk rotation constant
-                FLIGHT = self._FLY
-                ignore_not_actuated_joints = True and not FLIGHT
-
-                if not ignore_not_actuated_joints:
-                    # position servos do not actuate all joints
-                    # for those joints, we still have to set the joint positions by hand
-                    ref_qpos = self.get_ref_qpos()
-                    ref_qvel = self.get_ref_qvel()
-                    qpos = self.get_qpos()
-                    qvel = self.get_qvel()
-
-                    if FLIGHT:
-                        ref_qpos[[0,1,2]] = [0, 1.5, 0]
-                        qvel[[0,1]] = 0
-                    # set the not actuated joint position from refs
-                    not_actuated_is = self._get_not_actuated_joint_indices()
-                    qpos[not_actuated_is] = ref_qpos[not_actuated_is]
-                    qvel[not_actuated_is] = ref_qvel[not_actuated_is]
-                    self.set_joint_kinematics_in_sim(qpos, qvel)
-
-                    # self.sim.data.qvel[:] = 0
-                    # fix all other joints to focus tuning control gains of a single joint pair
-                    # self.sim.data.qpos[[0, 2, 3, 4, 6, 7]] = 0
-                    # self.sim.data.qvel[[0, 2, 3, 4, 6, 7]] = 0
-
-                # follow desired trajecs
-                des_qpos = self.get_ref_qpos(exclude_not_actuated_joints=True)
-                # des_qpos[0] = 0
-                # des_qpos[1] = 0.4
-                # if i % 60 == 0:
-                #     self.reset()
-                if FLIGHT:
-                    self.sim.data.qpos[[0, 1, 2]] = [0, 1.5, 0]
-                    self.sim.data.qvel[[0, 1, 2]] = 0
-                obs, reward, done, _ = env.step(des_qpos)
-                # obs, reward, done, _ = self.step(np.ones_like(des_qpos)*(0))
-                # ankle tune:
-                # obs, reward, done, _ = self.step([0, 0, -0.3, 0, 0, -0.3])
-                # knee tune:
-                # obs, reward, done, _ = self.step([0, 0.2, 0, 0, 0.2, 0])
-                # obs, reward, done, _ = self.step([-0.5, 1, -.2, -0.5, 1, -.2])
-                self.render()
-                if done:
-                    self.reset()
-        else:
-            for i in range(timesteps):
-                self.refs.next()
-                ZERO_INPUTS = False
-                if ZERO_INPUTS:
-                    qpos, qvel = self.get_joint_kinematics()
-                    qpos= np.zeros_like(qpos)
-                    qvel = np.zeros_like(qvel)
-                    self.set_joint_kinematics_in_sim(qpos, qvel)
-                else:
-                    self.set_joint_kinematics_in_sim()
-                # self.step(np.zeros_like(self.action_space.sample()))
-                self.sim.forward()
-                self.render()
-
-        _play_ref_trajecs = False
-        self.close()
-        raise SystemExit('Environment intentionally closed after playing back trajectories.')
+    def playback_ref_trajectories(self, timesteps=2000, pd_pos_control=False, render=False):
+        """ Plays the reference trajectories back kinematically or tracks them with the PD servos.
+            :returns the tracking and reward statistics, see gym_mimic_envs.ref_playback """
+        from gym_mimic_envs.ref_playback import playback
+        return playback(self, 'pd' if pd_pos_control else 'kinematic', timesteps, render)
 
 
     def set_joint_kinematics_in_sim(self, qpos=None, qvel=None):
         """ Specify the desired qpos and qvel and do a forward step in the simulation
             to set the specified qpos and qvel values. """
-        old_state = self.sim.get_state()
         if qpos is None or qvel is None:
             qpos, qvel = self.refs.get_ref_kinmeatics()
-        new_state = mujoco_py.MjSimState(old_state.time, qpos, qvel,
-                                         old_state.act, old_state.udd_state)
-        self.sim.set_state(new_state)
+        # same as setting a new MjSimState with the old time, act and udd_state
+        # but without allocating the state object every call
+        self.sim.data.qpos[:] = qpos
+        self.sim.data.qvel[:] = qvel
 
     def activate_speed_control(self, desired_walking_speeds):
         self.FOLLOW_DESIRED_SPEED_PROFILE = True
@@ -365,16 +460,23 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
         phase = self.refs.get_phase_variable()
 
         obs = np.concatenate([np.array([phase, self.desired_walking_speed]), qpos, qvel]).ravel()
-
+        if self._n_phase_flags:
+            # gate the expert networks of the policy, the contacts are unknown during construction
+            phase_flags = self.has_ground_contact() if self.contacts is not None \
+                else np.zeros(self._n_phase_flags)
+            obs = np.concatenate([obs, phase_flags])
+        return obs.astype(OBS_DTYPE)
+
+    def _get_mirrored_obs(self):
+        obs = self._get_obs()
         # when we mirror the policy (phase based mirr), mirror left step
-        if cfg.is_mod(cfg.MOD_MIRR_PHASE) and self.refs.is_step_left():
+        if self.refs.is_step_left():
             obs = self.mirror_obs(obs)
-
         return obs
 
 
     def mirror_obs(self, obs):
-        is3d = cfg.IS3D
+        is3d = self._cfg.env_is3d
         if is3d:
             # 3D Walker obs indices:
             #           0: phase, 1: des_vel, 2: com_y, 3: com_z,
@@ -405,6 +507,8 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
             #           16: hip_vel_l, 17: knee_vel_l, 18: ankle_vel_l
             mirred_obs_indices = [0, 1, 2, 3, 7, 8, 9, 4, 5, 6,
                                   10, 11, 12, 16, 17, 18, 13, 14, 15]
+        # swap the left and right gait phase flags at the end of the observations
+        mirred_obs_indices += get_mirrored_flag_indices(len(mirred_obs_indices), self._n_phase_flags)
 
         obs_mirred = obs[mirred_obs_indices]
 
@@ -415,7 +519,7 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
 
 
     def mirror_action(self, acts):
-        is3d = '3d' in cfg.env_abbrev or '3pd' in cfg.env_abbrev
+        is3d = self._acts_are_3d
         if is3d:
             mirred_acts_indices = [4, 5, 6, 7, 0, 1, 2, 3]
             # some observations and actions retain the same absolute value but change the sign
@@ -437,28 +541,65 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
 
 
     def reset_model(self):
-
-        qpos, qvel = self.get_init_state(not self.is_evaluation_on() and not self.FOLLOW_DESIRED_SPEED_PROFILE)
-        self.set_state(qpos, qvel)
-
-        # sanity check: reward should be around 1 after initialization
-        rew = self.get_imitation_reward()
-        assert (rew > 0.95 * cfg.rew_scale) if not self._FLY else 0.5, \
-            f"Reward should be around 1 after RSI, but was {rew}!"
+        random_init = not self.is_evaluation_on() and not self.FOLLOW_DESIRED_SPEED_PROFILE
+        n_phase_bins = self._cfg.rsi_phase_bins
+        if random_init:
+            init_key = self.refs.set_random_init_position(n_phase_bins)
+        else:
+            init_key = self.refs.set_deterministic_init_position()
+        # uniform RSI samples too many positions to cache them
+        cacheable = not random_init or n_phase_bins > 0
+        init_state = self._init_states_cache.get(init_key) if cacheable else None
+
+        if init_state is None:
+            self.set_state(self.refs.get_qpos(), self.refs.get_qvel())
+            # check each cached state once
+            if cacheable or self._cfg.debug: self._check_init_state()
+            if cacheable: self._init_states_cache[init_key] = self.sim.get_state()
+        else:
+            # restore the cached state and recompute the forward kinematics,
+            # the cached MjSimState also contains the sim time: keep the time of this reset
+            sim_time = self.sim.data.time
+            self.sim.set_state(init_state)
+            self.sim.data.time = sim_time
+            self.sim.forward()
+            if self._cfg.debug: self._check_init_state()
 
         # set the reference trajectories to the next state,
         # otherwise the first step after initialization has always zero error
         self.refs.next()
 
         # get and return current observations
-        obs = self._get_obs()
+        obs = self._obs_fn()
         return obs
 
 
+    def pop_rsi_counts(self):
+        """ :returns the adaptive RSI counts (n_inits, n_ets) recorded since the last call
+                     or None if adaptive RSI is not active """
+        if self.refs.rsi_sampler is None: return None
+        return self.refs.rsi_sampler.pop_new_counts()
+
+    def get_rsi_distribution(self):
+        """ :returns the adaptive RSI probabilities (n_steps, n_phase_bins) or None if inactive """
+        if self.refs.rsi_sampler is None: return None
+        return self.refs.rsi_sampler.get_distribution()
+
+    def set_rsi_counts(self, n_inits, n_ets):
+        """ Sets the adaptive RSI counts merged from all environments. """
+        if self.refs.rsi_sampler is not None:
+            self.refs.rsi_sampler.set_counts(n_inits, n_ets)
+
+    def _check_init_state(self):
+        """ Sanity check: reward should be around 1 after initialization. """
+        rew = self.get_imitation_reward()
+        assert self._FLY or rew > 0.95 * self._cfg.rew_scale, \
+            f"Reward should be around 1 after RSI, but was {rew}!"
+
     def get_init_state(self, random=True):
         ''' Random State Initialization:
             @returns: qpos and qvel of a random step at a random position'''
-        return self.refs.get_random_init_state() if random \
+        return self.refs.get_random_init_state(self._cfg.rsi_phase_bins) if random \
             else self.refs.get_deterministic_init_state()
 
 
@@ -522,10 +663,7 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
     def get_imitation_reward(self):
         """ DeepMimic imitation reward function """
 
-        # get rew weights from rew_weights_string
-        weights = [float(digit)/10 for digit in cfg.rew_weights]
-
-        w_pos, w_vel, w_com, w_pow = weights
+        w_pos, w_vel, w_com, w_pow = self._rew_weights
         pos_rew = self.get_pose_reward()
         vel_rew = self.get_vel_reward()
         com_rew = self.get_com_reward()
@@ -533,12 +671,12 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
 
         self.pos_rew, self.vel_rew, self.com_rew = pos_rew, vel_rew, com_rew
 
-        if cfg.is_mod(cfg.MOD_REW_MULT):
+        if self._cfg.rew_mult:
             imit_rew = np.sqrt(pos_rew) * np.sqrt(com_rew) # * vel_rew**w_vel
         else:
             imit_rew = w_pos * pos_rew + w_vel * vel_rew + w_com * com_rew + w_pow * pow_rew
 
-        return imit_rew * cfg.rew_scale
+        return imit_rew * self._cfg.rew_scale
 
 
     def do_terminate_early(self):
@@ -548,9 +686,6 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
         - does the characters COM in Z direction is below a certain point
         - does the characters COM in Y direction deviated from straight walking
         """
-        if _play_ref_trajecs:
-            return False
-
         qpos = self.get_qpos()
         ref_qpos = self.refs.get_qpos()
         com_indices = self._get_COM_indices()
@@ -639,9 +774,23 @@ class MimicEnv(MujocoEnv, gym.utils.EzPickle):
         raise NotImplementedError
 
 
+    def _get_foot_geom_names(self):
+        """
+        :returns: the names of the left and right foot geoms in the MJCF file.
+        Example: ('foot_left_geom', 'foot_geom')
+        """
+        raise NotImplementedError
+
+
     def has_ground_contact(self):
         """
         :returns: two booleans indicating ground contact of left and right foot.
         Example: [True, False] means left foot has ground contact, [True, True] indicates double stance.
+        With MOD_3_PHASES, a third boolean indicates double stance (see contact_sensing.py).
         """
-        raise NotImplementedError
+        return self.contacts.get_encoding()
+
+
+    def get_ground_reaction_forces(self):
+        """ :returns the normal ground reaction forces of the left and right foot in N """
+        return self.contacts.get_grfs()
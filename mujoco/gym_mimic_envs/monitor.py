@@ -1,8 +1,11 @@
-import gym
+import gym, os
 import numpy as np
-import seaborn as sns
-from scripts.common.utils import config_pyplot, is_remote, \
-    exponential_running_smoothing as smooth, change_plot_properties
+from scripts.common import perf
+from scripts.common.utils import is_remote, show_plot
+from scripts.plots.trajecs import plot_sim_ref_trajecs, save_trajecs_buffers, get_dump_path
+from scripts.common.smoothing import ExponentialSmoother
+from scripts.common.trajec_recorder import TrajecRecorder
+from scripts.mocap.ref_stats import load_distributions, get_phase_bin
 from gym_mimic_envs.mimic_env import MimicEnv
 from stable_baselines.common.vec_env import DummyVecEnv, SubprocVecEnv, VecNormalize
 
@@ -10,6 +13,8 @@ from stable_baselines.common.vec_env import DummyVecEnv, SubprocVecEnv, VecNorma
 _trajec_buffer_length = 2000
 
 PLOT_REF_DISTRIB =  False
+# show the gains of the PD controllers in the trajectory comparison and exit after it
+PD_TUNING = False
 
 class Monitor(gym.Wrapper):
 
@@ -36,11 +41,19 @@ class Monitor(gym.Wrapper):
         self.num_actions = self.env.action_space.high.size
         # do we want to control walking speed
         self.SPEED_CONTROL = False
+        # streams the trajectories to disk, see activate_recording()
+        self.recorder = None
 
         self.setup_containers()
 
-        self.plt = config_pyplot(fig_size=True, font_size=12,
-                                 tick_size=12, legend_fontsize=16)
+    def activate_recording(self, dir, **recorder_kwargs):
+        """ Records the sim and ref kinematics, actions, torques, rewards, contacts and dones
+            of all following steps in a chunked recording (see scripts.common.trajec_recorder). """
+        # required to play the recorded kinematics back in the same model, see scripts.plots.videos
+        recorder_kwargs.setdefault('meta', {'env_id': self.env.spec.id if self.env.spec else None,
+                                            'control_freq': self.env.control_freq})
+        self.recorder = TrajecRecorder(dir, **recorder_kwargs)
+        return self.recorder
 
     def activate_speed_control(self, speeds):
         """TODO: Work in progress. Build desired speed trajectory from speeds.
@@ -55,7 +68,15 @@ class Monitor(gym.Wrapper):
         desired_walking_speeds = np.concatenate((desired_walking_speeds, desired_walking_speeds, desired_walking_speeds))
         self.env.activate_speed_control(desired_walking_speeds)
 
+    def _smooth(self, label, new_value, alpha=0.9):
+        """ Exponential running smoothing of the episode statistics of this env. """
+        if label not in self.smoothers:
+            self.smoothers[label] = ExponentialSmoother(alpha)
+        return self.smoothers[label].update(new_value)
+
     def setup_containers(self):
+        # exponential smoothers of the episode statistics
+        self.smoothers = {}
         self.ep_len = 0
         self.reward = 0
         self.ep_len_smoothed = 0
@@ -100,7 +121,26 @@ class Monitor(gym.Wrapper):
 
     def step(self, action):
         obs, reward, done, _ = self.env.step(action)
+        with perf.span('env/monitor'):
+            self._track_step(action, reward, done)
+            if self.recorder is not None:
+                self.recorder.record_step(self.env, action, reward, done)
+        return obs, reward, done, _
+
+    def reset(self, **kwargs):
+        # episodes also end when they are reset before a terminal state
+        if self.recorder is not None:
+            self.recorder.end_episode()
+        return self.env.reset(**kwargs)
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        return super(Monitor, self).close()
+
 
+    def _track_step(self, action, reward, done):
+        """ Bookkeeping of episode statistics and buffers for plotting. """
         if self.ep_len == 0:
             self.init_phase = self.env.refs.get_phase_variable()
             self.rsi_phases.append(self.init_phase)
@@ -121,28 +161,28 @@ class Monitor(gym.Wrapper):
 
             ep_rewards = self.rewards[-self.ep_len:]
             mean_reward = np.mean(ep_rewards[:-1])
-            self.mean_reward_smoothed = smooth('rew', mean_reward)
-            self.mean_ep_pos_rew_smoothed = smooth('ep_pos_rew', np.mean(self.ep_pos_rews))
-            self.mean_ep_vel_rew_smoothed = smooth('ep_vel_rew', np.mean(self.ep_vel_rews))
-            self.mean_ep_com_rew_smoothed = smooth('ep_com_rew', np.mean(self.ep_com_rews))
+            self.mean_reward_smoothed = self._smooth('rew', mean_reward)
+            self.mean_ep_pos_rew_smoothed = self._smooth('ep_pos_rew', np.mean(self.ep_pos_rews))
+            self.mean_ep_vel_rew_smoothed = self._smooth('ep_vel_rew', np.mean(self.ep_vel_rews))
+            self.mean_ep_com_rew_smoothed = self._smooth('ep_com_rew', np.mean(self.ep_com_rews))
 
             ep_return = np.sum(ep_rewards)
             self.returns.append(ep_return)
-            self.ep_ret_smoothed = smooth('ep_ret', ep_return, 0.25)
+            self.ep_ret_smoothed = self._smooth('ep_ret', ep_return, 0.25)
 
             self.ep_lens.append(self.ep_len)
-            self.ep_len_smoothed = smooth('ep_len', self.ep_len, 0.75)
+            self.ep_len_smoothed = self._smooth('ep_len', self.ep_len, 0.75)
             if self.ep_len < self.ep_len_smoothed*0.75:
                 self.difficult_rsi_phases.append(self.init_phase)
             self.ep_len = 0
 
 
-            self.moved_distance_smooth = smooth('dist', self.env.data.qpos[0], 0.25)
+            self.moved_distance_smooth = self._smooth('dist', self.env.data.qpos[0], 0.25)
 
             self.mean_abs_ep_torque_smoothed = \
-                smooth('mean_ep_tor', np.mean(self.ep_torques_abs), 0.75)
+                self._smooth('mean_ep_tor', np.mean(self.ep_torques_abs), 0.75)
             self.median_abs_torque_smoothed = \
-                smooth('med_ep_tor', np.median(self.ep_torques_abs), 0.75)
+                self._smooth('med_ep_tor', np.median(self.ep_torques_abs), 0.75)
             self.ep_torques_abs = []
 
 
@@ -161,20 +201,20 @@ class Monitor(gym.Wrapper):
                 # load trajectory distributions if not done already
                 if self.left_step_distrib is None:
                     from scripts.common import config as cfg
-                    npz = np.load(cfg.abs_project_path +
+                    distribs = load_distributions(cfg.abs_project_path +
                                   'assets/ref_trajecs/distributions/2d_distributions_const_speed_400hz.npz')
-                    self.left_step_distrib = [npz['means_left'], npz['stds_left']]
-                    self.right_step_distrib = [npz['means_right'], npz['stds_right']]
-                    self.step_len = min(self.left_step_distrib[0].shape[1], self.right_step_distrib[0].shape[1])
+                    self.left_step_distrib = [distribs['means_left'], distribs['stds_left']]
+                    self.right_step_distrib = [distribs['means_right'], distribs['stds_right']]
+                    self.n_phase_bins = min(self.left_step_distrib[0].shape[1], self.right_step_distrib[0].shape[1])
 
                 # left and right step distributions are different
                 step_dist = self.left_step_distrib if self.refs.is_step_left() else self.right_step_distrib
 
                 # get current mean on the mocap distribution, exlude com_x_pos
-                pos = min(self.refs._pos, self.step_len - 1)
-                mean_state = step_dist[0][:, pos]
+                i_bin = get_phase_bin(self.refs.get_phase_variable(), self.n_phase_bins)
+                mean_state = step_dist[0][:, i_bin]
                 # terminate if distance is too big
-                std_state = 3 * step_dist[1][:, pos]
+                std_state = 3 * step_dist[1][:, i_bin]
                 self.trajecs_buffer[2, :, -1] = mean_state
                 self.trajecs_buffer[3, :, -1] = std_state
 
@@ -195,185 +235,49 @@ class Monitor(gym.Wrapper):
             try: self.trajecs_recorded += 1
             except: self.trajecs_recorded = 1
             if self.trajecs_recorded % (1 * _trajec_buffer_length) == 0:
-                self.compare_sim_ref_trajecs()
-
-        return obs, reward, done, _
+                # evaluation waits for the figure, training only dumps the buffers
+                # to not block the env step, render them with scripts.plots.render
+                if self.env.is_evaluation_on() or PD_TUNING:
+                    self.compare_sim_ref_trajecs()
+                else:
+                    self.dump_trajecs_buffers()
 
 
-    def compare_sim_ref_trajecs(self):
-        """
-        Plot simulation and reference trajectories in a single figure
-        to compare them.
-        """
-        plt = self.plt
-        plt.rcParams.update({'figure.autolayout': False})
-        plt.rcParams['figure.figsize'] = (19.2, 6.8)
-        plt.subplots_adjust(top=0.974, bottom=0.13, left=0.06, right=0.978, hspace=0.15, wspace=0.44)
-        font_size, _, _ = change_plot_properties(-4, -2, -2, 1)
-        sns.set_style("whitegrid", {'axes.edgecolor':'#ffffff00'})
-        names = ['Simulation'] # line names (legend)
-        second_y_axis_pos = 1.0
-
-        ONLY_ACTUATED_JOINTS = True
-        if ONLY_ACTUATED_JOINTS:
-            # both legs
-            # inds = list(range(6,14)) + list(range(20, 27))
-            # right leg only
-            inds = list(range(6,10)) + list(range(20, 24))
-            self.trajecs_buffer = self.trajecs_buffer[:, inds, :]
-            self.kinem_labels = self.kinem_labels[inds]
-            plt.rcParams.update({'figure.autolayout': False})
-
-        if self.SPEED_CONTROL:
-            # plt.rcParams.update({'axes.labelsize': 14})
-            num_joints = 2
-            rows, cols = 3, 1
-            # only plot com x pos and velocity
-            inds = [0, 9]
-            self.trajecs_buffer = self.trajecs_buffer[:, inds, :]
-            self.kinem_labels = self.kinem_labels[inds]
-            y_labels = ['Moved Distance [m]', 'COM X Vel [m/s]']
-        else:
-            num_joints = len(self.kinem_labels)
-            cols = 5
-            rows = int((num_joints+1)/cols) + 1
-            if ONLY_ACTUATED_JOINTS:
-                cols = 4
-                rows = 2
-        # plot sim trajecs
-        trajecs = self.trajecs_buffer[0,:,:]
-        # collect axes to reuse them for overlaying multiple plots
-        axes = []
-        # collect different lines to place the legend in a separate subplot
-        lines = []
-        for i_joint in range(num_joints):
-            try: axes.append(plt.subplot(rows, cols, i_joint + 1, sharex=axes[i_joint-1]))
-            except: axes.append(plt.subplot(rows, cols, i_joint + 1))
-            trajec = trajecs[i_joint, :]
-            line = plt.plot(trajec)
-            # show episode ends
-            plt.rcParams['lines.linewidth'] = 1
-            plt.vlines(np.argwhere(self.dones_buf).flatten()+1,
-                       np.min(trajec), np.max(trajec), colors='#cccccc', linestyles='dashed')
-            plt.rcParams['lines.linewidth'] = 2
-            if self.SPEED_CONTROL:
-                plt.ylabel(y_labels[i_joint])
-            else:
-                plt.ylabel(f'{i_joint+1}. ' + self.kinem_labels[i_joint])
-        lines.append(line[0])
-
-        # plot ref trajec distributions (mean + 2std)
-        if PLOT_REF_DISTRIB:
-            trajecs = self.trajecs_buffer[2,:,:]
-            stds = self.trajecs_buffer[3,:,:]
-            for i_joint in range(num_joints):
-                trajec = trajecs[i_joint, :]
-                std = stds[i_joint, :]
-                line = axes[i_joint].plot(trajec)
-                axes[i_joint].fill_between(range(len(trajec)), trajec+std, trajec-std,
-                                           color='orange', alpha=0.5)
-            lines.append(line[0])
-            names.append('Reference Distribution\n(mean $\pm$ 2std)')
-
-        PLOT_REFS = True
-        if PLOT_REFS:
-            trajecs = self.trajecs_buffer[1, :, :]
-            for i_joint in range(num_joints):
-                trajec = trajecs[i_joint, :]
-                line = axes[i_joint].plot(trajec, color='red' if PLOT_REF_DISTRIB else 'orange')
-
-            lines.append(line[0])
-            names.append('Reference')
-
-        def plot_actions(buffer, name, line_color='#777777'):
-            with sns.axes_style("white", {"axes.edgecolor": '#ffffff00',
-                                          "ytick.color":'#ffffff00'}):
-                i_not_actuated = self.env._get_not_actuated_joint_indices()
-                i_actuated = 0
-                plt.rcParams['lines.linewidth'] = 1
-                for i_joint in range(num_joints):
-                    if i_joint in i_not_actuated:
-                        continue
-                    if i_actuated >= buffer.shape[0]:
-                        break
-                    act_plt = axes[i_joint].twinx()
-                    act_plt.spines['right'].set_position(('axes', second_y_axis_pos))
-                    line = act_plt.plot(buffer[i_actuated, :], line_color+'77')
-                    act_plt.tick_params(axis='y', labelcolor=line_color)
-                    i_actuated += 1
-                plt.rcParams['lines.linewidth'] = 2
-            lines.append(line[0])
-            names.append(name)
-
-        PLOT_TORQUES = False
-        if PLOT_TORQUES:
-            plot_actions(self.torque_buf/1000, "Joint Torque [kNm]")
-            second_y_axis_pos = 1.12
-
-        PLOT_ACTIONS = False
-        if PLOT_ACTIONS:
-            plot_actions(self.action_buf, 'PD Target', '#ff0000')
-
-        # remove x ticks from upper graphs
-        for i_graph in (range(len(axes) - cols + 1) if not ONLY_ACTUATED_JOINTS else range(4)):
-            axes[i_graph].tick_params(axis='x', which='both',
-                                      labelbottom=False)
-
-        if self.SPEED_CONTROL:
-            plt.subplot(rows, cols, 3, sharex=axes[-1])
-            plt.plot(self.speed_buf)
-            plt.ylabel('Desired Walking Speed [m/s]')
-            plt.xlabel('Simulation Timesteps []')
-            axes[0].legend(lines, names)
-        elif ONLY_ACTUATED_JOINTS:
-            axes[-1].legend(lines, names, loc='upper right')
-            plt.gcf().text(0.5, 0.04, r'Simulation Timesteps', ha='center', fontsize=font_size+2)
-            plt.subplots_adjust(top=0.974, bottom=0.13, left=0.06, right=0.978, hspace=0.15, wspace=0.44)
-            axes[-1].set_xlim([1400, 2000])
-        else:
-            # plot the legend in a separate subplot
-            with sns.axes_style("white", {"axes.edgecolor": 'white'}):
-                legend_subplot = plt.subplot(rows, cols, num_joints + 2)
-                legend_subplot.set_xticks([])
-                legend_subplot.set_yticks([])
-                legend_subplot.legend(lines, names, bbox_to_anchor=(
-                    1.2 if PLOT_REF_DISTRIB else 1, 1.075 if PLOT_REF_DISTRIB else 1))
-
-            PLOT_REWS = False
-            if PLOT_REWS:
-                # add rewards and returns
-                from scripts.common.config import rew_scale, alive_bonus
-                rews = np.copy(self.rewards[-_trajec_buffer_length:])
-                rews -= alive_bonus
-                rews /= rew_scale
-
-                rew_plot = plt.subplot(rows, cols, len(axes) + 1, sharex=axes[-1])
-                rew_plot.plot(rews)
-                # rew_plot.set_ylim(np.array([-0.075, 1.025]))
-                # plot episode terminations
-                plt.vlines(np.argwhere(self.dones_buf).flatten() + 1,
-                           0, 1, colors='#cccccc')
-                # plot episode returns
-                ret_plot = rew_plot.twinx().twiny()
-                ret_plot.plot(self.returns, '#77777777')
-                ret_plot.tick_params(axis='y', labelcolor='#77777777')
-                ret_plot.set_xticks([])
-
-                plt.title('Rewards & Returns')
-
-        # fix title overlapping when tight_layout is true
-        plt.gcf().tight_layout() # rect=[0, 0, 1, 0.95])
-        plt.subplots_adjust(wspace=0.25, hspace=0.4)
-        PD_TUNING = False
+    def get_trajecs_buffers(self):
+        """ :returns dict with copies of the buffers required to plot the trajectory comparison """
+        title = ''
         if PD_TUNING:
-            rew_plot.set_xlim([-5, 250])
             dampings = self.env.model.dof_damping[3:].astype(int).tolist()
             kps = self.env.model.actuator_gainprm[:,0].astype(int).tolist()
             mean_rew = int(1000 * np.mean(self.rewards[-_trajec_buffer_length:]))
-            plt.suptitle(f'PD Gains Tuning:   rew={mean_rew}    kp={kps}    kd={dampings}')
-        elif self.SPEED_CONTROL:
-            plt.suptitle('Simulation and Reference Joint Kinematics over Time')
+            title = f'PD Gains Tuning:   rew={mean_rew}    kp={kps}    kd={dampings}'
+        return {'trajecs': np.copy(self.trajecs_buffer), 'dones': np.copy(self.dones_buf),
+                'speeds': np.copy(self.speed_buf), 'actions': np.copy(self.action_buf),
+                'torques': np.copy(self.torque_buf),
+                'rewards': np.array(self.rewards[-_trajec_buffer_length:]),
+                'returns': np.array(self.returns),
+                'kinem_labels': np.asarray(self.kinem_labels),
+                'not_actuated_joints': np.asarray(self.env._get_not_actuated_joint_indices()),
+                'speed_control': self.SPEED_CONTROL, 'plot_ref_distrib': PLOT_REF_DISTRIB,
+                'title': title}
+
+    def dump_trajecs_buffers(self, path=None):
+        """
+        Saves the trajectory buffers to be plotted offline by the headless renderer
+        instead of blocking the env step with plotting.
+        :param path: defaults to a file of this env process in TRAJECS_DUMP_PATH
+        """
+        if path is None: path = get_dump_path(os.getpid())
+        with perf.span('env/monitor_dump'):
+            save_trajecs_buffers(self.get_trajecs_buffers(), path)
+        return path
 
-        plt.show()
+    def compare_sim_ref_trajecs(self):
+        """
+        Plot simulation and reference trajectories in a single figure
+        to compare them. Blocks until the figure is closed.
+        """
+        plot_sim_ref_trajecs(self.get_trajecs_buffers())
+        show_plot()
         if self.env.is_evaluation_on() or PD_TUNING:
             raise SystemExit('Planned exit after closing trajectory comparison plot.')
\ No newline at end of file
@@ -27,19 +27,19 @@ class MimicWalker2dEnv(MimicEnv, mujoco_env.MujocoEnv, utils.EzPickle):
     """
     Building upon the Walker2d-v2 Environment with the id: Walker2d-v2
     """
-    def __init__(self):
+    def __init__(self, run_cfg:cfg.RunConfig=None):
+        if run_cfg is None: run_cfg = cfg.default_run_config()
         walker_xml = {'mim2d': 'walker2pd.xml',
-                      'mim_trq2d': 'walker2d.xml'}[cfg.env_abbrev]
-        mujoco_env.MujocoEnv.__init__(self,
-                                      join(dirname(__file__), "assets", walker_xml), 4)
-        utils.EzPickle.__init__(self)
+                      'mim_trq2d': 'walker2d.xml'}[run_cfg.env_abbrev]
         # init the mimic environment, automatically loads and inits ref trajectories
-        MimicEnv.__init__(self,
-                          ReferenceTrajectories(qpos_indices, qvel_indices, ref_trajec_adapts))
+        MimicEnv.__init__(self, join(dirname(__file__), "assets", walker_xml),
+                          ReferenceTrajectories(qpos_indices, qvel_indices,
+                                                ref_trajec_adapts, run_cfg),
+                          run_cfg)
 
     @staticmethod
-    def get_refs(reset=False):
-        refs = ReferenceTrajectories(qpos_indices, qvel_indices, ref_trajec_adapts)
+    def get_refs(reset=False, run_cfg=None):
+        refs = ReferenceTrajectories(qpos_indices, qvel_indices, ref_trajec_adapts, run_cfg)
         if reset: refs.reset()
         return refs
 
@@ -66,17 +66,7 @@ class MimicWalker2dEnv(MimicEnv, mujoco_env.MujocoEnv, utils.EzPickle):
         """Maximum joint velocities approximated from the reference data."""
         return np.array([5, 10, 10, 5, 10, 10])
 
-    def has_ground_contact(self):
-        has_contact = [False, False]
-        for contact in self.data.contact[:10]:
-            if contact.geom1 == 0 and contact.geom2 == 4:
-                # right foot has ground contact
-                has_contact[1] = True
-            elif contact.geom1 == 0 and contact.geom2 == 7:
-                # left foot has ground contact
-                has_contact[0] = True
-        if cfg.is_mod(cfg.MOD_3_PHASES):
-            has_contact += [all(has_contact)]
-        return has_contact
+    def _get_foot_geom_names(self):
+        return 'foot_left_geom', 'foot_geom'
 
 
@@ -33,17 +33,19 @@ class MimicWalker3dEnv(MimicEnv):
     the 3D bipedal walker model from Guoping Zhao.
     '''
 
-    def __init__(self):
+    def __init__(self, run_cfg:cfg.RunConfig=None):
+        if run_cfg is None: run_cfg = cfg.default_run_config()
         # specify the name of the environment XML file
         walker_xml = 'walker3d_flat_feet.xml'
         # init reference trajectories
         # by specifying the indices in the mocap data to use for qpos and qvel
         global qpos_indices, qvel_indices
-        reference_trajectories = refs.ReferenceTrajectories(qpos_indices, qvel_indices)
+        reference_trajectories = refs.ReferenceTrajectories(
+            qpos_indices, qvel_indices, run_cfg=run_cfg)
         # specify absolute path to the MJCF file
         mujoco_xml_file = join(dirname(__file__), "assets", walker_xml)
         # init the mimic environment
-        MimicEnv.__init__(self, mujoco_xml_file, reference_trajectories)
+        MimicEnv.__init__(self, mujoco_xml_file, reference_trajectories, run_cfg)
 
     def viewer_setup(self):
         self.viewer.cam.trackbodyid = 2
@@ -82,30 +84,5 @@ class MimicWalker3dEnv(MimicEnv):
         """Maximum joint velocities approximated from the reference data."""
         return np.array([5, 1, 10, 10, 5, 1, 10, 10])
 
-    def has_ground_contact(self):
-        has_contact = [False, False]
-        for contact in self.data.contact[:self.data.ncon]:
-            if contact.geom1 == 0 and contact.geom2 == 4:
-                # right foot has ground contact
-                has_contact[1] = True
-            elif contact.geom1 == 0 and contact.geom2 == 7:
-                # left foot has ground contact
-                has_contact[0] = True
-
-        if cfg.is_mod(cfg.MOD_3_PHASES):
-            double_stance = all(has_contact)
-            if cfg.is_mod(cfg.MOD_GRND_CONTACT_ONE_HOT):
-                if double_stance:
-                    return [False, False, True]
-                else:
-                    has_contact += [False]
-            else: has_contact + [double_stance]
-
-        # when both feet have no ground contact
-        if cfg.is_mod(cfg.MOD_GROUND_CONTACT_NNS) and not any(has_contact):
-            # print('Both feet without ground contact!')
-            # let the left and right foot network handle this situation
-            has_contact = np.array(has_contact)
-            has_contact[:2] = True
-
-        return has_contact
\ No newline at end of file
+    def _get_foot_geom_names(self):
+        return 'left_foot', 'right_foot'
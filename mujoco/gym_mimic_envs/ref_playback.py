@@ -0,0 +1,140 @@
+"""
+Headless playback of the reference trajectories, from the first to the last reference step.
+
+- kinematic: the reference kinematics are set in the simulation at each control step.
+  Checks that the references fit the model and that they obtain the maximum imitation reward.
+- pd: the position servos of the walker follow the reference joint angles.
+  Measures how well the actuators and PD gains of the MJCF model can track the references.
+  Falls are counted and the walker is reinitialized at the current reference state.
+
+The statistics contain the per-joint tracking error, the reward and the simulation throughput
+without any policy. Several PD gain configurations can be played back in parallel processes.
+"""
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+PLAYBACK_MODES = ('kinematic', 'pd')
+# the walker has fallen when its COM is lower, same as in MimicEnv._check_termination()
+FALL_COM_HEIGHT = 0.5
+
+
+def set_pd_gains(env, gains, dampings):
+    """ Sets the proportional gains of the position servos and the dampings of the actuated joints. """
+    env.model.actuator_gainprm[:, 0] = gains
+    env.model.dof_damping[3:] = dampings
+
+
+def init_at_ref_state(env):
+    """ Sets the simulation to the current reference state
+        and moves the references one step ahead like MimicEnv.reset_model(). """
+    env.set_state(env.refs.get_qpos(), env.refs.get_qvel())
+    env.refs.next()
+
+
+class TrackingStats:
+    """ Running per-dimension tracking errors and reward statistics, nothing is stored per step. """
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.n_steps = 0
+        self._abs_err_sum = np.zeros(len(labels))
+        self._sq_err_sum = np.zeros(len(labels))
+        self._max_abs_err = np.zeros(len(labels))
+        self._rewards = []
+        self._contacts_sum = np.zeros(2)
+        self.n_falls = 0
+
+    def update(self, sim_kinematics, ref_kinematics, reward, contacts):
+        abs_err = np.abs(sim_kinematics - ref_kinematics)
+        self._abs_err_sum += abs_err
+        self._sq_err_sum += abs_err ** 2
+        np.maximum(self._max_abs_err, abs_err, out=self._max_abs_err)
+        self._rewards.append(reward)
+        self._contacts_sum += contacts
+        self.n_steps += 1
+
+    def report(self):
+        """ :returns JSON serializable statistics """
+        n_steps = max(1, self.n_steps)
+        mae = self._abs_err_sum / n_steps
+        rmse = np.sqrt(self._sq_err_sum / n_steps)
+        rewards = np.asarray(self._rewards)
+        return {'n_steps': self.n_steps, 'n_falls': self.n_falls,
+                'reward': {'mean': float(np.mean(rewards)), 'min': float(np.min(rewards)),
+                           'std': float(np.std(rewards))} if len(rewards) else None,
+                'contact_ratio_left_right': (self._contacts_sum / n_steps).tolist(),
+                'tracking_error': {str(label): {'mae': float(mae[i]), 'rmse': float(rmse[i]),
+                                                'max': float(self._max_abs_err[i])}
+                                   for i, label in enumerate(self.labels)}}
+
+
+def playback(env, mode='kinematic', max_steps=None, render=False):
+    """
+    Plays the reference trajectories back once from the first to the last reference step.
+    The PD servos get the reference angles as targets directly, bypassing the action
+    rescaling and mirroring, and only the simulation and the imitation reward are computed.
+    :param env: unwrapped MimicEnv
+    :param max_steps: stop earlier after this number of control steps
+    :returns dict with the tracking and reward statistics and the throughput
+    """
+    assert mode in PLAYBACK_MODES, f'Unknown playback mode {mode}, choose from {PLAYBACK_MODES}'
+    assert mode == 'kinematic' or not env._cfg.env_out_torque, \
+        'PD tracking requires an environment with position servos (env_out_torque=False).'
+    env.reset()
+    refs = env.refs
+    refs.reset()
+    init_at_ref_state(env)
+    stats = TrackingStats(refs.get_kinematics_labels())
+
+    t_start = time.perf_counter()
+    while not refs.has_reached_last_step and (max_steps is None or stats.n_steps < max_steps):
+        if mode == 'kinematic':
+            refs.next()
+            env.set_joint_kinematics_in_sim()
+            env.sim.forward()
+            reward, fallen = env.get_imitation_reward(), False
+        else:
+            des_qpos = env.get_ref_qpos(exclude_not_actuated_joints=True)
+            env.do_simulation(des_qpos, env._frame_skip)
+            refs.next()
+            reward = env.get_imitation_reward()
+            fallen = env.sim.data.qpos[env._com_z_index] < FALL_COM_HEIGHT
+        stats.update(env.get_joint_kinematics(concat=True), env.get_ref_kinematics(concat=True),
+                     reward, env.contacts.get_contacts())
+        if fallen:
+            stats.n_falls += 1
+            init_at_ref_state(env)
+        if render: env.render()
+    duration = time.perf_counter() - t_start
+
+    report = stats.report()
+    report.update({'mode': mode, 'duration_s': duration,
+                   'steps_per_s': stats.n_steps / duration if duration > 0 else None})
+    return report
+
+
+def _playback_with_gains(run_cfg, gains, dampings, max_steps):
+    import gym, gym_mimic_envs
+    env = gym.make(run_cfg.env_id, run_cfg=run_cfg).unwrapped
+    if gains is not None: set_pd_gains(env, gains, dampings)
+    try:
+        return playback(env, 'pd', max_steps)
+    finally:
+        env.close()
+
+
+def playback_gain_configs(run_cfg, gain_configs, max_steps=None, n_workers=None):
+    """
+    PD tracking of the references with several gain configurations in parallel processes.
+    :param gain_configs: list of (gains, dampings) of the actuated joints,
+                         (None, None) keeps the gains of the MJCF model
+    :returns list of the playback statistics in the order of the configs
+    """
+    n_workers = n_workers or min(len(gain_configs), mp.cpu_count())
+    # forked workers inherit the reference trajectories loaded by the parent process
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('fork')) as pool:
+        futures = [pool.submit(_playback_with_gains, run_cfg, gains, dampings, max_steps)
+                   for gains, dampings in gain_configs]
+        return [future.result() for future in futures]
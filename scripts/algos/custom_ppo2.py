@@ -3,8 +3,9 @@ import numpy as np
 
 from stable_baselines import PPO2
 from scripts.common.utils import log
-from scripts.common import config as cfg
+from scripts.common import config as cfg, perf
 from scripts.behavior_cloning.dataset import get_obs_and_delta_actions
+from gym_mimic_envs.contact_sensing import get_mirrored_flag_indices
 
 # imports required to copy the learn method
 from stable_baselines import logger
@@ -13,14 +14,25 @@ from stable_baselines.common.schedules import get_schedule_fn
 from stable_baselines.common.tf_util import total_episode_reward_logger
 from stable_baselines.common import explained_variance, SetVerbosity, TensorboardWriter
 
+# dtype of the experiences fed into the TF graph, upcasting would double the memory traffic
+EXPS_DTYPE = np.float32
 
-def mirror_experiences(rollout, ppo2=None):
+
+def check_exps_dtypes(**arrays):
+    """ Guards the float32 data path from the env observations to the TF feed. """
+    for name, array in arrays.items():
+        assert array.dtype == EXPS_DTYPE, f'{name} has dtype {array.dtype} instead of {EXPS_DTYPE}'
+
+
+def mirror_experiences(rollout, ppo2=None, run_cfg=None):
+    if run_cfg is None:
+        run_cfg = ppo2.run_cfg if ppo2 is not None else cfg.default_run_config()
     obs, returns, masks, actions, values, neglogpacs, states, ep_infos, true_reward = rollout
-    assert obs.shape[0] == cfg.batch_size
+    assert obs.shape[0] == run_cfg.batch_size
     assert states is None
     assert len(ep_infos) == 0
 
-    is3d = cfg.env_is3d
+    is3d = run_cfg.env_is3d
     if is3d:
         # 3D Walker obs indices:
         #           0: phase, 1: des_vel, 2: com_y, 3: com_z,
@@ -54,6 +66,8 @@ def mirror_experiences(rollout, ppo2=None):
         mirred_acts_indices = [3, 4, 5, 0, 1, 2]
         mirred_obs_indices = [0, 1, 2, 3, 7, 8, 9, 4, 5, 6,
                               10, 11, 12, 16, 17, 18, 13, 14, 15]
+    # swap the left and right gait phase flags at the end of the observations
+    mirred_obs_indices += get_mirrored_flag_indices(len(mirred_obs_indices), run_cfg.n_phase_flags)
 
     obs_mirred = obs[:, mirred_obs_indices]
     acts_mirred = actions[:, mirred_acts_indices]
@@ -62,7 +76,7 @@ def mirror_experiences(rollout, ppo2=None):
         obs_mirred[:, negate_obs_indices] *= -1
         acts_mirred[:, negate_act_indices] *= -1
 
-    QUERY_NETS = cfg.is_mod(cfg.MOD_QUERY_NETS)
+    QUERY_NETS = run_cfg.query_nets
     if QUERY_NETS:
         parameters = ppo2.get_parameter_list()
         parameter_values = np.array(ppo2.sess.run(parameters))
@@ -92,10 +106,10 @@ def mirror_experiences(rollout, ppo2=None):
         def neglogp(acts, mean, logstd):
             std = np.exp(logstd)
             return 0.5 * np.sum(np.square((acts - mean) / std), axis=-1) \
-                   + 0.5 * np.log(2.0 * np.pi) * np.array(acts.shape[-1], dtype=np.float) \
+                   + 0.5 * np.log(2.0 * np.pi) * acts.shape[-1] \
                    + np.sum(logstd, axis=-1)
 
-        if not cfg.is_mod(cfg.MOD_QUERY_VF_ONLY):
+        if not run_cfg.query_vf_only:
             act_means = get_action_means(obs)
             act_means_mirred = get_action_means(obs_mirred)
 
@@ -150,7 +164,7 @@ def mirror_experiences(rollout, ppo2=None):
         values = np.concatenate((values, values_mirred_obs.flatten()))
         neglogpacs = np.concatenate((neglogpacs,
                                      neglogpacs_mirred.flatten()
-                                     if not cfg.is_mod(cfg.MOD_QUERY_VF_ONLY)
+                                     if not run_cfg.query_vf_only
                                      else neglogpacs))
     else:
         values = np.concatenate((values, values))
@@ -162,7 +176,7 @@ def mirror_experiences(rollout, ppo2=None):
     true_reward = np.concatenate((true_reward, true_reward))
 
     # remove mirrored experiences with too high neglogpacs
-    FILTER_MIRRED_EXPS = cfg.is_mod(cfg.MOD_QUERY_NETS) and not cfg.is_mod(cfg.MOD_QUERY_VF_ONLY)
+    FILTER_MIRRED_EXPS = run_cfg.query_nets and not run_cfg.query_vf_only
     if FILTER_MIRRED_EXPS:
         n_mirred_exps = int(len(neglogpacs) / 2)
         max_allowed_neglogpac = 5 * np.percentile(neglogpacs[:n_mirred_exps], 99)
@@ -218,21 +232,26 @@ class CustomPPO2(PPO2):
     def __init__(self, policy, env, gamma=0.99, n_steps=128, ent_coef=0.01, learning_rate=2.5e-4, vf_coef=0.5,
                  max_grad_norm=0.5, lam=0.95, nminibatches=4, noptepochs=4, cliprange=0.2, cliprange_vf=None,
                  verbose=0, tensorboard_log=None, _init_setup_model=True, policy_kwargs=None,
-                 full_tensorboard_log=False, seed=None, n_cpu_tf_sess=None):
+                 full_tensorboard_log=False, seed=None, n_cpu_tf_sess=None, run_cfg=None):
 
         # log('Using CustomPPO2!')
 
-        self.mirror_experiences = cfg.is_mod(cfg.MOD_MIRROR_EXPS)
+        # configuration of the current run, see config.RunConfig
+        self.run_cfg = run_cfg if run_cfg is not None else cfg.default_run_config()
+        self.mirror_experiences = self.run_cfg.mirror_exps
         # to investigate the outputted actions in the monitor env
         self.last_actions = None
 
-        if cfg.is_mod(cfg.MOD_REFS_REPLAY):
+        if self.run_cfg.refs_replay:
             # load obs and actions generated from reference trajectories
-            self.ref_obs, self.ref_acts = get_obs_and_delta_actions(norm_obs=True, norm_acts=True, fly=False)
+            ref_obs, ref_acts = get_obs_and_delta_actions(norm_obs=True, norm_acts=True, fly=False)
+            self.ref_obs, self.ref_acts = ref_obs.astype(EXPS_DTYPE), ref_acts.astype(EXPS_DTYPE)
 
-        if cfg.is_mod(cfg.MOD_EXP_REPLAY):
+        if self.run_cfg.exp_replay:
             self.replay_buf = np.ndarray((cfg.replay_buf_size,), dtype=object)
 
+        if self.run_cfg.perf_timing: perf.enable()
+
         super(CustomPPO2, self).__init__(policy, env, gamma, n_steps, ent_coef, learning_rate, vf_coef,
                                          max_grad_norm, lam, nminibatches, noptepochs, cliprange, cliprange_vf,
                                          verbose, tensorboard_log, _init_setup_model, policy_kwargs,
@@ -242,7 +261,7 @@ class CustomPPO2(PPO2):
         obs, returns, masks, actions, values, neglogpacs, \
         states, ep_infos, true_reward = rollout
 
-        QUERY_NETS = cfg.is_mod(cfg.MOD_QUERY_NETS)
+        QUERY_NETS = self.run_cfg.query_nets
 
         if QUERY_NETS:
             # get current PI and VF network parameters
@@ -272,7 +291,7 @@ class CustomPPO2(PPO2):
             def neglogp(acts, mean, logstd):
                 std = np.exp(logstd)
                 return 0.5 * np.sum(np.square((acts - mean) / std), axis=-1) \
-                       + 0.5 * np.log(2.0 * np.pi) * np.array(acts.shape[-1], dtype=np.float) \
+                       + 0.5 * np.log(2.0 * np.pi) * acts.shape[-1] \
                        + np.sum(logstd, axis=-1)
 
         for old_rollout in self.replay_buf:
@@ -284,7 +303,7 @@ class CustomPPO2(PPO2):
 
             if QUERY_NETS:
                 self.prev_values = get_value(self.prev_obs)
-                if not cfg.is_mod(cfg.MOD_QUERY_VF_ONLY):
+                if not self.run_cfg.query_vf_only:
                     act_means = get_action_means(self.prev_obs)
                     self.prev_neglogpacs = neglogp(self.prev_actions, act_means, pi_logstd)
 
@@ -309,7 +328,7 @@ class CustomPPO2(PPO2):
             neglogpacs = np.concatenate((neglogpacs, self.prev_neglogpacs))
 
         # remove mirrored experiences with too high neglogpacs
-        FILTER_MIRRED_EXPS = True and QUERY_NETS and not cfg.is_mod(cfg.MOD_QUERY_VF_ONLY)
+        FILTER_MIRRED_EXPS = True and QUERY_NETS and not self.run_cfg.query_vf_only
         if FILTER_MIRRED_EXPS:
             n_fresh_exps = int(len(neglogpacs) / (cfg.replay_buf_size+1))
             max_allowed_neglogpac = 5 * np.percentile(neglogpacs[:n_fresh_exps], 99)
@@ -368,10 +387,16 @@ class CustomPPO2(PPO2):
             t_first_start = time.time()
             n_updates = total_timesteps // self.n_batch
 
+            if perf.is_enabled():
+                # measure how long the runner waits for the (sub)processes stepping the envs
+                venv = self.env
+                while hasattr(venv, 'venv'): venv = venv.venv
+                perf.time_method(venv, 'step_wait', 'runner/env_step_wait')
+
             callback.on_training_start(locals(), globals())
 
             for update in range(1, n_updates + 1):
-                minibatch_size = cfg.minibatch_size # self.n_batch // self.nminibatches
+                minibatch_size = self.run_cfg.minibatch_size # self.n_batch // self.nminibatches
                 t_start = time.time()
                 frac = 1.0 - (update - 1.0) / n_updates
                 lr_now = self.learning_rate(frac)
@@ -385,7 +410,8 @@ class CustomPPO2(PPO2):
                 while tried_rollouts < 1:
                     try:
                         # true_reward is the reward without discount
-                        rollout = self.runner.run(callback)
+                        with perf.span('ppo/rollout'):
+                            rollout = self.runner.run(callback)
                         break
                     except BrokenPipeError as bpe:
                         raise BrokenPipeError(f'Catched Broken Pipe Error.')
@@ -412,11 +438,13 @@ class CustomPPO2(PPO2):
 
                 # Unpack
                 if self.mirror_experiences:
-                    obs, returns, masks, actions, values, neglogpacs, \
-                    states, ep_infos, true_reward = mirror_experiences(rollout, self)
-                elif cfg.is_mod(cfg.MOD_EXP_REPLAY):
-                    obs, returns, masks, actions, values, neglogpacs, \
-                    states, ep_infos, true_reward = self.exp_replay(rollout)
+                    with perf.span('ppo/mirror_exps'):
+                        obs, returns, masks, actions, values, neglogpacs, \
+                        states, ep_infos, true_reward = mirror_experiences(rollout, self)
+                elif self.run_cfg.exp_replay:
+                    with perf.span('ppo/exp_replay'):
+                        obs, returns, masks, actions, values, neglogpacs, \
+                        states, ep_infos, true_reward = self.exp_replay(rollout)
                 else:
                     obs, returns, masks, actions, values, neglogpacs, \
                     states, ep_infos, true_reward = rollout
@@ -431,10 +459,14 @@ class CustomPPO2(PPO2):
                      f'mean returns:\t{np.mean(returns)}', f'mean values:\t{np.mean(values)}',
                      f'max returns:\t{np.max(returns)}', f'max values:\t\t{np.max(values)}'])
 
-                if cfg.is_mod(cfg.MOD_REFS_REPLAY):
+                if self.run_cfg.refs_replay:
                     # load ref experiences and treat them as real experiences
-                    obs, actions, returns, masks, values, neglogpacs = \
-                        generate_experiences_from_refs(rollout, self.ref_obs, self.ref_acts)
+                    with perf.span('ppo/refs_replay'):
+                        obs, actions, returns, masks, values, neglogpacs = \
+                            generate_experiences_from_refs(rollout, self.ref_obs, self.ref_acts)
+
+                check_exps_dtypes(obs=obs, returns=returns, actions=actions,
+                                  values=values, neglogpacs=neglogpacs)
 
                 callback.on_rollout_end()
 
@@ -463,8 +495,9 @@ class CustomPPO2(PPO2):
                             end = start + minibatch_size
                             mbinds = inds[start:end]
                             slices = (arr[mbinds] for arr in (obs, returns, masks, actions, values, neglogpacs))
-                            mb_loss_vals.append(self._train_step(lr_now, cliprange_now, *slices, writer=writer,
-                                                                 update=timestep, cliprange_vf=cliprange_vf_now))
+                            with perf.span('ppo/train_step'):
+                                mb_loss_vals.append(self._train_step(lr_now, cliprange_now, *slices, writer=writer,
+                                                                     update=timestep, cliprange_vf=cliprange_vf_now))
                 else:  # recurrent version
                     update_fac = self.n_batch // self.nminibatches // self.noptepochs // self.n_steps + 1
                     assert self.n_envs % self.nminibatches == 0
@@ -481,9 +514,10 @@ class CustomPPO2(PPO2):
                             mb_flat_inds = flat_indices[mb_env_inds].ravel()
                             slices = (arr[mb_flat_inds] for arr in (obs, returns, masks, actions, values, neglogpacs))
                             mb_states = states[mb_env_inds]
-                            mb_loss_vals.append(self._train_step(lr_now, cliprange_now, *slices, update=timestep,
-                                                                 writer=writer, states=mb_states,
-                                                                 cliprange_vf=cliprange_vf_now))
+                            with perf.span('ppo/train_step'):
+                                mb_loss_vals.append(self._train_step(lr_now, cliprange_now, *slices, update=timestep,
+                                                                     writer=writer, states=mb_states,
+                                                                     cliprange_vf=cliprange_vf_now))
 
                 loss_vals = np.mean(mb_loss_vals, axis=0)
                 t_now = time.time()
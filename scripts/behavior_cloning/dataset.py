@@ -1,8 +1,21 @@
+import os, hashlib
 import numpy as np
 from matplotlib import pyplot as plt
 
+from scripts.common import config as cfg
+from scripts.common.utils import log
 from scripts.mocap import ref_trajecs as rt
-from gym_mimic_envs.mujoco.mimic_walker2d import MimicWalker2dEnv, qpos_indices, qvel_indices
+from scripts.mocap.ref_stats import calculate_refs_stats
+from gym_mimic_envs.mujoco.mimic_walker2d import MimicWalker2dEnv, qpos_indices, qvel_indices, \
+    ref_trajec_adapts
+
+# the dataset built from the default reference trajectories is cached here
+DATASET_CACHE_PATH = cfg.abs_project_path + 'models/behav_clone/dataset_cache/'
+# increase when the dataset generation changes to invalidate old caches
+DATASET_VERSION = 1
+# the refs are traversed twice starting at position 0 and 1
+# to get all points as refs.next() skips one point at 200Hz
+N_START_POSITIONS = 2
 
 def build_data_matrix(refs):
     """:returns: 2D matrix containing all the data points in the reference trajectory:
@@ -50,8 +63,105 @@ def get_refs(refs=None):
     return refs
 
 
-def get_data(refs:rt.ReferenceTrajectories=None, fly=False, debug=False):
+def get_data(refs:rt.ReferenceTrajectories=None, fly=False, debug=False, use_cache=True):
     """
+    :param use_cache: load the dataset from disk if it was already built
+                      from the default reference trajectories (only used if refs is None)
+    :returns:   data_x (n_points, state_dim)
+                data_y (n_points, act_dim)
+    """
+    if refs is not None and debug:
+        # plots the data while stepping through the refs
+        return _get_data_stepwise(refs, fly, debug)
+
+    cache_file = None
+    if refs is None and use_cache:
+        cache_file = DATASET_CACHE_PATH + _get_cache_key(fly) + '.npz'
+        if os.path.exists(cache_file):
+            npz = np.load(cache_file)
+            return npz['x_data'], npz['y_data']
+
+    if refs is None:
+        refs = rt.ReferenceTrajectories(qpos_indices, qvel_indices, ref_trajec_adapts)
+    x_data, y_data = build_data(refs, fly)
+
+    if cache_file is not None:
+        os.makedirs(DATASET_CACHE_PATH, exist_ok=True)
+        np.savez(cache_file, x_data=x_data, y_data=y_data)
+        log('Saved behavior cloning dataset to ' + cache_file)
+    return x_data, y_data
+
+
+def _get_cache_key(fly):
+    """ Hash of all settings the dataset built from the default refs depends on. """
+    run_cfg = cfg.default_run_config()
+    refs_path = rt.get_refs_path(run_cfg.refs_ramp)
+    settings = [DATASET_VERSION, refs_path, os.path.getmtime(refs_path),
+                rt.SAMPLE_FREQ / run_cfg.ctrl_freq, run_cfg.symmetric_walk,
+                rt.SKIP_N_STEPS, rt.STEPS_PER_VEL, qpos_indices, qvel_indices,
+                sorted(ref_trajec_adapts.items()), fly]
+    return hashlib.md5(repr(settings).encode()).hexdigest()
+
+
+def build_data(refs:rt.ReferenceTrajectories, fly=False):
+    """
+    Builds the same dataset as _get_data_stepwise() by slicing the steps of the refs
+    instead of calling refs.next() for every single point.
+    :returns:   data_x (n_points, state_dim): [phase, des. walking speed, qpos w/o COM X, qvel]
+                data_y (n_points, act_dim): actuated joint positions at the next timestep
+    """
+    data, increment = refs.data, refs.increment
+    assert isinstance(increment, int), \
+        'The dataset requires a control frequency that is a divider of the sample frequency of the refs.'
+    qpos_is, qvel_is = np.array(refs.qpos_is), np.array(refs.qvel_is)
+    # remove COM x position as the action should be independent of it
+    obs_is = np.concatenate([qpos_is[1:], qvel_is])
+    act_is = qpos_is[3:]
+    assert len(act_is) == 6, f'6 actions expected, got {len(act_is)}'
+
+    x_parts, y_parts = [], []
+    count_steps_same_vel = refs.count_steps_same_vel
+    for start_pos in range(N_START_POSITIONS):
+        i_step, pos = 0, start_pos
+        has_reached_last_step = False
+        while not has_reached_last_step:
+            step = data[i_step]
+            step_len = step.shape[1]
+            # all positions visited by refs.next() on the current step
+            positions = np.arange(pos, step_len, increment)
+            i_next_step, next_count, has_reached_last_step = \
+                refs.get_next_step_index(i_step, count_steps_same_vel)
+            # position on the next step after the last increment
+            next_pos = positions[-1] + increment - (step_len - 1)
+
+            x = np.empty((len(positions), 2 + len(obs_is)))
+            x[:, 0] = positions / step_len
+            x[:, 1] = refs.step_velocities[max(0, i_step - count_steps_same_vel + 1)]
+            x[:, 2:] = step[obs_is][:, positions].T
+            # desired joint positions at the next timestep
+            y = np.empty((len(positions), len(act_is)))
+            y[:-1] = step[act_is][:, positions[1:]].T
+            y[-1] = data[i_next_step][act_is, next_pos]
+
+            x_parts.append(x)
+            y_parts.append(y)
+            i_step, pos, count_steps_same_vel = i_next_step, next_pos, next_count
+
+    x_data, y_data = np.concatenate(x_parts), np.concatenate(y_parts)
+
+    if fly:
+        # set the joints affected by fixed torso to a constant values
+        n_qpos = len(qpos_is) - 1
+        x_data[:, [2, 3]] = [1.2, 0.0] # COM Z and Trunk Rot
+        x_data[:, 2+n_qpos:5+n_qpos] = [0.0, -0.05, 0.0] # COM X, COM Z, Trunk Rot
+
+    return x_data, y_data
+
+
+def _get_data_stepwise(refs:rt.ReferenceTrajectories=None, fly=False, debug=False):
+    """
+    Builds the dataset by stepping through the refs point by point.
+    Slow, use get_data() instead. Kept to plot the data during generation (debug).
     :returns:   data_x (n_points, state_dim)
                 data_y (n_points, act_dim)
     """
@@ -62,7 +172,7 @@ def get_data(refs:rt.ReferenceTrajectories=None, fly=False, debug=False):
     x_data, y_data = [], []
     # iterate twice through the refs to get all points
     # as we're skipping 1 step in refs.next()
-    for i in range(2):
+    for i in range(N_START_POSITIONS):
         refs.reset()
         assert refs._i_step == 0 and refs._pos == 0
         # first iteration, start at pos 0, second at pos 1
@@ -135,19 +245,53 @@ def get_data(refs:rt.ReferenceTrajectories=None, fly=False, debug=False):
     return x_data, y_data
 
 
-def augment_data_with_gaussian_noise(x_data, y_data, std=1, des_size=int(1e6)):
-    """:param x_data: dataset of shape (num_points, state_dim)"""
+def augment_data_with_gaussian_noise(x_data, y_data, std=1, des_size=int(1e6), seed=None):
+    """
+    Builds noisy copies of the whole dataset in memory.
+    For large datasets, use the constant memory noisy_minibatches() instead.
+    :param x_data: dataset of shape (num_points, state_dim)
+    :returns x_data with Gaussian noise (n_copies * num_points, state_dim),
+             and the corresponding y_data (n_copies * num_points, act_dim)
+    """
     n_noisy_copies = des_size // x_data.shape[0] + 1
     print('size of new dataset will be ', n_noisy_copies * x_data.shape[0])
-    x_data_copies, y_data_copies = [],[]
-
-    for i in range(n_noisy_copies):
-        x_data_copies.append(np.random.normal(x_data, std) + x_data)
+    rng = np.random.RandomState(seed)
+    x_data_noisy = np.concatenate([x_data + rng.normal(0, std, x_data.shape)
+                                   for _ in range(n_noisy_copies)])
+    y_data_copies = np.tile(y_data, (n_noisy_copies,) + (1,) * (y_data.ndim - 1))
+    return x_data_noisy, y_data_copies
 
 
-    return x_data, y_data
-
-def get_dataset_for_zero_policy():
+def noisy_minibatches(x_data, y_data, batch_size=512, std=1,
+                      n_samples=None, zero_targets=False, seed=33):
+    """
+    Streams shuffled minibatches of observations with added Gaussian noise
+    together with the matching targets. Only a single minibatch is kept in memory,
+    so the number of samples is not limited by the RAM. Reproducible for the same seed.
+    The data is reshuffled after each pass through it.
+    :param n_samples: total number of samples to generate, infinite if None (e.g. for keras fit())
+    :param zero_targets: yield zeros as targets (see get_dataset_for_zero_policy())
+    :yields (x_batch, y_batch)
+    """
+    rng = np.random.RandomState(seed)
+    n_points, state_dim = x_data.shape
+    indices, pos = rng.permutation(n_points), 0
+    n_generated = 0
+    while n_samples is None or n_generated < n_samples:
+        size = batch_size if n_samples is None else min(batch_size, n_samples - n_generated)
+        # append the next shuffled pass through the data when required
+        while pos + size > len(indices):
+            indices, pos = np.concatenate([indices[pos:], rng.permutation(n_points)]), 0
+        batch_indices = indices[pos:pos+size]
+        pos += size
+        n_generated += size
+
+        x_batch = x_data[batch_indices] + rng.normal(0, std, (size, state_dim))
+        y_batch = np.zeros((size,) + y_data.shape[1:]) if zero_targets else y_data[batch_indices]
+        yield x_batch, y_batch
+
+
+def get_dataset_for_zero_policy(std=1, des_size=int(1e6), seed=None):
     """
     Generate a dataset to train the policy to output zero for all possible inputs.
     We expect this to be a better initialization compared to the random one,
@@ -155,42 +299,29 @@ def get_dataset_for_zero_policy():
     Our initial stochastic policy this way will be a unit Gaussian distribution.
 
     The x_data is generated by applying Gaussian noise to the original dataset.
+    To train on more samples than fit into memory, use
+    noisy_minibatches(*get_obs_and_delta_actions(), zero_targets=True) instead.
 
     :returns x_data_normed, y_data = np.zeros()
     """
     x_data, y_data = get_obs_and_delta_actions()
-    x_data, y_data = augment_data_with_gaussian_noise(x_data, y_data)
+    x_data, y_data = augment_data_with_gaussian_noise(x_data, y_data, std, des_size, seed)
     # set y_data to zero
-    y_data *= 0
-
-
-
-
-
-def get_augmented_normed_data():
-    pass
+    return x_data, np.zeros_like(y_data)
 
 
 def get_refs_stats(refs:rt.ReferenceTrajectories=None, all_joints=True, debug=False):
     """:return: mean, variance and standard deviation of all or specified joints."""
-    global qpos_indices
     if refs is None:
         refs = rt.ReferenceTrajectories(qpos_indices, qvel_indices, {})
         debug = False
-    data = build_data_matrix(refs)
-    means = np.mean(data, axis=0)
-    vars = np.var(data, axis=0)
-    stds = np.std(data, axis=0)
-    if not all_joints:
-        # remove com x position
-        qpos_indices = qpos_indices[1:]
-        indices = np.concatenate([qpos_indices, qvel_indices])
-        # add phase variable
-        data = np.copy(data[:, indices])
-        means = np.copy(means[indices])
-        vars = np.copy(vars[indices])
-        stds = np.copy(stds[indices])
+    # remove com x position
+    indices = None if all_joints else np.concatenate([qpos_indices[1:], qvel_indices])
+    stats = calculate_refs_stats(refs, indices)
+    means, vars, stds = stats['global_mean'], stats['global_var'], stats['global_std']
     if debug:
+        data = build_data_matrix(refs)
+        if indices is not None: data = data[:, indices]
         for i in range(5,13):
             plt.subplot(2,4,i-4)
             plt.plot(data[:500,i])
@@ -241,10 +372,12 @@ def get_delta_angs(x_data, y_data):
     return y_delta
 
 
-def get_obs_and_delta_actions(norm_obs=True, norm_acts=False, fly=False):
+def get_obs_and_delta_actions(norm_obs=True, norm_acts=False, fly=False, obs_rms_from_refs=False):
     """
     Loads the SL data extracted from the reference trajectories,
     calculates the action deltas and normalizes the observations.
+    :param obs_rms_from_refs: normalize the observations with statistics calculated
+                              from the refs instead of the obs_rms saved in cfg.init_obs_rms_path
     """
     # get data
     x_data, y_data = get_data(fly=fly)
@@ -253,7 +386,7 @@ def get_obs_and_delta_actions(norm_obs=True, norm_acts=False, fly=False):
     if norm_obs:
         from scripts.behavior_cloning.obs_rms import get_obs_rms
         # normalize x_data by mean and var
-        x_mean, x_var = get_obs_rms(True)
+        x_mean, x_var = get_obs_rms(True, from_refs=obs_rms_from_refs, fly=fly)
         x_data_normed = (x_data - x_mean) / np.sqrt(x_var + 1e-4)
         assert (np.abs((x_data - x_data_normed)) > 0.0000001).all(), \
             'Observation Normalization had no effect!'
@@ -6,9 +6,12 @@ from matplotlib import pyplot as plt
 from stable_baselines import PPO2
 from scripts.behavior_cloning.dataset import get_obs_and_delta_actions
 
-def load_weights():
+def load_weights(fly=None):
+    """:param fly: load the weights trained without ground contact,
+                  defaults to the fly mode of the default run config."""
     import h5py
-    if cfg.is_mod(cfg.MOD_FLY):
+    if fly is None: fly = cfg.default_run_config().fly
+    if fly:
         weights_file = h5py.File(cfg.abs_project_path
                                  + 'models/behav_clone/models/best/'
                                    'MAE_const_ortho_l2_actnormFLY_ep200', 'r')
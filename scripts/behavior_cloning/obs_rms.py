@@ -1,4 +1,5 @@
-from scripts.behavior_cloning.dataset import get_refs, get_refs_stats
+import pickle
+from scripts.behavior_cloning.dataset import get_data, get_refs
 from scripts.common.utils import vec_env, log
 from scripts.common import config as cfg
 
@@ -9,60 +10,79 @@ import numpy as np
 OVERWRITE_OBS_RMS = False
 DEBUG = False
 
-def get_obs_rms(do_log=False):
-    """:returns (mean, var) of pretrained obs_rms. Path defined in cfg.
-    Pretrained statistics might come from refs or from previous runs."""
-    model_path = cfg.init_obs_rms_path
-    env = vec_env(cfg.env_id, norm_rew=True, num_envs=cfg.n_envs,
-                  deltas=cfg.is_mod(cfg.MOD_PI_OUT_DELTAS), load_path=model_path)
+# loaded statistics, path -> (mean, var)
+_obs_rms_cache = {}
+
+
+def load_obs_rms(path=None):
+    """
+    Loads the observation running mean and variance of a VecNormalize saved with env.save()
+    directly from the pickle file without creating any environment.
+    :returns (mean, var) of the saved obs_rms
+    """
+    if path is None: path = cfg.init_obs_rms_path
+    if path not in _obs_rms_cache:
+        with open(path, 'rb') as file:
+            vec_normalize = pickle.load(file)
+        obs_rms = vec_normalize.obs_rms
+        _obs_rms_cache[path] = (np.array(obs_rms.mean), np.array(obs_rms.var))
+    mean, var = _obs_rms_cache[path]
+    return np.copy(mean), np.copy(var)
+
+
+def get_refs_obs_stats(fly=False):
+    """
+    Observation statistics calculated from the reference trajectories
+    including the phase variable and the desired walking speed.
+    :returns (mean, var) over all points of the behavior cloning dataset
+    """
+    x_data, _ = get_data(fly=fly)
+    return np.mean(x_data, axis=0), np.var(x_data, axis=0)
+
+
+def get_obs_rms(do_log=False, path=None, from_refs=False, fly=False):
+    """:returns (mean, var) of pretrained obs_rms. Path defined in cfg if not specified.
+    Pretrained statistics might come from refs or from previous runs.
+    :param from_refs: calculate the statistics from the reference trajectories instead"""
+    if from_refs:
+        mean, var = get_refs_obs_stats(fly)
+        source = 'reference trajectories'
+    else:
+        if path is None: path = cfg.init_obs_rms_path
+        mean, var = load_obs_rms(path)
+        source = path
 
     if do_log: log('Successfully loaded pretrained OBS_RMS:',
-                   [f'object:\t {env.obs_rms}',
-                    f'mean:\t {env.obs_rms.mean}',
-                    f'var:\t {env.obs_rms.var}'])
+                   [f'source:\t {source}',
+                    f'mean:\t {mean}',
+                    f'var:\t {var}'])
 
-    return env.obs_rms.mean, env.obs_rms.var
+    return mean, var
 
 
-# TODO: NOT USING OBS_STDS FROM REFERENCE TRAJECTORIES BUT FROM A PREVIOUS RUN.
 if __name__ == '__main__':
-    # build VecNormalize wrapped Environment
-    env = vec_env(cfg.env_id, norm_rew=True, num_envs=cfg.n_envs,
-                            deltas=cfg.is_mod(cfg.MOD_PI_OUT_DELTAS))
-    # get refs statistics
-    ref_means, ref_vars, ref_stds = get_refs_stats(None, False, False)
-    # add phase variable statistics
-    phase = np.linspace(0, 1, 250)
-    phase_mean, phase_var = np.mean(phase), np.var(phase)
-    # add desired walking speed statistics
-    walk_speeds = get_refs()._calculate_walking_speed()
-    speed_mean, speed_var = np.mean(walk_speeds), np.var(walk_speeds)
-    # concatenate means and vars
-    ref_means = np.concatenate([np.array([phase_mean, speed_mean]), ref_means])
-    ref_vars = np.concatenate([np.array([phase_var, speed_var]), ref_vars])
+    # get refs statistics incl. phase variable and desired walking speed
+    ref_means, ref_vars = get_refs_obs_stats()
 
     if DEBUG:
-        plt.subplot(1,2,1)
-        plt.title('Phase Variable Statistics')
-        plt.plot(phase)
-        plt.plot(range(250), np.ones((250,))*phase_mean)
-        plt.fill_between(range(250), phase_mean - np.sqrt(phase_var),
-                         phase_mean + np.sqrt(phase_var), alpha=0.25)
-        plt.subplot(1,2,2)
-        plt.title('Walking Speed Statistics')
-        plt.plot(walk_speeds)
-        x_len = len(walk_speeds)
-        plt.plot(range(x_len), np.ones((x_len,)) * speed_mean)
-        plt.fill_between(range(x_len), speed_mean - np.sqrt(speed_var),
-                         speed_mean + np.sqrt(speed_var), alpha=0.25)
+        x_data, _ = get_data()
+        for i, title in enumerate(['Phase Variable Statistics', 'Walking Speed Statistics']):
+            plt.subplot(1,2,i+1)
+            plt.title(title)
+            x_len = len(x_data)
+            plt.plot(x_data[:, i])
+            plt.plot(range(x_len), np.ones((x_len,)) * ref_means[i])
+            plt.fill_between(range(x_len), ref_means[i] - np.sqrt(ref_vars[i]),
+                             ref_means[i] + np.sqrt(ref_vars[i]), alpha=0.25)
         plt.show()
 
-    # compare
-    labels = get_refs().get_kinematics_labels()
+    # compare with the statistics of a previous run
+    qpos_labels, qvel_labels = get_refs().get_kinematics_labels(concat=False)
+    # COM x position is not part of the observations
+    labels = np.concatenate([['phase', 'des_speed'], qpos_labels[1:], qvel_labels])
     refs_mean = ref_means
     refs_var = ref_vars
-    run_mean = env.obs_rms.mean
-    run_var = env.obs_rms.var
+    run_mean, run_var = load_obs_rms()
 
     deltas_mean = np.abs(run_mean - ref_means)
     deltas_var = np.abs(run_var - ref_vars)
@@ -74,8 +94,10 @@ if __name__ == '__main__':
         print('\n', label)
         print('delta_prct \t delta_mean \t run_mean \t ref_mean')
         print('%d \t\t\t %.3f \t\t\t %.3f \t\t\t %.3f' % (deltas_mean_prct[i], deltas_mean[i], run_mean[i], refs_mean[i]))
-    if not OVERWRITE_OBS_RMS: SystemExit('Expectedly finished script W/O saving new refs!')
+    if not OVERWRITE_OBS_RMS: raise SystemExit('Expectedly finished script W/O saving new refs!')
 
+    # a single environment is only required to save the statistics in the VecNormalize format
+    env = vec_env(cfg.env_id, norm_rew=True, num_envs=1)
     env.obs_rms.mean = ref_means
     env.obs_rms.var = ref_vars
 
@@ -1,67 +1,203 @@
 """
-Optimizes the PD gains of the MimicWalker2D Env using optuna
-ATTENTION:
-    + change ref_trajecs.get_random_init_state() to return a fixed step at position 0
-    + set PD_TUNING = True in monitor.py
-    + we've chosen the best parameters based on reward weights 6400
+Optimizes the PD gains of the MimicWalker2D Env using optuna.
+
+The trials are evaluated concurrently by a pool of worker processes
+sharing a single optuna study stored in a sqlite database.
+Each worker keeps one warm environment and evaluates its trials on it.
+The workers are forked after the reference trajectories were loaded once in the main process.
+A trial is pruned as soon as its cumulative reward can no longer reach the best trial
+or the optuna pruner decides it's not promising compared to the other trials.
+We've chosen the best parameters based on reward weights 6400.
+
+Usage (from the project root):
+    python -m scripts.behavior_cloning.optimize_pd_gains --n-trials 1000 --workers 8
+    python -m scripts.behavior_cloning.optimize_pd_gains --rew-weights 6400 --fixed-init
+    python -m scripts.behavior_cloning.optimize_pd_gains --show-best   # plot the best trial
 """
+import argparse, os, time
+import multiprocessing as mp
 import gym, optuna, numpy as np
 # necessary to import custom gym environments
 import gym_mimic_envs
+from gym_mimic_envs import monitor
 from gym_mimic_envs.monitor import Monitor
+from gym_mimic_envs.ref_playback import set_pd_gains
 from scripts.common import config as cfg
+from scripts.common.utils import log
+
+STUDY_NAME = 'pd_gains'
+STUDY_PATH = cfg.abs_project_path + 'graphs/optuna/'
+# number of env steps each trial is evaluated on
+N_EVAL_STEPS = 2000
+# report the cumulative reward to the pruner every n steps
+REPORT_EVERY = 100
 
+# the warm environment of each worker process
+_env = None
 
-RENDER = False
 
-# set config params
-cfg.modification = cfg.MOD_CUSTOM_POLICY
-cfg.rew_weights = "2800"
-print(f'1000, 5 FSkip')
-print('Random Initialization')
-print('reward weights:', cfg.rew_weights)
+def make_run_config(rew_weights):
+    return cfg.build_run_config(cfg.MOD_CUSTOM_POLICY, rew_weights=rew_weights,
+                                env_id=cfg.env_ids[0], env_abbrev=cfg.env_abbrevs[0],
+                                env_is3d=False, env_out_torque=False)
 
-env = gym.make('MimicWalker2d-v0')
-env = Monitor(env)
 
-if not isinstance(env, Monitor):
-    # VecNormalize wrapped DummyVecEnv
-    vec_env = env
-    env = env.venv.envs[0]
+def make_env(run_cfg, monitored=False):
+    env = gym.make(run_cfg.env_id, run_cfg=run_cfg)
+    if monitored: env = Monitor(env)
+    env.reset()
+    env.do_fly()
+    env.activate_evaluation()
+    return env
 
-obs = env.reset()
-env.do_fly()
-env.activate_evaluation()
 
-def objective(trial: optuna.Trial):
+def suggest_gains(trial: optuna.Trial):
+    """ :returns the PD gains and dampings of all actuated joints suggested by the trial """
     k_hip = trial.suggest_uniform('k_hip', 0, 5000)
     k_knee = trial.suggest_uniform('k_knee', 0, 4000)
     k_ankle = trial.suggest_uniform('k_ankle', 0, 4000)
     d_hip = trial.suggest_uniform('d_hip', 0, 10)
     d_knee = trial.suggest_uniform('d_knee', 0, 8)
     d_ankle = trial.suggest_uniform('d_ankle', 0, 8)
-    gains = [k_hip, k_knee, k_ankle] * 2
-    dampings = [d_hip, d_knee, d_ankle] * 2
-
-    # set pd gains
-    env.model.actuator_gainprm[:,0] = gains
-    env.model.dof_damping[3:] = dampings
+    return [k_hip, k_knee, k_ankle] * 2, [d_hip, d_knee, d_ankle] * 2
 
-    # collect rewards as evaluation metric
-    rewards = []
 
+def reset(env, fixed_init=False):
+    """ Resets the env, with fixed_init always to the beginning of the first step. """
     env.reset()
-    for i in range(2000):
-        # follow desired trajecs with PD Position Controllers
+    if fixed_init:
+        env.refs.reset()
+        env.set_state(env.refs.get_qpos(), env.refs.get_qvel())
+        # same as in MimicEnv.reset_model()
+        env.refs.next()
+
+
+def get_best_value(study):
+    try: return study.best_value
+    except ValueError: return None
+
+
+def evaluate(env, trial, n_steps=N_EVAL_STEPS, fixed_init=False, report_every=REPORT_EVERY):
+    """
+    Follows the reference trajectories with the PD position controllers.
+    :returns the cumulative reward
+    :raises optuna.TrialPruned when the trial can't be better than the best one so far
+    """
+    run_cfg = env._cfg
+    # highest possible reward of a single step during evaluation
+    max_step_rew = run_cfg.rew_scale + run_cfg.alive_bonus
+    best_value = get_best_value(trial.study)
+    cum_reward = 0
+    reset(env, fixed_init)
+    for i in range(n_steps):
         des_qpos = env.get_ref_qpos(exclude_not_actuated_joints=True)
         obs, reward, done, _ = env.step(des_qpos)
-        rewards.append(reward)
-        if RENDER: env.render()
+        cum_reward += reward
+        if (i + 1) % report_every == 0:
+            trial.report(cum_reward, i)
+            # hopelessly behind: even perfect remaining steps can't reach the best trial
+            if best_value is not None and \
+                    cum_reward + (n_steps - i - 1) * max_step_rew < best_value:
+                raise optuna.TrialPruned()
+            if trial.should_prune(): raise optuna.TrialPruned()
+            # trials of the other workers might have finished in the meantime
+            best_value = get_best_value(trial.study)
+    return cum_reward
+
+
+def objective(trial: optuna.Trial, n_steps=N_EVAL_STEPS, fixed_init=False):
+    gains, dampings = suggest_gains(trial)
+    set_pd_gains(_env, gains, dampings)
+    return evaluate(_env, trial, n_steps, fixed_init)
+
+
+def _optimize_worker(rew_weights, storage, pruner, n_trials, n_steps, fixed_init, seed):
+    """ Runs n_trials of the shared study on a warm env of this process.
+        :param pruner: optuna doesn't save the pruner in the storage, it has to be passed again """
+    global _env
+    np.random.seed(seed)
+    run_cfg = make_run_config(rew_weights)
+    cfg.set_default_run_config(run_cfg)
+    _env = make_env(run_cfg)
+    study = optuna.load_study(study_name=STUDY_NAME, storage=storage, pruner=pruner,
+                              sampler=optuna.samplers.TPESampler(seed=seed))
+    study.optimize(lambda trial: objective(trial, n_steps, fixed_init), n_trials=n_trials)
+    _env.close()
+
+
+def show_best(study, rew_weights, n_steps, fixed_init):
+    """ Plots the sim and ref trajectories of the best trial. """
+    monitor.PD_TUNING = True
+    run_cfg = make_run_config(rew_weights)
+    cfg.set_default_run_config(run_cfg)
+    env = make_env(run_cfg, monitored=True)
+    params = study.best_params
+    set_pd_gains(env, [params['k_hip'], params['k_knee'], params['k_ankle']] * 2,
+              [params['d_hip'], params['d_knee'], params['d_ankle']] * 2)
+    reset(env, fixed_init)
+    # the Monitor shows its trajectory comparison when the buffer is filled
+    for i in range(max(n_steps, monitor._trajec_buffer_length)):
+        env.step(env.get_ref_qpos(exclude_not_actuated_joints=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n-trials', type=int, default=1000, help='total number of trials')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument('--n-steps', type=int, default=N_EVAL_STEPS,
+                        help='env steps to evaluate each trial on')
+    parser.add_argument('--rew-weights', default='2800')
+    parser.add_argument('--fixed-init', action='store_true',
+                        help='start each trial at the beginning of the first ref step '
+                             'instead of the deterministic evaluation init states')
+    parser.add_argument('--storage', default=None,
+                        help=f'optuna storage url, default sqlite db in {STUDY_PATH}')
+    parser.add_argument('--no-pruning', action='store_true',
+                        help='only prune trials that can no longer reach the best one')
+    parser.add_argument('--show-best', action='store_true',
+                        help='plot the trajectories of the best trial of the stored study and exit')
+    parser.add_argument('--seed', type=int, default=33)
+    args = parser.parse_args()
+
+    storage = args.storage
+    if storage is None:
+        os.makedirs(STUDY_PATH, exist_ok=True)
+        storage = f'sqlite:///{STUDY_PATH}{STUDY_NAME}_{args.rew_weights}.db'
+    pruner = optuna.pruners.NopPruner() if args.no_pruning else \
+        optuna.pruners.MedianPruner(n_startup_trials=10, n_warmup_steps=args.n_steps // 4)
+    study = optuna.create_study(study_name=STUDY_NAME, storage=storage, direction='maximize',
+                                pruner=pruner, load_if_exists=True)
+    if args.show_best:
+        show_best(study, args.rew_weights, args.n_steps, args.fixed_init)
+        return
+
+    log('Optimizing PD gains:', [f'trials:\t {args.n_trials}', f'workers:\t {args.workers}',
+                                 f'reward weights:\t {args.rew_weights}',
+                                 f'init:\t {"fixed" if args.fixed_init else "deterministic"}',
+                                 f'storage:\t {storage}'])
+
+    # load the reference trajectories once, the forked workers inherit them
+    run_cfg = make_run_config(args.rew_weights)
+    cfg.set_default_run_config(run_cfg)
+    make_env(run_cfg).close()
+
+    t_start = time.perf_counter()
+    n_workers = min(args.workers, args.n_trials)
+    trials_per_worker = np.diff(np.linspace(0, args.n_trials, n_workers + 1).astype(int))
+    ctx = mp.get_context('fork')
+    workers = [ctx.Process(target=_optimize_worker,
+                           args=(args.rew_weights, storage, pruner, int(n_trials),
+                                 args.n_steps, args.fixed_init, args.seed + i_worker))
+               for i_worker, n_trials in enumerate(trials_per_worker)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
 
-    return np.sum(rewards)
+    n_pruned = len([trial for trial in study.trials if trial.state == optuna.trial.TrialState.PRUNED])
+    log(f'Finished {len(study.trials)} trials in {time.perf_counter() - t_start:.0f}s '
+        f'({n_pruned} pruned):', [f'best reward:\t {study.best_value}',
+                                  f'best params:\t {study.best_params}'])
 
-# optimize
-study = optuna.create_study(direction='maximize')
-study.optimize(objective, n_trials=1000)
 
-env.close()
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ from tensorflow.keras import layers
 from matplotlib import pyplot as plt
 
 from sklearn.model_selection import train_test_split
-from scripts.behavior_cloning.dataset import get_obs_and_delta_actions
+from scripts.behavior_cloning.dataset import get_obs_and_delta_actions, noisy_minibatches
 
 from scripts.common import config as cfg
 
@@ -15,6 +15,11 @@ SHUFFLE = True
 EPOCHS = 200
 LEARN_RATE0 = 0.01
 LEARN_RATE1 = 0.0005
+# train on noisy copies of the training data streamed in minibatches
+AUGMENT_WITH_NOISE = False
+NOISE_STD = 1
+N_NOISY_SAMPLES_PER_EPOCH = int(1e6)
+BATCH_SIZE = 512
 
 def build_model(state_dim, act_dim):
     model = keras.Sequential()
@@ -83,9 +88,16 @@ if __name__ == '__main__':
     lr_decay_callback = keras.callbacks.LearningRateScheduler(linear_lr_schedule)
 
     # train model
-    history = model.fit(x_train, y_train, epochs=EPOCHS, verbose=1,
-                        validation_data=(x_val, y_val),
-                        callbacks=[save_best_callback, lr_decay_callback])
+    if AUGMENT_WITH_NOISE:
+        train_batches = noisy_minibatches(x_train, y_train, BATCH_SIZE, NOISE_STD)
+        history = model.fit(train_batches, epochs=EPOCHS, verbose=1,
+                            steps_per_epoch=N_NOISY_SAMPLES_PER_EPOCH // BATCH_SIZE,
+                            validation_data=(x_val, y_val),
+                            callbacks=[save_best_callback, lr_decay_callback])
+    else:
+        history = model.fit(x_train, y_train, epochs=EPOCHS, verbose=1,
+                            validation_data=(x_val, y_val),
+                            callbacks=[save_best_callback, lr_decay_callback])
 
     # evaluate the model
     train_metrics = model.evaluate(x_train, y_train, verbose=0)
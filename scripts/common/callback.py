@@ -1,19 +1,14 @@
-from os import makedirs, remove, rename
+from os import makedirs
 import tensorflow as tf
 import numpy as np
 import wandb
 
 from stable_baselines import PPO2
-from scripts.common import config as cfg, utils
+from scripts.common import config as cfg, utils, perf
+from scripts.common.checkpoints import CheckpointManager
+from scripts.mocap import rsi_sampler
 from stable_baselines.common.callbacks import BaseCallback
 
-# define intervals/criteria for saving the model
-# save everytime the agent achieved an additional 10% of the max possible return
-MAX_RETURN = cfg.ep_dur_max * 1 * cfg.rew_scale
-EP_RETURN_INCREMENT = 0.1 * MAX_RETURN
-# 10% of max possible reward
-MEAN_REW_INCREMENT = 0.1 * cfg.rew_scale
-
 # define evaluation interval
 EVAL_MORE_FREQUENT_THRES = 3.2e6
 EVAL_INTERVAL_RARE = 400e3 if not cfg.DEBUG else 10e3
@@ -22,8 +17,19 @@ EVAL_INTERVAL_MOST_FREQUENT = 100e3
 EVAL_INTERVAL = EVAL_INTERVAL_RARE
 
 class TrainingMonitor(BaseCallback):
-    def __init__(self, verbose=0):
+    def __init__(self, run_cfg:cfg.RunConfig=None, verbose=0, checkpoints:CheckpointManager=None):
         super(TrainingMonitor, self).__init__(verbose)
+        # configuration of the monitored run
+        self.run_cfg = run_cfg if run_cfg is not None else cfg.default_run_config()
+        # define criteria for saving the model
+        # save everytime the agent achieved an additional 10% of the max possible return
+        self.max_return = self.run_cfg.ep_dur_max * 1 * self.run_cfg.rew_scale
+        self.ep_return_increment = 0.1 * self.max_return
+        # 10% of max possible reward
+        self.mean_rew_increment = 0.1 * self.run_cfg.rew_scale
+        # writes the checkpoints in the background and applies the retention policy
+        self.checkpoints = checkpoints if checkpoints is not None \
+            else CheckpointManager(self.run_cfg.save_path)
         # to control how often to save the model
         self.times_surpassed_ep_return_threshold = 0
         self.times_surpassed_mean_reward_threshold = 0
@@ -46,12 +52,17 @@ class TrainingMonitor(BaseCallback):
         # log data less frequently
         self.skip_n_steps = 100
         self.skipped_steps = 99
+        # export timing statistics of the hot paths (only if perf timing is enabled)
+        self.last_perf_log_timestep = 0
+        # adaptive RSI statistics merged from all envs (see scripts/mocap/rsi_sampler.py)
+        self.rsi_counts = None
+        self.last_rsi_sync_timestep = 0
 
     def _on_training_start(self) -> None:
         self.env = self.training_env
 
     def _on_step(self) -> bool:
-        if cfg.DEBUG and self.num_timesteps > cfg.MAX_DEBUG_STEPS:
+        if self.run_cfg.debug and self.num_timesteps > cfg.MAX_DEBUG_STEPS:
             raise SystemExit(f"Planned Exit after {cfg.MAX_DEBUG_STEPS} due to Debugging mode!")
 
         # reset the collection of episode lengths after 1M steps
@@ -62,18 +73,27 @@ class TrainingMonitor(BaseCallback):
             self.env.set_attr('et_phases', [])
             self.env.set_attr('difficult_rsi_phases', [])
 
-        self.n_steps_after_eval += 1 * cfg.n_envs
+        self.n_steps_after_eval += 1 * self.run_cfg.n_envs
 
         # skip n steps to reduce logging interval and speed up training
         if self.skipped_steps < self.skip_n_steps:
             self.skipped_steps += 1
             return True
 
+        if perf.is_enabled() and \
+                self.num_timesteps - self.last_perf_log_timestep >= cfg.PERF_LOG_INTERVAL:
+            self.log_perf_stats()
+
+        if self.run_cfg.adaptive_rsi and \
+                self.num_timesteps - self.last_rsi_sync_timestep >= cfg.RSI_SYNC_INTERVAL:
+            self.sync_rsi_sampler()
+
         global EVAL_INTERVAL
 
-        if self.n_steps_after_eval >= EVAL_INTERVAL and not cfg.DEBUG:
+        if self.n_steps_after_eval >= EVAL_INTERVAL and not self.run_cfg.debug:
             self.n_steps_after_eval = 0
-            walking_stably = self.eval_walking()
+            with perf.span('callback/eval'):
+                walking_stably = self.eval_walking()
             # terminate training when stable walking has been learned
             if walking_stably:
                 import wandb
@@ -99,10 +119,13 @@ class TrainingMonitor(BaseCallback):
         mean_rew = self.get_mean('mean_reward_smoothed')
 
         # avoid logging data during first episode
-        if ep_len < {400: 60, 200:30, 50:8, 100:15}[cfg.CTRL_FREQ]:
+        ctrl_freq = self.run_cfg.ctrl_freq
+        if ep_len < {400: 60, 200:30, 50:8, 100:15}.get(ctrl_freq, 0.15 * ctrl_freq):
             return True
 
-        if not cfg.DEBUG: self.log_to_tb(mean_rew, ep_len, ep_ret)
+        if not self.run_cfg.debug:
+            with perf.span('callback/log_to_tb'):
+                self.log_to_tb(mean_rew, ep_len, ep_ret)
         # do not save a model if its episode length was too short
         if ep_len > 1500:
             self.save_model_if_good(mean_rew, ep_ret)
@@ -113,6 +136,43 @@ class TrainingMonitor(BaseCallback):
         return True
 
 
+    def log_perf_stats(self):
+        """ Collects the timings of this process and all env processes
+            and logs them to tensorboard (synced to wandb) under perf/. """
+        self.last_perf_log_timestep = self.num_timesteps
+        try: env_stats = self.env.env_method('get_perf_stats')
+        except AttributeError: env_stats = []
+        stats = perf.merge([perf.pop_stats()] + env_stats)
+        writer = self.locals.get('writer')
+        if writer is None or not stats: return
+        logs = [tf.Summary.Value(tag=tag, simple_value=value)
+                for tag, value in perf.summarize(stats)]
+        writer.add_summary(tf.Summary(value=logs), self.num_timesteps)
+
+
+    def sync_rsi_sampler(self):
+        """ Merges the adaptive RSI counts of all envs, sends them back to the envs
+            and logs the resulting initial state distribution to wandb. """
+        self.last_rsi_sync_timestep = self.num_timesteps
+        new_counts = [counts for counts in self.env.env_method('pop_rsi_counts')
+                      if counts is not None]
+        if not new_counts: return
+        if self.rsi_counts is None:
+            self.rsi_counts = (np.zeros_like(new_counts[0][0]), np.zeros_like(new_counts[0][1]))
+        self.rsi_counts = rsi_sampler.merge_counts(*self.rsi_counts, new_counts)
+        self.env.env_method('set_rsi_counts', *self.rsi_counts)
+
+        if self.run_cfg.debug: return
+        distribution = self.env.env_method('get_rsi_distribution', indices=[0])[0]
+        n_steps, n_phase_bins = distribution.shape
+        wandb.log({'_hist/adaptive_rsi_phases': wandb.Histogram(np_histogram=(
+                       np.sum(distribution, axis=0), np.linspace(0, 1, n_phase_bins + 1))),
+                   '_hist/adaptive_rsi_steps': wandb.Histogram(np_histogram=(
+                       np.sum(distribution, axis=1), np.arange(n_steps + 1))),
+                   'rsi/max_cell_probability_x_n_cells': np.max(distribution) * distribution.size},
+                  step=self.num_timesteps)
+
+
     def get_mean(self, attribute_name):
         try:
             values = self.env.get_attr(attribute_name)
@@ -122,6 +182,7 @@ class TrainingMonitor(BaseCallback):
 
 
     def log_to_tb(self, mean_rew, ep_len, ep_ret):
+        run_cfg = self.run_cfg
         moved_distance = self.get_mean('moved_distance_smooth')
         mean_abs_torque_smoothed = self.get_mean('mean_abs_ep_torque_smoothed')
 
@@ -152,13 +213,14 @@ class TrainingMonitor(BaseCallback):
                 #                  simple_value=),
 
                 tf.Summary.Value(tag='_train/1. moved distance (stochastic, smoothed 0.25)',
-                                 simple_value=moved_distance/cfg.max_distance),
+                                 simple_value=moved_distance/run_cfg.max_distance),
                 tf.Summary.Value(tag='_train/2. episode length (smoothed 0.75)',
-                                 simple_value=ep_len/cfg.ep_dur_max),
+                                 simple_value=ep_len/run_cfg.ep_dur_max),
                 tf.Summary.Value(tag='_train/3. step reward (smoothed 0.25)',
-                                 simple_value=(mean_rew-cfg.alive_bonus)/cfg.rew_scale),
+                                 simple_value=(mean_rew-run_cfg.alive_bonus)/run_cfg.rew_scale),
                 tf.Summary.Value(tag='_train/4. episode return (smoothed 0.75)',
-                                 simple_value=(ep_ret-ep_len*cfg.alive_bonus)/(cfg.ep_dur_max*cfg.rew_scale)),
+                                 simple_value=(ep_ret-ep_len*run_cfg.alive_bonus)
+                                              /(run_cfg.ep_dur_max*run_cfg.rew_scale)),
 
                 # tf.Summary.Value(tag='acts/2. mean abs episode joint torques (smoothed 0.75)',
                 #                  simple_value=mean_abs_torque_smoothed)
@@ -171,18 +233,18 @@ class TrainingMonitor(BaseCallback):
             mean_ep_pos_rew = self.get_mean('mean_ep_pos_rew_smoothed')
             mean_ep_vel_rew = self.get_mean('mean_ep_vel_rew_smoothed')
             mean_ep_com_rew = self.get_mean('mean_ep_com_rew_smoothed')
-            logs += [tf.Summary.Value(tag=f'_rews/1. mean ep pos rew ({cfg.n_envs}envs, smoothed 0.9)',
+            logs += [tf.Summary.Value(tag=f'_rews/1. mean ep pos rew ({run_cfg.n_envs}envs, smoothed 0.9)',
                                       simple_value=mean_ep_pos_rew),
-                     tf.Summary.Value(tag=f'_rews/2. mean ep vel rew ({cfg.n_envs}envs, smoothed 0.9)',
+                     tf.Summary.Value(tag=f'_rews/2. mean ep vel rew ({run_cfg.n_envs}envs, smoothed 0.9)',
                                       simple_value=mean_ep_vel_rew),
-                     tf.Summary.Value(tag=f'_rews/3. mean ep com rew ({cfg.n_envs}envs, smoothed 0.9)',
+                     tf.Summary.Value(tag=f'_rews/3. mean ep com rew ({run_cfg.n_envs}envs, smoothed 0.9)',
                                       simple_value=mean_ep_com_rew),
                      ]
 
             model = self.model
             parameters = model.get_parameter_list()
             parameters = [param for param in parameters if 'logstd' in param.name]
-            if cfg.is_mod(cfg.MOD_CONST_EXPLORE):
+            if run_cfg.const_explore:
                 logstd = cfg.init_logstd
             else:
                 logstd = np.array(model.sess.run(parameters))[0]
@@ -256,29 +318,30 @@ class TrainingMonitor(BaseCallback):
 
 
     def save_model_if_good(self, mean_rew, ep_ret):
-        if cfg.DEBUG: return
+        if self.run_cfg.debug: return
         def get_mio_timesteps():
             return int(self.num_timesteps/1e6)
 
-        ep_ret_thres = 0.6 * MAX_RETURN \
-                       + int(EP_RETURN_INCREMENT * (self.times_surpassed_ep_return_threshold + 1))
+        ep_ret_thres = 0.6 * self.max_return \
+                       + int(self.ep_return_increment * (self.times_surpassed_ep_return_threshold + 1))
         if ep_ret > ep_ret_thres:
-            utils.save_model(self.model, cfg.save_path,
-                             'ep_ret' + str(ep_ret_thres) + f'_{get_mio_timesteps()}M')
+            # pinned, these checkpoints are kept for the whole training
+            self.checkpoints.save(self.model, 'ep_ret' + str(ep_ret_thres) + f'_{get_mio_timesteps()}M',
+                                  timestep=self.num_timesteps, pinned=True)
             self.times_surpassed_ep_return_threshold += 1
-            print(f'NOT Saving model after surpassing EPISODE RETURN of {ep_ret_thres}.')
+            print(f'Saving model after surpassing EPISODE RETURN of {ep_ret_thres}.')
             # print('Model Path: ', cfg.save_path)
 
         # normalize reward
-        mean_rew = (mean_rew - cfg.alive_bonus)/cfg.rew_scale
-        mean_rew_thres = 0.4 * cfg.rew_scale \
-                         + MEAN_REW_INCREMENT * (self.times_surpassed_mean_reward_threshold + 1)
+        mean_rew = (mean_rew - self.run_cfg.alive_bonus)/self.run_cfg.rew_scale
+        mean_rew_thres = 0.4 * self.run_cfg.rew_scale \
+                         + self.mean_rew_increment * (self.times_surpassed_mean_reward_threshold + 1)
         if mean_rew > (mean_rew_thres):
             # utils.save_model(self.model, cfg.save_path,
             #                  'mean_rew' + str(int(100*mean_rew_thres)) + f'_{get_mio_timesteps()}M')
             self.times_surpassed_mean_reward_threshold += 1
             print(f'NOT Saving model after surpassing MEAN REWARD of {mean_rew_thres}.')
-            print('Model Path: ', cfg.save_path)
+            print('Model Path: ', self.run_cfg.save_path)
 
 
     def eval_walking(self):
@@ -287,16 +350,18 @@ class TrainingMonitor(BaseCallback):
         How far does it walk (in average and at least) without falling?
         @returns: If the training can be stopped as stable walking was achieved.
         """
+        run_cfg = self.run_cfg
         moved_distances, mean_rewards, ep_durs, mean_com_x_vels = [], [], [], []
         # save current model
         checkpoint = f'{int(self.num_timesteps/1e5)}'
-        model_path, env_path = \
-            utils.save_model(self.model, cfg.save_path, checkpoint, full=False)
+        model_path, _ = self.checkpoints.save(self.model, checkpoint, timestep=self.num_timesteps)
+        # the evaluation loads the checkpoint from disk
+        self.checkpoints.wait()
 
         # load current model
         eval_model = PPO2.load(load_path=model_path)
 
-        eval_env = utils.load_env(checkpoint, cfg.save_path, cfg.env_id)
+        eval_env = utils.load_env(checkpoint, run_cfg.save_path, run_cfg.env_id, run_cfg)
         mimic_env = eval_env.venv.envs[0].env
         mimic_env.activate_evaluation()
 
@@ -316,7 +381,7 @@ class TrainingMonitor(BaseCallback):
                     moved_distances.append(walked_distance)
                     mean_rewards.append(np.mean(rewards))
                     ep_durs.append(ep_dur)
-                    mean_com_x_vel = walked_distance/(ep_dur/cfg.CTRL_FREQ)
+                    mean_com_x_vel = walked_distance/(ep_dur/run_cfg.ctrl_freq)
                     mean_com_x_vels.append(mean_com_x_vel)
                     break
                 else:
@@ -331,7 +396,7 @@ class TrainingMonitor(BaseCallback):
         self.moved_distances = moved_distances
         self.mean_walked_distance = np.mean(moved_distances)
         self.min_walked_distance = np.min(moved_distances)
-        self.mean_episode_duration = np.mean(ep_durs)/cfg.ep_dur_max
+        self.mean_episode_duration = np.mean(ep_durs)/run_cfg.ep_dur_max
         self.min_episode_duration = np.min(ep_durs)
 
         # calculate mean walking speed
@@ -341,13 +406,13 @@ class TrainingMonitor(BaseCallback):
         # calculate the average mean reward
         self.mean_reward_means = np.mean(mean_rewards)
         # normalize it
-        self.mean_reward_means = (self.mean_reward_means - cfg.alive_bonus)/cfg.rew_scale
+        self.mean_reward_means = (self.mean_reward_means - run_cfg.alive_bonus)/run_cfg.rew_scale
 
         # how many times 20m were reached
         runs_below_20 = np.where(np.array(moved_distances) < 20)[0]
         runs_20m = eval_n_times - len(runs_below_20)
         runs_no_falling = np.where(
-            (np.array(ep_durs) == cfg.ep_dur_max)
+            (np.array(ep_durs) == run_cfg.ep_dur_max)
             & (np.array(moved_distances) >= 18))[0]
         if eval_n_times == cfg.EVAL_N_TIMES:
             self.failed_eval_runs_indices = runs_below_20.tolist()
@@ -356,7 +421,7 @@ class TrainingMonitor(BaseCallback):
             EVAL_INTERVAL_RARE if self.num_timesteps < EVAL_MORE_FREQUENT_THRES else
             EVAL_INTERVAL_FREQUENT)
         self.summary_score += dt * 4 * self.mean_reward_means ** 2 \
-                              * (self.count_stable_walks / cfg.EVAL_N_TIMES) ** 4 \
+                              * (self.count_stable_walks / cfg.EVAL_N_TIMES) ** 4
 
         if False: # runs_20m >= 20 and not cfg.is_mod(cfg.MOD_MIRR_QUERY_VF_ONLY):
             cfg.modification += f'/{cfg.MOD_QUERY_VF_ONLY}'
@@ -364,10 +429,8 @@ class TrainingMonitor(BaseCallback):
                       [f'Stable walks: {runs_20m}',
                        f'Mean distance: {self.mean_walked_distance}'])
 
-        ## delete evaluation model if stable walking was not achieved yet
-        # or too many models were saved already
-        were_enough_models_saved = self.n_saved_models >= 5
-        # or walking was not human-like
+        ## only score the evaluation model if stable walking was achieved
+        # and walking was human-like, the best scored models are retained (see CheckpointManager)
         walks_humanlike = self.mean_reward_means >= 0.5 * (1+self.n_saved_models/10)
         # print('Mean rewards during evaluation of the deterministic model: ', mean_rewards)
         min_dist = int(self.min_walked_distance)
@@ -377,25 +440,23 @@ class TrainingMonitor(BaseCallback):
         # in average stable for 20 meters but not all 20 trials were over 20m
         has_reached_high_mean_distance = mean_dist > 20
         is_stable_humanlike_walking = self.count_stable_walks == eval_n_times and walks_humanlike
-        # retain the model if it is good else delete it
-        retain_model = is_stable_humanlike_walking and not were_enough_models_saved
+        # retain the model if it is good, otherwise it is deleted when it's not among the latest ones
+        retain_model = is_stable_humanlike_walking
         distances_report = [f'Min walked distance: {min_dist}m',
                             f'Mean walked distance: {mean_dist}m']
         if retain_model:
-            utils.log('Saving Model:', distances_report)
-            # rename model: add distances to the models names
-            dists = f'_min{min_dist}mean{mean_dist}'
-            new_model_path = model_path[:-4] + dists +'.zip'
-            new_env_path = env_path + dists
-            rename(model_path, new_model_path)
-            rename(env_path, new_env_path)
+            utils.log('Retaining Model:', distances_report)
             self.n_saved_models += 1
         else:
-            utils.log('Deleting Model:', distances_report +
+            utils.log('Not retaining Model:', distances_report +
                       [f'Mean step reward: {self.mean_reward_means}',
                        f'Runs below 20m: {runs_below_20}'])
-            remove(model_path)
-            remove(env_path)
+        # the retained models are ranked by the normalized mean reward of their own evaluation,
+        # the summary score accumulates over the training and would always favor the latest model
+        self.checkpoints.update(checkpoint, score=float(self.mean_reward_means) if retain_model else None,
+                                metrics={'min_dist': min_dist, 'mean_dist': mean_dist,
+                                         'mean_reward': float(self.mean_reward_means),
+                                         'stable_walks': int(self.count_stable_walks)})
 
         return is_stable_humanlike_walking
 
@@ -0,0 +1,185 @@
+"""
+Checkpoints of the model and the VecNormalize statistics, written in the background.
+
+The model and the env are serialized in memory on the training thread and written by a
+background thread to temporary files that are renamed atomically, so a crash never leaves
+a half-written checkpoint behind. Every checkpoint is listed in an index file
+(models/checkpoints.json) with its timestep, score and metrics. A retention policy keeps
+the best checkpoints by score, the latest ones and the pinned ones (e.g. init and final)
+and deletes all others. Scripts resolve 'best', 'latest' or a checkpoint name with resolve()
+and get the name the aliases refer to with resolve_name().
+The file names are the same as before (models/model_{name}.zip, envs/env_{name}).
+"""
+import io, os, json, time, pickle, queue, threading
+from os import path
+from scripts.common.utils import log
+
+INDEX_FILE = 'models/checkpoints.json'
+# retention policy: keep the checkpoints with the highest scores and the latest ones
+KEEP_BEST = 5
+KEEP_LAST = 2
+
+
+def get_model_path(name):
+    return f'models/model_{name}.zip'
+
+
+def get_env_path(name):
+    return f'envs/env_{name}'
+
+
+def _write_atomic(file_path, data):
+    """ Writes the bytes into a temporary file and renames it to the final path. """
+    os.makedirs(path.dirname(file_path), exist_ok=True)
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def load_index(save_path):
+    """ :returns dict: checkpoint name -> entry, empty if the run has no index """
+    try:
+        with open(path.join(save_path, INDEX_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def resolve_name(save_path, checkpoint='latest'):
+    """
+    :param checkpoint: 'best', 'latest' or the name of a checkpoint
+    :returns the name of the checkpoint in the index the aliases 'best' and 'latest' refer to,
+             other names are returned unchanged (also if they are not in the index)
+    """
+    checkpoint = str(checkpoint)
+    if checkpoint not in ['best', 'latest']: return checkpoint
+    index = load_index(save_path)
+    if not index: raise FileNotFoundError(f'No checkpoint index found in {save_path}')
+    if checkpoint == 'best':
+        scored = [(name, entry) for name, entry in index.items() if entry['score'] is not None]
+        if scored: return max(scored, key=lambda item: item[1]['score'])[0]
+        log('No scored checkpoint in the index, resolving the latest one instead.')
+    return max(index.items(), key=lambda item: (item[1]['timestep'] or 0, item[1]['time']))[0]
+
+
+def resolve(save_path, checkpoint='latest'):
+    """
+    :param checkpoint: 'best', 'latest' or the name of a checkpoint.
+                       Names not in the index are resolved to the default file names
+                       to load checkpoints saved before the index was introduced.
+    :returns the absolute (model_path, env_path) of the checkpoint
+    """
+    name = resolve_name(save_path, checkpoint)
+    entry = load_index(save_path).get(name, {'model_path': get_model_path(name),
+                                             'env_path': get_env_path(name)})
+    return path.join(save_path, entry['model_path']), path.join(save_path, entry['env_path'])
+
+
+class CheckpointManager:
+    def __init__(self, save_path, keep_best=KEEP_BEST, keep_last=KEEP_LAST):
+        self.save_path = save_path
+        self.keep_best = keep_best
+        self.keep_last = keep_last
+        # continue the index of a resumed run
+        self.index = load_index(save_path)
+        # the index is only modified by the writer thread, all changes are queued
+        self._jobs = queue.Queue()
+        self._writer = threading.Thread(target=self._write_jobs, daemon=True,
+                                        name='checkpoint_writer')
+        self._writer.start()
+
+    def save(self, model, name, timestep=None, pinned=False, score=None, metrics=None, upload=False):
+        """
+        Serializes the model and its VecNormalize env in memory and writes them in the background.
+        :param pinned: pinned checkpoints are never deleted by the retention policy
+        :param score: checkpoints with the highest scores are retained, unscored ones only if latest
+        :param upload: also save the files to wandb
+        :returns the absolute (model_path, env_path) the checkpoint will be written to,
+                 call wait() before reading them
+        """
+        model_buffer = io.BytesIO()
+        model.save(model_buffer)
+        # same bytes as VecNormalize.save(), the wrapped envs are not pickled
+        env_bytes = pickle.dumps(model.get_env())
+        entry = {'model_path': get_model_path(name), 'env_path': get_env_path(name),
+                 'timestep': timestep, 'time': time.time(), 'pinned': pinned,
+                 'score': score, 'metrics': metrics or {}}
+        self._jobs.put((self._write_checkpoint, (str(name), entry, model_buffer.getvalue(),
+                                                 env_bytes, upload)))
+        return path.join(self.save_path, entry['model_path']), path.join(self.save_path, entry['env_path'])
+
+    def update(self, name, **fields):
+        """ Changes the entry of a checkpoint, e.g. its score after an evaluation,
+            and applies the retention policy. """
+        self._jobs.put((self._update_entry, (str(name), fields)))
+
+    def wait(self):
+        """ Blocks until all queued checkpoints are written. """
+        self._jobs.join()
+
+    def close(self):
+        self.wait()
+        self._jobs.put(None)
+        self._writer.join()
+
+    def _write_jobs(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None: return
+                function, args = job
+                function(*args)
+            except Exception as error:
+                log('Writing checkpoint failed!', [repr(error)])
+            finally:
+                self._jobs.task_done()
+
+    def _write_checkpoint(self, name, entry, model_bytes, env_bytes, upload):
+        model_path = path.join(self.save_path, entry['model_path'])
+        env_path = path.join(self.save_path, entry['env_path'])
+        _write_atomic(model_path, model_bytes)
+        _write_atomic(env_path, env_bytes)
+        self.index[name] = entry
+        self._apply_retention()
+        if upload:
+            import wandb
+            wandb.save(model_path)
+            wandb.save(env_path)
+
+    def _update_entry(self, name, fields):
+        self.index[name].update(fields)
+        self._apply_retention()
+
+    def _apply_retention(self):
+        """ Removes the checkpoints that are neither pinned nor among the best or latest ones. """
+        entries = [(name, entry) for name, entry in self.index.items() if not entry['pinned']]
+        scored = [item for item in entries if item[1]['score'] is not None]
+        best = sorted(scored, key=lambda item: item[1]['score'], reverse=True)[:self.keep_best]
+        latest = sorted(entries, key=lambda item: (item[1]['timestep'] or 0, item[1]['time']),
+                        reverse=True)[:self.keep_last]
+        retained = {name for name, _ in best + latest}
+        removed = [self.index.pop(name) for name, _ in entries if name not in retained]
+        # update the index before deleting, it never lists missing files
+        _write_atomic(path.join(self.save_path, INDEX_FILE),
+                      json.dumps(self.index, indent=2).encode())
+        for entry in removed:
+            for file_path in [entry['model_path'], entry['env_path']]:
+                try: os.remove(path.join(self.save_path, file_path))
+                except FileNotFoundError: pass
+
+
+def annotate(save_path, checkpoint, **fields):
+    """ Adds fields to the index entry of a checkpoint outside of the training,
+        e.g. the evaluated return. 'best' and 'latest' annotate the checkpoint they refer to,
+        other checkpoints missing in the index are added pinned. """
+    name = resolve_name(save_path, checkpoint)
+    index = load_index(save_path)
+    if name not in index:
+        index[name] = {'model_path': get_model_path(name), 'env_path': get_env_path(name),
+                       'timestep': None, 'time': time.time(), 'pinned': True,
+                       'score': None, 'metrics': {}}
+    index[name].update(fields)
+    _write_atomic(path.join(save_path, INDEX_FILE), json.dumps(index, indent=2).encode())
@@ -7,7 +7,8 @@ warnings.filterwarnings('ignore', category=DeprecationWarning)
 sys.path.append('/home/rustam/code/remote/')
 
 import numpy as np
-from scripts.common import utils
+from os import path, getcwd
+from dataclasses import dataclass, fields
 from scripts import config_light as cfgl
 
 def s(input):
@@ -35,10 +36,16 @@ def get_torque_ranges(hip_sag, hip_front, knee, ankle):
     return torque_ranges
 
 def is_mod(mod_str):
+    """ Checks the module default modification.
+        Code running per env step should use the flags of a RunConfig instead. """
     return mod_str in modification
 
+def _is_remote():
+    # same check as utils.is_remote() without importing utils (and pyplot with it)
+    return 'remote' in path.abspath(getcwd())
+
 # get the absolute path of the current project
-abs_project_path = utils.get_absolute_project_path()
+abs_project_path = path.dirname(path.dirname(path.dirname(path.abspath(__file__)))) + '/'
 
 # approaches
 AP_DEEPMIMIC = 'dmm'
@@ -90,6 +97,8 @@ MOD_REFS_REPLAY = 'ref_replay'
 # train multiple networks for different phases (left/right step, double stance)
 MOD_GROUND_CONTACT_NNS = 'grnd_contact_nns'
 MOD_3_PHASES = '3_phases'
+# encode the three phases one-hot (double stance excludes the single stance flags)
+MOD_GRND_CONTACT_ONE_HOT = 'grnd_1hot'
 MOD_CLIPRANGE_SCHED = 'clip_sched'
 # use symmetrized mocap data for imitation reward
 MOD_SYMMETRIC_WALK = 'sym_walk'
@@ -123,21 +132,33 @@ modification += mod([MOD_MIRROR_EXPS])
 # ----------------------------------------------------------------------------------
 DEBUG = cfgl.DEBUG_TRAINING or not sys.gettrace() is None
 MAX_DEBUG_STEPS = int(2e4) # stop training thereafter!
+# measure the time spent in the hot paths of the training (see scripts/common/perf.py)
+PERF_TIMING = False
+# export the collected timings to tensorboard every n timesteps
+PERF_LOG_INTERVAL = int(100e3)
+# snap the RSI positions to a grid of n phases per step to reset from cached sim states (opt-in),
+# 0 samples the positions uniformly on each step without caching
+RSI_PHASE_BINS = 0
+# sample the RSI positions with priority on phases that often lead to early terminations
+# (see scripts/mocap/rsi_sampler.py), mixed with uniform RSI with the probability RSI_UNIFORM_MIX
+ADAPTIVE_RSI = False
+RSI_UNIFORM_MIX = 0.5
+# merge the adaptive RSI statistics of all envs every n timesteps
+RSI_SYNC_INTERVAL = int(50e3)
 TORQUE_RANGES = get_torque_ranges(*cfgl.PEAK_JOINT_TORQUES)
 
-rew_weights = '8110' if not is_mod(MOD_FLY) else '7300'
-ent_coef = {200: -0.0075, 400: -0.00375}[CTRL_FREQ]
+# the entropy coefficient is scaled with the number of steps per second
+ent_coef = -0.0075 * 200 / CTRL_FREQ
 init_logstd = -0.7
 pi_out_init_scale = 0.001
 cliprange = 0.15
-clip_start = 0.55 if is_mod(MOD_CLIPRANGE_SCHED) else cliprange
-clip_end = 0.1 if is_mod(MOD_CLIPRANGE_SCHED) else cliprange
 clip_exp_slope = 5
 
 enc_layer_sizes = [512]*2 + [16]
 hid_layer_sizes_vf = cfgl.hid_layer_sizes_vf
 hid_layer_sizes_pi = cfgl.hid_layer_sizes_pi
-gamma = {50:0.99, 100: 0.99, 200:0.995, 400:0.998}[CTRL_FREQ]
+# other control frequencies keep the horizon in seconds of the 200Hz discount factor
+gamma = {50:0.99, 100: 0.99, 200:0.995, 400:0.998}.get(CTRL_FREQ, 0.995 ** (200 / CTRL_FREQ))
 rew_scale = 1
 alive_bonus = 0.2 * rew_scale
 # number of episodes per model evaluation
@@ -146,12 +167,12 @@ EVAL_N_TIMES = 20
 noptepochs = 4
 
 wb_project_name = cfgl.WB_PROJECT_NAME
-wb_run_name = ('SYM ' if is_mod(MOD_SYMMETRIC_WALK) else '') + \
-               cfgl.WB_EXPERIMENT_NAME
 wb_run_notes = cfgl.WB_EXPERIMENT_DESCRIPTION
 # ----------------------------------------------------------------------------------
 
 # choose environment
+env_ids = ['MimicWalker2d-v0', 'MimicWalker2d-v0', 'MimicWalker3d-v0', 'MimicWalker3d-v0', 'MimicWalker3d-v0', 'Walker2d-v2', 'Walker2d-v3', 'Humanoid-v3', 'Blind-BipedalWalker-v2', 'BipedalWalker-v2']
+env_abbrevs = ['mim2d', 'mim_trq2d', 'mim3d', 'mim_trq3d', 'mim_trq_ff3d', 'walker2dv2', 'walker2dv3', 'humanoid', 'blind_walker', 'walker']
 if cfgl.ENV_ID is not None:
     env_id = cfgl.ENV_ID
     # short description of the env used in the save path
@@ -159,8 +180,6 @@ if cfgl.ENV_ID is not None:
     env_is3d = True
     env_out_torque = cfgl.ENV_OUT_TORQUE
 else:
-    env_ids = ['MimicWalker2d-v0', 'MimicWalker2d-v0', 'MimicWalker3d-v0', 'MimicWalker3d-v0', 'MimicWalker3d-v0', 'Walker2d-v2', 'Walker2d-v3', 'Humanoid-v3', 'Blind-BipedalWalker-v2', 'BipedalWalker-v2']
-    env_abbrevs = ['mim2d', 'mim_trq2d', 'mim3d', 'mim_trq3d', 'mim_trq_ff3d', 'walker2dv2', 'walker2dv3', 'humanoid', 'blind_walker', 'walker']
     env_index = 4
     env_id = env_ids[env_index]
     # used in the save path (e.g. 'wlk2d')
@@ -170,49 +189,192 @@ else:
 
 # choose hyperparams
 algo = 'ppo2'
-# number of experiences to collect, not training steps.
-# In case of mirroring, during 4M training steps, we collect 8M samples.
-mirr_exps = is_mod(MOD_MIRROR_EXPS)
-exp_replay = is_mod(MOD_EXP_REPLAY)
-mio_samples = cfgl.MIO_SAMPLES
-if mirr_exps: mio_samples *= 2
-n_envs = cfgl.N_PARALLEL_ENVS if utils.is_remote() and not DEBUG else 2
 minibatch_size = 512 * 4
-batch_size = (4096 * 4 * (2 if not mirr_exps else 1)) if not DEBUG else 2*minibatch_size
-# to make PHASE based mirroring comparable with DUP, reduce the batch size
-if is_mod(MOD_MIRR_PHASE): batch_size = int(batch_size / 2)
-# if using a replay buffer, we have to collect less experiences
-# to reach the same batch size
-if exp_replay: batch_size = int(batch_size/(replay_buf_size+1))
+n_envs = cfgl.N_PARALLEL_ENVS if _is_remote() and not DEBUG else 2
 
 lr_start = 500 * (1e-6)
 lr_final = 1 * (1e-6)
-_ep_dur_in_k = {400: 6, 200: 3, 100: 1.5, 50: 0.75}[CTRL_FREQ]
+_ep_dur_in_k = 3 * CTRL_FREQ / 200
 ep_dur_max = cfgl.MAX_EPISODE_STEPS # int(_ep_dur_in_k * 1e3)
 max_distance = cfgl.MAX_WALKING_DISTANCE
 
-run_id = s(np.random.random_integers(0, 1000))
-info_baseline_hyp_tune = f'hl{s(hid_layer_sizes_vf)}_ent{int(ent_coef * 1000)}_lr{lr_start}to{lr_final}_epdur{_ep_dur_in_k}_' \
-       f'bs{int(batch_size/1000)}_imrew{rew_weights}_gam{int(gamma*1e3)}'
-
-# construct the paths to store the models at
-_mod_path = ('debug/' if DEBUG else '') + \
-            f'{approach}/{modification}/{env_abbrev}/{n_envs}envs/' \
-            f'{algo}/{mio_samples}mio/'
-save_path_norun= abs_project_path + 'models/' + _mod_path
-save_path = save_path_norun + f'{run_id}/'
-
-print('Model: ', save_path)
-print('Modification:', modification)
-
-# wandb
-def get_wb_run_name():
-    return wb_run_name
-
 # names of saved model before and after training
 init_checkpoint = 'init'
 final_checkpoint = 'final'
 
+# modes that are resolved to boolean flags of the RunConfig
+_mode_flags = {'fly': MOD_FLY, 'refs_ramp': MOD_REFS_RAMP,
+               'custom_policy': MOD_CUSTOM_POLICY, 'pi_out_deltas': MOD_PI_OUT_DELTAS,
+               'bound_mean': MOD_BOUND_MEAN, 'sac_acts': MOD_SAC_ACTS,
+               'load_obs_rms': MOD_LOAD_OBS_RMS, 'pretrain_pi': MOD_PRETRAIN_PI,
+               'vf_zero': MOD_VF_ZERO, 'mirror_exps': MOD_MIRROR_EXPS,
+               'query_nets': MOD_QUERY_NETS, 'query_vf_only': MOD_QUERY_VF_ONLY,
+               'rew_mult': MOD_REW_MULT, 'lin_rew': MOD_LIN_REW, 'com_x_vel': MOD_COM_X_VEL,
+               'refs_replay': MOD_REFS_REPLAY, 'ground_contact_nns': MOD_GROUND_CONTACT_NNS,
+               'three_phases': MOD_3_PHASES, 'grnd_contact_one_hot': MOD_GRND_CONTACT_ONE_HOT,
+               'cliprange_sched': MOD_CLIPRANGE_SCHED, 'symmetric_walk': MOD_SYMMETRIC_WALK,
+               'e2e_enc_obs': MOD_E2E_ENC_OBS, 'l2_reg': MOD_L2_REG,
+               'const_explore': MOD_CONST_EXPLORE, 'mirr_phase': MOD_MIRR_PHASE,
+               'exp_replay': MOD_EXP_REPLAY}
+
+
+@dataclass(frozen=True)
+class RunConfig:
+    """
+    Immutable and picklable configuration of a single training run.
+    Built once (e.g. in train.py) and passed to the environments, the policy and the algorithm.
+    All modes are resolved to booleans, so no string search is required during training.
+    Use build_run_config() to create an instance.
+    """
+    modification: str
+    run_id: str
+    env_id: str = env_id
+    env_abbrev: str = env_abbrev
+    env_is3d: bool = env_is3d
+    env_out_torque: bool = env_out_torque
+    sim_freq: int = SIM_FREQ
+    ctrl_freq: int = CTRL_FREQ
+    peak_joint_torques: tuple = tuple(cfgl.PEAK_JOINT_TORQUES)
+    debug: bool = DEBUG
+    perf_timing: bool = PERF_TIMING
+    rsi_phase_bins: int = RSI_PHASE_BINS
+    adaptive_rsi: bool = ADAPTIVE_RSI
+    rsi_uniform_mix: float = RSI_UNIFORM_MIX
+    n_envs: int = n_envs
+    # hyperparameters
+    rew_weights: str = '8110'
+    gamma: float = gamma
+    rew_scale: float = rew_scale
+    alive_bonus: float = alive_bonus
+    ep_dur_max: int = ep_dur_max
+    max_distance: float = max_distance
+    mio_samples: float = cfgl.MIO_SAMPLES
+    batch_size: int = 4096 * 4
+    minibatch_size: int = minibatch_size
+    clip_start: float = cliprange
+    clip_end: float = cliprange
+    wb_run_name: str = cfgl.WB_EXPERIMENT_NAME
+    # resolved modes
+    fly: bool = False
+    refs_ramp: bool = False
+    custom_policy: bool = False
+    pi_out_deltas: bool = False
+    bound_mean: bool = False
+    sac_acts: bool = False
+    load_obs_rms: bool = False
+    pretrain_pi: bool = False
+    vf_zero: bool = False
+    mirror_exps: bool = False
+    query_nets: bool = False
+    query_vf_only: bool = False
+    rew_mult: bool = False
+    lin_rew: bool = False
+    com_x_vel: bool = False
+    refs_replay: bool = False
+    ground_contact_nns: bool = False
+    three_phases: bool = False
+    grnd_contact_one_hot: bool = False
+    cliprange_sched: bool = False
+    symmetric_walk: bool = False
+    e2e_enc_obs: bool = False
+    l2_reg: bool = False
+    const_explore: bool = False
+    mirr_phase: bool = False
+    exp_replay: bool = False
+
+    def is_mod(self, mod_str):
+        """ Avoid in code executed every env step, use the boolean flags instead. """
+        return mod_str in self.modification
+
+    @property
+    def torque_ranges(self):
+        return get_torque_ranges(*self.peak_joint_torques)
+
+    @property
+    def n_phase_flags(self):
+        """ number of gait phase flags appended to the observations
+            to gate the expert networks of the CustomPolicy, they are not normalized """
+        if not self.ground_contact_nns: return 0
+        return 3 if self.three_phases else 2
+
+    @property
+    def save_path_norun(self):
+        # construct the paths to store the models at
+        mod_path = ('debug/' if self.debug else '') + \
+                   f'{approach}/{self.modification}/{self.env_abbrev}/{self.n_envs}envs/' \
+                   f'{algo}/{self.mio_samples}mio/'
+        return abs_project_path + 'models/' + mod_path
+
+    @property
+    def save_path(self):
+        return self.save_path_norun + f'{self.run_id}/'
+
+    def get_wb_run_name(self):
+        return self.wb_run_name
+
+
+def build_run_config(modification=modification, run_id=None, **overrides):
+    """
+    Resolves all hyperparameters depending on the chosen modification
+    and returns them in a RunConfig. Has no side effects apart from drawing a run id.
+    :param overrides: fields of the RunConfig to overwrite, e.g. rew_weights='6400'.
+                      Overridden modes (e.g. fly=True) and debug are applied
+                      before the values depending on them are derived.
+    """
+    modes = {flag: mod_str in modification for flag, mod_str in _mode_flags.items()}
+    modes.update({flag: overrides.pop(flag) for flag in list(overrides) if flag in modes})
+    if run_id is None:
+        run_id = s(np.random.randint(0, 1001))
+
+    debug = overrides.pop('debug', DEBUG)
+    mio_samples = cfgl.MIO_SAMPLES
+    # number of experiences to collect, not training steps.
+    # In case of mirroring, during 4M training steps, we collect 8M samples.
+    if modes['mirror_exps']: mio_samples *= 2
+    batch_size = (4096 * 4 * (2 if not modes['mirror_exps'] else 1)) if not debug else 2*minibatch_size
+    # to make PHASE based mirroring comparable with DUP, reduce the batch size
+    if modes['mirr_phase']: batch_size = int(batch_size / 2)
+    # if using a replay buffer, we have to collect less experiences
+    # to reach the same batch size
+    if modes['exp_replay']: batch_size = int(batch_size/(replay_buf_size+1))
+
+    params = dict(modification=modification, run_id=run_id, debug=debug,
+                  rew_weights='8110' if not modes['fly'] else '7300',
+                  mio_samples=mio_samples, batch_size=batch_size,
+                  clip_start=0.55 if modes['cliprange_sched'] else cliprange,
+                  clip_end=0.1 if modes['cliprange_sched'] else cliprange,
+                  wb_run_name=('SYM ' if modes['symmetric_walk'] else '') + cfgl.WB_EXPERIMENT_NAME,
+                  **modes)
+    params.update(overrides)
+    return RunConfig(**params)
+
+
+# RunConfig used by code that was not passed an explicit config, e.g. scripts loading a model
+_default_run_config = None
+
+def default_run_config():
+    """:returns the RunConfig built from the module settings above (created on first call)."""
+    global _default_run_config
+    if _default_run_config is None:
+        _default_run_config = build_run_config()
+    return _default_run_config
+
+def set_default_run_config(run_cfg: RunConfig):
+    global _default_run_config
+    _default_run_config = run_cfg
+
+
+_run_config_fields = {f.name for f in fields(RunConfig)} | \
+                     {'save_path', 'save_path_norun', 'torque_ranges', 'get_wb_run_name'}
+
+def __getattr__(name):
+    """ Values depending on the modification or the run (e.g. batch_size, save_path, run_id)
+        are no longer computed at import but taken lazily from the default RunConfig. """
+    if name in _run_config_fields:
+        return getattr(default_run_config(), name)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
 if __name__ == '__main__':
     from scripts.train import train
-    train()
\ No newline at end of file
+    train()
@@ -17,17 +17,18 @@ class CustomDiagGaussianDistribution(DiagGaussianProbabilityDistribution):
 
 
 class CustomDiagGaussianDistributionType(DiagGaussianProbabilityDistributionType):
-    def __init__(self, size):
+    def __init__(self, size, run_cfg:cfg.RunConfig=None):
         self.size = size
+        self._cfg = run_cfg if run_cfg is not None else cfg.default_run_config()
 
     def probability_distribution_class(self):
         return CustomDiagGaussianDistribution
 
     def proba_distribution_from_latent(self, pi_latent_vector, vf_latent_vector, init_scale=1.0, init_bias=0.0):
-        if cfg.is_mod(cfg.MOD_PRETRAIN_PI):
+        if self._cfg.pretrain_pi:
             # init the output layer of the policy with the weights of the pretrained policy
             # [w_hid1, w_hid2, w_out], [b_hid1, b_hid2, b_out]
-            ws, bs = load_weights()
+            ws, bs = load_weights(self._cfg.fly)
             w_out, b_out = ws[-1], bs[-1]
             # check dimensions
             assert w_out.shape[0] == pi_latent_vector.shape[1]
@@ -40,10 +41,10 @@ class CustomDiagGaussianDistributionType(DiagGaussianProbabilityDistributionType
             mean = output
         else:
             mean = linear(pi_latent_vector, 'pi', self.size, init_scale=cfg.pi_out_init_scale, init_bias=init_bias)
-        if cfg.is_mod(cfg.MOD_BOUND_MEAN):
+        if self._cfg.bound_mean:
             with tf.variable_scope('pi'):
                 mean = tf.tanh(mean)  # squashing mean only
-        if cfg.is_mod(cfg.MOD_CONST_EXPLORE):
+        if self._cfg.const_explore:
             logstd = cfg.init_logstd
         else:
             logstd_initializer = tf.constant_initializer(cfg.init_logstd)
@@ -58,15 +59,17 @@ class CustomDiagGaussianDistributionType(DiagGaussianProbabilityDistributionType
 
 
 class BoundedDiagGaussianDistribution(DiagGaussianProbabilityDistribution):
-    def __init__(self, flat):
+    def __init__(self, flat, sac_acts=False):
         super(BoundedDiagGaussianDistribution, self).__init__(flat)
+        # squash sampled actions with a tanh as done in SAC
+        self._sac_acts = sac_acts
 
     def neglogp(self, sampled_action):
         """
         Computes log[pi(a|s)] of a given sampled action a.
         """
         neg_log_pi = super(BoundedDiagGaussianDistribution, self).neglogp(sampled_action)
-        if cfg.is_mod(cfg.MOD_SAC_ACTS):
+        if self._sac_acts:
             log('Using custom distribution with SAC neglogp.')
             from stable_baselines.sac.policies import clip_but_pass_gradient
             # account for squashing the sampled action by a tahn
@@ -77,7 +80,7 @@ class BoundedDiagGaussianDistribution(DiagGaussianProbabilityDistribution):
 
     def sample(self):
         sampled_action = super(BoundedDiagGaussianDistribution, self).sample()
-        if cfg.is_mod(cfg.MOD_SAC_ACTS):
+        if self._sac_acts:
             log('Using custom distribution with custom SAC sampling!')
             sampled_action = tf.tanh(sampled_action)
         return sampled_action
@@ -92,15 +95,19 @@ class BoundedDiagGaussianDistribution(DiagGaussianProbabilityDistribution):
 
 
 class BoundedDiagGaussianDistributionType(DiagGaussianProbabilityDistributionType):
-    def __init__(self, size):
+    def __init__(self, size, run_cfg:cfg.RunConfig=None):
         self.size = size
+        self._cfg = run_cfg if run_cfg is not None else cfg.default_run_config()
 
     def probability_distribution_class(self):
         return BoundedDiagGaussianDistribution
 
+    def proba_distribution_from_flat(self, flat):
+        return self.probability_distribution_class()(flat, self._cfg.sac_acts)
+
     def proba_distribution_from_latent(self, pi_latent_vector, vf_latent_vector, init_scale=1.0, init_bias=0.0):
         mean = linear(pi_latent_vector, 'pi', self.size, init_scale=init_scale, init_bias=init_bias)
-        if cfg.is_mod(cfg.MOD_BOUND_MEAN):
+        if self._cfg.bound_mean:
             with tf.variable_scope('pi'):
                 mean = tf.tanh(mean)  # squashing mean only
         logstd = tf.get_variable(name='pi/logstd', shape=[1, self.size], initializer=tf.zeros_initializer())
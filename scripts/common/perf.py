@@ -0,0 +1,108 @@
+"""
+Opt-in, low overhead timing of the training hot paths.
+
+Spans are measured with perf_counter() and aggregated in the current process.
+Each subprocess of a SubprocVecEnv collects its own statistics,
+which are gathered by the TrainingMonitor via MimicEnv.get_perf_stats().
+Activate by setting PERF_TIMING = True in the config.
+When disabled, span() returns a shared no-op context manager.
+"""
+from time import perf_counter
+
+_enabled = False
+# maps the span name to [total duration in seconds, number of calls]
+_stats = {}
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+def is_enabled():
+    return _enabled
+
+
+class _Span:
+    __slots__ = ('name', 't_start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t_start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add(self.name, perf_counter() - self.t_start)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """ Usage: with perf.span('ppo/train_step'): ...
+        Measures the duration of the with block if timing is enabled. """
+    return _Span(name) if _enabled else _NO_SPAN
+
+
+def add(name, duration, count=1):
+    """ Adds an externally measured duration (in seconds) to the span statistics. """
+    entry = _stats.get(name)
+    if entry is None:
+        _stats[name] = [duration, count]
+    else:
+        entry[0] += duration
+        entry[1] += count
+
+
+def pop_stats():
+    """ :returns the statistics collected since the last call and resets them. """
+    global _stats
+    stats, _stats = _stats, {}
+    return stats
+
+
+def merge(stats_list):
+    """ Sums up the statistics of multiple processes. """
+    merged = {}
+    for stats in stats_list:
+        for name, (duration, count) in stats.items():
+            entry = merged.setdefault(name, [0.0, 0])
+            entry[0] += duration
+            entry[1] += count
+    return merged
+
+
+def time_method(obj, method_name, span_name):
+    """ Measures every call of the method of the passed object (not of its class),
+        e.g. the waiting time for the subprocesses in VecEnv.step_wait(). """
+    method = getattr(obj, method_name)
+
+    def timed_method(*args, **kwargs):
+        t_start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            add(span_name, perf_counter() - t_start)
+
+    setattr(obj, method_name, timed_method)
+
+
+def summarize(stats, prefix='perf/'):
+    """ :returns a list of (tag, value) tuples with the mean duration per call in ms
+                 and the total duration in s of each span, e.g. to log them to tensorboard. """
+    summary = []
+    for name in sorted(stats):
+        duration, count = stats[name]
+        summary.append((f'{prefix}{name} [ms per call]', 1e3 * duration / max(1, count)))
+        summary.append((f'{prefix}{name} [s total]', duration))
+    return summary
@@ -0,0 +1,75 @@
+"""
+Phase-gated mixture of expert MLPs (left stance, right stance and double stance networks).
+
+The output of each sample is the weighted average of the experts active in its gait phase:
+    out = sum_k(mask_k * expert_k(x)) / sum_k(mask_k)
+Instead of evaluating all experts on all samples and blending them with masks,
+- routed_mixture() gathers the samples of each expert, runs the expert on its partition only
+  and scatters the results back (large batches, e.g. the PPO minibatches),
+- grouped_mixture() evaluates all experts with a single batched matmul per layer
+  (small batches, e.g. the action prediction of a few envs, where the gather and scatter
+  overhead would dominate).
+Both produce the same outputs and parameter gradients as the blended version.
+"""
+import tensorflow as tf
+
+# use the routed mixture for batches of at least this size (or of unknown size)
+ROUTED_MIN_BATCH_SIZE = 64
+
+
+def mlp(input, layers, act_func):
+    """ :param layers: list of (weight, bias) of each hidden layer """
+    hid = input
+    for weight, bias in layers:
+        hid = act_func(tf.matmul(hid, weight) + bias)
+    return hid
+
+
+def get_mixture_weights(masks):
+    """ :param masks: (batch, n_experts) gait phase flags
+        :returns the weight of each expert per sample, normalized over the experts """
+    return masks / tf.reduce_sum(masks, axis=1, keepdims=True)
+
+
+def blended_mixture(input, masks, experts, act_func):
+    """ Reference implementation: evaluates all experts on all samples and blends them. """
+    outputs = [mlp(input, layers, act_func) for layers in experts]
+    weighted = tf.add_n([masks[:, k:k+1] * outputs[k] for k in range(len(experts))])
+    return weighted / tf.reduce_sum(masks, axis=1, keepdims=True)
+
+
+def routed_mixture(input, masks, experts, act_func):
+    """
+    Runs each expert only on the samples with a non-zero mask of its phase.
+    :param experts: list of the layers of each expert, see mlp()
+    """
+    weights = get_mixture_weights(masks)
+    batch_size = tf.shape(input)[0]
+    out_dim = experts[0][-1][1].get_shape()[0].value
+    output = tf.zeros([batch_size, out_dim], dtype=input.dtype)
+    for k, layers in enumerate(experts):
+        indices = tf.where(tf.not_equal(masks[:, k], 0))
+        expert_out = mlp(tf.gather_nd(input, indices), layers, act_func)
+        expert_weights = tf.gather_nd(weights[:, k:k+1], indices)
+        output += tf.scatter_nd(indices, expert_weights * expert_out,
+                                tf.stack([batch_size, out_dim]))
+    return output
+
+
+def grouped_mixture(input, masks, experts, act_func):
+    """ Evaluates all experts at once with a batched matmul of the stacked expert weights. """
+    weights = get_mixture_weights(masks)
+    # (n_experts, batch, hid)
+    hid = tf.tile(tf.expand_dims(input, 0), [len(experts), 1, 1])
+    for i_layer in range(len(experts[0])):
+        stacked_w = tf.stack([layers[i_layer][0] for layers in experts])
+        stacked_b = tf.stack([layers[i_layer][1] for layers in experts])
+        hid = act_func(tf.matmul(hid, stacked_w) + tf.expand_dims(stacked_b, 1))
+    return tf.einsum('bk,kbo->bo', weights, hid)
+
+
+def phase_gated_mixture(input, masks, experts, act_func, batch_size=None):
+    """ :param batch_size: static batch size if known, chooses the implementation """
+    if batch_size is None or batch_size >= ROUTED_MIN_BATCH_SIZE:
+        return routed_mixture(input, masks, experts, act_func)
+    return grouped_mixture(input, masks, experts, act_func)
@@ -5,24 +5,31 @@ from stable_baselines.a2c.utils import linear, ortho_init
 from scripts.behavior_cloning.models import load_weights, load_encoder_weights
 from scripts.common.utils import log
 from scripts.common import config as cfg
+from scripts.common.phase_gating import phase_gated_mixture
 import tensorflow as tf
 import numpy as np
 
+# experts of the phase-gated policy, in the order of the gait phase flags in the observations
+# (without MOD_3_PHASES, there are only the left and right flags)
+GAIT_PHASES = ('left', 'right', 'double')
+
 
 class CustomPolicy(ActorCriticPolicy):
 
-    def __init__(self, sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse=False, **kwargs):
+    def __init__(self, sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse=False,
+                 run_cfg:cfg.RunConfig=None, **kwargs):
         super(CustomPolicy, self).__init__(sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse=reuse, **kwargs)
 
         # log("Using CustomPolicy.")
+        self._cfg = run_cfg = run_cfg if run_cfg is not None else cfg.default_run_config()
 
-        self._pdtype = CustomDiagGaussianDistributionType(ac_space.shape[0])
+        self._pdtype = CustomDiagGaussianDistributionType(ac_space.shape[0], run_cfg)
 
-        if cfg.is_mod(cfg.MOD_PRETRAIN_PI):
-            self._pdtype = CustomDiagGaussianDistributionType(ac_space.shape[0])
+        if run_cfg.pretrain_pi:
+            self._pdtype = CustomDiagGaussianDistributionType(ac_space.shape[0], run_cfg)
             log("Using Custom Gaussian Distribution\nwith pretrained mean weights and biases!")
-        elif cfg.is_mod(cfg.MOD_BOUND_MEAN) or cfg.is_mod(cfg.MOD_SAC_ACTS):
-            self._pdtype = BoundedDiagGaussianDistributionType(ac_space.shape[0])
+        elif run_cfg.bound_mean or run_cfg.sac_acts:
+            self._pdtype = BoundedDiagGaussianDistributionType(ac_space.shape[0], run_cfg)
             log("Using Bounded Gaussian Distribution")
 
         with tf.variable_scope("model", reuse=reuse):
@@ -30,7 +37,7 @@ class CustomPolicy(ActorCriticPolicy):
             act_func_hid = tf.nn.relu
 
             # reduce dim of observations
-            if cfg.is_mod(cfg.MOD_E2E_ENC_OBS):
+            if run_cfg.e2e_enc_obs:
                 log('Building an encoder to reduce PI input dimensionality.\n'
                     f'Input dim original: {obs.shape[1]}\n'
                     f'Hidden Layer Sizes (E2E): {cfg.enc_layer_sizes + cfg.hid_layer_sizes_pi}')
@@ -38,43 +45,31 @@ class CustomPolicy(ActorCriticPolicy):
 
 
             # build the policy network's hidden layers
-            if cfg.is_mod(cfg.MOD_PRETRAIN_PI):
+            if run_cfg.pretrain_pi:
                 pi_h = self.load_pretrained_policy_hid_layers('pi_fc_hid', obs, act_func_hid)
                 log('Loading pretrained policy HIDDEN LAYER weights!')
-            elif cfg.is_mod(cfg.MOD_GROUND_CONTACT_NNS):
+            elif run_cfg.ground_contact_nns:
                 log('Constructing multiple networks for different gait phases!')
-                pi_left = self.fc_hidden_layers('pi_left_hid', obs, cfg.hid_layer_sizes_vf, act_func_hid)
-                pi_right = self.fc_hidden_layers('pi_right_hid', obs, cfg.hid_layer_sizes_vf, act_func_hid)
-                pi_double = self.fc_hidden_layers('pi_double_hid', obs, cfg.hid_layer_sizes_vf, act_func_hid)
-                has_ground_contact_left = tf.stack([obs[:,0]] * cfg.hid_layer_sizes_vf[-1], axis=1)
-                has_ground_contact_right = tf.stack([obs[:,1]] * cfg.hid_layer_sizes_vf[-1], axis=1)
-                has_ground_contact_both = tf.stack([obs[:,2]] * cfg.hid_layer_sizes_vf[-1], axis=1)
-                pi_h = tf.divide(
-                    (tf.multiply(has_ground_contact_left, pi_left)
-                     + tf.multiply(has_ground_contact_right, pi_right)
-                     + tf.multiply(has_ground_contact_both, pi_double)),
-                    (has_ground_contact_left+has_ground_contact_right+has_ground_contact_both))
+                # the last observations are the raw gait phase flags (left, right, double stance),
+                # they are not normalized (see utils.PartialVecNormalize)
+                phase_masks = obs[:, -run_cfg.n_phase_flags:]
+                pi_h = self.phase_gated_hidden_layers('pi', obs, phase_masks,
+                                                      cfg.hid_layer_sizes_vf, act_func_hid)
             else:
                 # simple two hidden layer fully connected policy network
-                pi_obs_input = obs if not cfg.is_mod(cfg.MOD_E2E_ENC_OBS) else obs_reduced
+                pi_obs_input = obs if not run_cfg.e2e_enc_obs else obs_reduced
                 pi_h = self.fc_hidden_layers('pi_fc_hid', pi_obs_input, cfg.hid_layer_sizes_pi, act_func_hid)
             # build the value network's hidden layers
-            if cfg.is_mod(cfg.MOD_GROUND_CONTACT_NNS):
-                vf_left = self.fc_hidden_layers('vf_left_hid', obs, cfg.hid_layer_sizes_vf, act_func_hid)
-                vf_right = self.fc_hidden_layers('vf_right_hid', obs, cfg.hid_layer_sizes_vf, act_func_hid)
-                vf_double = self.fc_hidden_layers('vf_double_hid', obs, cfg.hid_layer_sizes_vf, act_func_hid)
-                vf_h = tf.divide(
-                (tf.multiply(has_ground_contact_left, vf_left)
-                 + tf.multiply(has_ground_contact_right, vf_right)
-                 + tf.multiply(has_ground_contact_both, vf_double)),
-                (has_ground_contact_left + has_ground_contact_right + has_ground_contact_both))
+            if run_cfg.ground_contact_nns:
+                vf_h = self.phase_gated_hidden_layers('vf', obs, phase_masks,
+                                                      cfg.hid_layer_sizes_vf, act_func_hid)
             else:
                 vf_h = self.fc_hidden_layers('vf_fc_hid', obs, cfg.hid_layer_sizes_vf, act_func_hid)
             # build the output layer of the policy (init_scale as proposed by stable-baselines)
             self._proba_distribution, self._policy, self.q_value = \
                 self.pdtype.proba_distribution_from_latent(pi_h, vf_h, init_scale=0.01)
             # build the output layer of the value function
-            vf_out = self.fc('vf_out', vf_h, 1, zero=cfg.is_mod(cfg.MOD_VF_ZERO))
+            vf_out = self.fc('vf_out', vf_h, 1, zero=run_cfg.vf_zero)
             self._value_fn = vf_out
             # required to set up additional attributes
             self._setup_init()
@@ -86,6 +81,19 @@ class CustomPolicy(ActorCriticPolicy):
             hid = act_func(self.fc(f'{name}{i}', hid, size))
         return hid
 
+    def phase_gated_hidden_layers(self, name, input, phase_masks, hid_sizes, act_func):
+        """
+        MLP with a separate expert network per gait phase.
+        Each sample is only passed through the experts of its phase (see phase_gating.py).
+        The variables are named like the separate networks before, e.g. pi_left_hid0.
+        """
+        in_sizes = [input.get_shape()[1].value] + list(hid_sizes[:-1])
+        experts = [[self.build_linear_params(f'{name}_{phase}_hid{i}', n_in, n_out,
+                                             init_scale=np.sqrt(2), init_bias=0)
+                    for i, (n_in, n_out) in enumerate(zip(in_sizes, hid_sizes))]
+                   for phase in GAIT_PHASES[:phase_masks.get_shape()[1].value]]
+        return phase_gated_mixture(input, phase_masks, experts, act_func, self.n_batch)
+
     def build_linear_layer(self, input_tensor, scope, n_hidden, *, init_scale=1.0, init_bias=0.0):
         """
         Creates a fully connected layer for TensorFlow
@@ -97,13 +105,20 @@ class CustomPolicy(ActorCriticPolicy):
         :param init_bias: (int) The initialization offset bias
         :return: (TensorFlow Tensor) fully connected layer
         """
+        n_input = input_tensor.get_shape()[1].value
+        weight, bias = self.build_linear_params(scope, n_input, n_hidden,
+                                                init_scale=init_scale, init_bias=init_bias)
+        return tf.matmul(input_tensor, weight) + bias
+
+    def build_linear_params(self, scope, n_input, n_hidden, *, init_scale=1.0, init_bias=0.0):
+        """ Creates the weight and bias variables of a fully connected layer.
+            :return: (weight, bias) """
         with tf.variable_scope(scope):
-            n_input = input_tensor.get_shape()[1].value
             weight = tf.get_variable("w", [n_input, n_hidden], initializer=ortho_init(init_scale),
                                      regularizer= (tf.keras.regularizers.l2(cfg.l2_coef)
-                                     if cfg.is_mod(cfg.MOD_L2_REG) else None))
+                                     if self._cfg.l2_reg else None))
             bias = tf.get_variable("b", [n_hidden], initializer=tf.constant_initializer(init_bias))
-            return tf.matmul(input_tensor, weight) + bias
+            return weight, bias
 
     def fc(self, name, input, size, zero=False):
         """
@@ -123,7 +138,7 @@ class CustomPolicy(ActorCriticPolicy):
         input_dim = input.get_shape()[1].value
         # load weights
         # [w_hid1, w_hid2, w_out], [b_hid1, b_hid2, b_out]
-        ws, bs = load_weights()
+        ws, bs = load_weights(self._cfg.fly)
         # check dimensions
         assert input_dim == ws[0].shape[0]
         hid_layer_sizes = [bs[0].size, bs[1].size]
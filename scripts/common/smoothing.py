@@ -0,0 +1,73 @@
+"""
+Vectorized smoothing of whole data series and small stateful smoothers
+for values arriving one at a time (e.g. one value per episode).
+"""
+import numpy as np
+from scipy.signal import lfilter
+
+
+def smooth_exponential(data, alpha=0.9, axis=0):
+    """
+    Exponential smoothing along the specified axis (first axis by default):
+    smoothed[0] = data[0], smoothed[t] = alpha * data[t] + (1-alpha) * smoothed[t-1]
+    Implemented as a first order IIR filter, so it runs in C also for very long series.
+    """
+    data = np.asarray(data)
+    if not np.issubdtype(data.dtype, np.floating):
+        data = data.astype(np.float64)
+    if axis != 0:
+        smoothed = smooth_exponential(np.moveaxis(data, axis, 0), alpha)
+        return np.moveaxis(smoothed, 0, axis)
+    smoothed = np.copy(data)
+    if len(data) < 2: return smoothed
+    # the initial filter state makes the first output equal
+    # to the recurrence started from smoothed[0] = data[0]
+    init_state = (1 - alpha) * data[:1]
+    smoothed[1:], _ = lfilter([alpha], [1, alpha - 1], data[1:], axis=0, zi=init_state)
+    return smoothed
+
+
+def cumulative_mean(data):
+    """ Mean of all values up to each index along the first axis. """
+    data = np.asarray(data, dtype=np.float64)
+    counts = np.arange(1, len(data) + 1).reshape((-1,) + (1,) * (data.ndim - 1))
+    return np.cumsum(data, axis=0) / counts
+
+
+class ExponentialSmoother:
+    """
+    Exponential running smoothing of values arriving one at a time.
+    The first value is returned unchanged.
+    """
+    def __init__(self, alpha=0.9):
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, new_value):
+        if self.value is None:
+            self.value = new_value
+        else:
+            self.value = self.alpha * new_value + (1 - self.alpha) * self.value
+        return self.value
+
+    def reset(self, value=None):
+        self.value = value
+
+
+class RunningMean:
+    """ Mean of all values seen so far, updated one value at a time. """
+    def __init__(self):
+        self.value = None
+        self.count = 0
+
+    def update(self, new_value):
+        if self.count == 0:
+            self.value = new_value
+        else:
+            self.value = (self.value * self.count + new_value) / (self.count + 1)
+        self.count += 1
+        return self.value
+
+    def reset(self):
+        self.value = None
+        self.count = 0
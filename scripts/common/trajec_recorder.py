@@ -0,0 +1,160 @@
+"""
+Streams the per-step trajectories of arbitrarily long evaluations to disk
+and reads them back memory-mapped for analysis and plotting.
+
+A recording is a directory with one subdirectory per column (qpos, qvel, ref_qpos, ...)
+holding numbered chunks of up to CHUNK_SIZE steps and an index.json with the dtype and shape
+of each column, the length of each chunk, the [start, end) steps of each episode
+and metadata of the recorded environment (e.g. env_id and control_freq).
+The chunks are saved as plain .npy files to memory-map them. Compressed chunks (.npz)
+are smaller on disk but have to be loaded into memory chunk by chunk.
+"""
+import os, json
+import numpy as np
+from os import path
+
+# number of steps buffered in memory before they are written as a chunk
+CHUNK_SIZE = 10000
+INDEX_FILE = 'index.json'
+
+# dtypes of the columns recorded by TrajecRecorder.record_step()
+COLUMNS = {'qpos': np.float64, 'qvel': np.float64, 'ref_qpos': np.float64, 'ref_qvel': np.float64,
+           'actions': np.float32, 'torques': np.float32, 'rewards': np.float32,
+           'contacts': np.bool_, 'dones': np.bool_}
+
+
+def _chunk_path(dir, column, i_chunk, compressed):
+    return path.join(dir, column, f'{i_chunk:05d}.{"npz" if compressed else "npy"}')
+
+
+class TrajecRecorder:
+    """ Collects the steps column-wise in preallocated chunks and writes full chunks to disk. """
+
+    def __init__(self, dir, chunk_size=CHUNK_SIZE, compress=False, meta=None):
+        """ :param meta: JSON serializable dict saved in the index """
+        self.dir = dir
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.meta = meta or {}
+        os.makedirs(dir, exist_ok=True)
+        # column -> chunk array, allocated with the shapes of the first recorded step
+        self._chunks = None
+        self._i_row = 0
+        self.chunk_lens = []
+        self.n_steps = 0
+        # [start, end) steps of the finished episodes
+        self.episodes = []
+        self._ep_start = 0
+
+    def record_step(self, env, action, reward, done):
+        """ Records the state of the MimicEnv after a step
+            together with the action taken, the reward and the done flag. """
+        qpos, qvel = env.get_joint_kinematics()
+        ref_qpos, ref_qvel = env.get_ref_kinematics()
+        self.append(qpos=qpos, qvel=qvel, ref_qpos=ref_qpos, ref_qvel=ref_qvel,
+                    actions=action, torques=env.get_actuator_torques(), rewards=reward,
+                    contacts=env.contacts.get_contacts(), dones=done)
+
+    def append(self, **values):
+        """ Appends a single step. Each step has to contain the same columns. """
+        if self._chunks is None:
+            self._chunks = {name: np.zeros((self.chunk_size,) + np.shape(value),
+                                           dtype=COLUMNS.get(name, np.asarray(value).dtype))
+                            for name, value in values.items()}
+        for name, value in values.items():
+            self._chunks[name][self._i_row] = value
+        self._i_row += 1
+        self.n_steps += 1
+        if self._i_row == self.chunk_size:
+            self.flush()
+
+    def end_episode(self):
+        """ Marks the steps since the last episode end as an episode. """
+        if self.n_steps > self._ep_start:
+            self.episodes.append((self._ep_start, self.n_steps))
+            self._ep_start = self.n_steps
+
+    def flush(self):
+        """ Writes the buffered steps as a new chunk and updates the index. """
+        if self._i_row == 0: return
+        i_chunk = len(self.chunk_lens)
+        for name, chunk in self._chunks.items():
+            file_path = _chunk_path(self.dir, name, i_chunk, self.compress)
+            os.makedirs(path.dirname(file_path), exist_ok=True)
+            if self.compress:
+                np.savez_compressed(file_path, data=chunk[:self._i_row])
+            else:
+                np.save(file_path, chunk[:self._i_row])
+        self.chunk_lens.append(self._i_row)
+        self._i_row = 0
+        self._save_index()
+
+    def _save_index(self):
+        index = {'columns': {name: {'dtype': chunk.dtype.name, 'shape': list(chunk.shape[1:])}
+                             for name, chunk in self._chunks.items()},
+                 'chunk_lens': self.chunk_lens, 'compressed': self.compress,
+                 'episodes': self.episodes, 'meta': self.meta}
+        # replace the index atomically, readers always see a consistent recording
+        tmp_path = path.join(self.dir, INDEX_FILE + '.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(index, file)
+        os.replace(tmp_path, path.join(self.dir, INDEX_FILE))
+
+    def close(self):
+        self.end_episode()
+        self.flush()
+
+
+class TrajecReader:
+    """ Reads the columns of a recording, only the chunks of the requested steps are touched. """
+
+    def __init__(self, dir):
+        self.dir = dir
+        with open(path.join(dir, INDEX_FILE)) as file:
+            index = json.load(file)
+        self.columns = {name: (np.dtype(col['dtype']), tuple(col['shape']))
+                        for name, col in index['columns'].items()}
+        self.compressed = index['compressed']
+        self.meta = index.get('meta', {})
+        self.episodes = [tuple(episode) for episode in index['episodes']]
+        self._offsets = np.cumsum([0] + index['chunk_lens'])
+        self.n_steps = int(self._offsets[-1])
+        # memory-mapped chunks, or only the last loaded chunk of each column if compressed
+        self._chunks = {}
+
+    @property
+    def n_episodes(self):
+        return len(self.episodes)
+
+    def _get_chunk(self, column, i_chunk):
+        key = (column, i_chunk)
+        if key not in self._chunks:
+            file_path = _chunk_path(self.dir, column, i_chunk, self.compressed)
+            if self.compressed:
+                with np.load(file_path) as file:
+                    chunk = file['data']
+                self._chunks = {k: v for k, v in self._chunks.items() if k[0] != column}
+            else:
+                chunk = np.load(file_path, mmap_mode='r')
+            self._chunks[key] = chunk
+        return self._chunks[key]
+
+    def get(self, column, start=0, end=None):
+        """ :returns the steps [start, end) of a column.
+                     Steps within a single chunk are a read-only view of the memory-mapped file. """
+        if end is None: end = self.n_steps
+        first = np.searchsorted(self._offsets, start, side='right') - 1
+        last = np.searchsorted(self._offsets, end, side='left')
+        parts = [self._get_chunk(column, i)[max(start - self._offsets[i], 0):end - self._offsets[i]]
+                 for i in range(first, last)]
+        if not parts:
+            dtype, shape = self.columns[column]
+            return np.zeros((0,) + shape, dtype=dtype)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def get_episode(self, column, i_episode):
+        start, end = self.episodes[i_episode]
+        return self.get(column, start, end)
+
+    def get_episode_returns(self):
+        return np.array([np.sum(self.get_episode('rewards', i)) for i in range(self.n_episodes)])
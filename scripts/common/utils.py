@@ -1,4 +1,4 @@
-import gym, os, wandb
+import gym, os, sys, wandb
 import numpy as np
 import seaborn as sns
 from os import path, getcwd
@@ -13,21 +13,32 @@ def get_absolute_project_path():
 
 abs_project_path = get_absolute_project_path()
 from stable_baselines.common.vec_env import DummyVecEnv, SubprocVecEnv, VecNormalize
+# vectorized smoothing, imported here to keep utils.smooth_exponential() available
+from scripts.common.smoothing import smooth_exponential, ExponentialSmoother, RunningMean
 # import gym_mimic_envs
 
-# used for running mean
+# labeled RunningMean objects used by running_mean()
 _running_means = {}
 
-# used for exponential running smoothing
+# labeled ExponentialSmoother objects used by exponential_running_smoothing()
 _exp_weighted_averages = {}
 
+def is_headless():
+    """Plots are rendered without a display (Agg backend) when HEADLESS_PLOTS=1 is set
+       or no X display is available, e.g. in render worker processes or on a cluster."""
+    if os.environ.get('HEADLESS_PLOTS', '0') == '1':
+        return True
+    return sys.platform.startswith('linux') and not os.environ.get('DISPLAY')
+
 def import_pyplot():
     """Imports pyplot and activates the right backend
        to render plots on local system even they're drawn remotely.
        @param: setup_plot_params: if true, activates seaborn and sets rcParams"""
     import matplotlib
     try:
-        matplotlib.use('tkagg') if is_remote() else matplotlib.use('Qt5Agg')
+        if is_headless(): matplotlib.use('Agg')
+        elif is_remote(): matplotlib.use('tkagg')
+        else: matplotlib.use('Qt5Agg')
     except Exception:
         pass
     from matplotlib import pyplot as plt
@@ -35,6 +46,11 @@ def import_pyplot():
 
 plt = import_pyplot()
 
+# resolution of figures saved by show_plot(), the rcParams dpi is meant for the thesis figures
+PLOT_SAVE_DPI = 150
+# when a directory is set, show_plot() saves the figures there instead of showing them
+_plot_output = {'dir': None, 'prefix': 'figure', 'format': 'png', 'dpi': PLOT_SAVE_DPI, 'paths': []}
+
 PLOT_FONT_SIZE = 22
 PLOT_TICKS_SIZE = 18
 PLOT_LINE_WIDTH = 2
@@ -70,6 +86,36 @@ def config_pyplot(fig_size=0.25, font_size=PLOT_FONT_SIZE, tick_size=PLOT_TICKS_
     return plt
 
 
+def set_plot_output(out_dir, prefix='figure', fmt='png', dpi=PLOT_SAVE_DPI):
+    """ Redirects all following show_plot() calls to files named {prefix}_{i}.{fmt} in out_dir.
+        :param out_dir: None to show the figures again """
+    if out_dir is not None: os.makedirs(out_dir, exist_ok=True)
+    _plot_output.update({'dir': out_dir, 'prefix': prefix, 'format': fmt,
+                         'dpi': dpi, 'paths': []})
+
+
+def show_plot():
+    """ Replacement of plt.show(): shows the current figure or,
+        when rendering headless or an output directory is set, saves and closes it.
+        :returns the path of the saved figure or None if it was shown """
+    if _plot_output['dir'] is None and not is_headless():
+        plt.show()
+        return None
+    out_dir = _plot_output['dir'] or abs_project_path + 'graphs/headless/'
+    os.makedirs(out_dir, exist_ok=True)
+    paths = _plot_output['paths']
+    file_path = os.path.join(out_dir, f"{_plot_output['prefix']}_{len(paths)}.{_plot_output['format']}")
+    plt.savefig(file_path, dpi=_plot_output['dpi'], format=_plot_output['format'])
+    plt.close('all')
+    paths.append(file_path)
+    return file_path
+
+
+def get_saved_plots():
+    """ :returns the paths of the figures saved by show_plot() since the last set_plot_output() """
+    return list(_plot_output['paths'])
+
+
 def change_plot_properties(font_size=0, tick_size=0,
                            legend_fontsize=0, line_width=0, show_grid=True):
 
@@ -87,20 +133,53 @@ def change_plot_properties(font_size=0, tick_size=0,
     return font_size, tick_size, legend_fontsize
 
 
+class PartialVecNormalize(VecNormalize):
+    """ VecNormalize that keeps the last n_raw_obs observations unnormalized,
+        e.g. the gait phase flags gating the expert networks of the CustomPolicy. """
+
+    def __init__(self, venv, n_raw_obs=0, **kwargs):
+        super(PartialVecNormalize, self).__init__(venv, **kwargs)
+        self.n_raw_obs = n_raw_obs
+
+    def normalize_obs(self, obs):
+        normed_obs = super(PartialVecNormalize, self).normalize_obs(obs)
+        if self.n_raw_obs > 0:
+            normed_obs[..., -self.n_raw_obs:] = obs[..., -self.n_raw_obs:]
+        return normed_obs
+
+
+def keep_obs_raw(vec_normed, n_raw_obs):
+    """ :returns the (e.g. loaded) VecNormalize with its statistics as a PartialVecNormalize
+                 that keeps the last n_raw_obs observations unnormalized """
+    if not isinstance(vec_normed, PartialVecNormalize):
+        partial = PartialVecNormalize.__new__(PartialVecNormalize)
+        partial.__dict__.update(vec_normed.__dict__)
+        vec_normed = partial
+    vec_normed.n_raw_obs = n_raw_obs
+    return vec_normed
+
+
 def vec_env(env_name, num_envs=4, seed=33, norm_rew=True,
-            load_path=None):
+            load_path=None, run_cfg=None):
     '''creates environments, vectorizes them and sets different seeds
     :param norm_rew: reward should only be normalized during training
     :param load_path: if set, the VecNormalize environment will
                       load the running means from this path.
+    :param run_cfg: RunConfig passed to each created MimicEnv;
+                    if None, the environments use the default config.
     :returns: VecNormalize (wrapped Subproc- or Dummy-VecEnv) '''
 
     from gym_mimic_envs.mimic_env import MimicEnv
     from gym_mimic_envs.monitor import Monitor as EnvMonitor
 
+    env_kwargs = {} if run_cfg is None else {'run_cfg': run_cfg}
+    if run_cfg is None:
+        from scripts.common.config import default_run_config
+        run_cfg = default_run_config()
+
     def make_env_func(env_name, seed, rank):
         def make_env():
-            env = gym.make(env_name)
+            env = gym.make(env_name, **env_kwargs)
             env.seed(seed + rank * 100)
             if isinstance(env, MimicEnv):
                 # wrap a MimicEnv in the EnvMonitor
@@ -125,8 +204,7 @@ def vec_env(env_name, num_envs=4, seed=33, norm_rew=True,
     #  the same way as when we load a complete trained model.
     else:
         try:
-            from scripts.common.config import is_mod, MOD_LOAD_OBS_RMS
-            if not is_mod(MOD_LOAD_OBS_RMS): raise Exception
+            if not run_cfg.load_obs_rms: raise Exception
             # load the obs_rms from a previously trained model
             init_obs_rms_path = abs_project_path + \
                                 'models/behav_clone/models/rms/env_999'
@@ -139,7 +217,9 @@ def vec_env(env_name, num_envs=4, seed=33, norm_rew=True,
             log('Do NOT loading obs_rms from a previous run.')
             vec_normed = VecNormalize(vec_env, norm_obs=True, norm_reward=norm_rew)
 
-    return vec_normed
+    # the gait phase flags gating the expert networks are never normalized,
+    # also not with loaded statistics
+    return keep_obs_raw(vec_normed, run_cfg.n_phase_flags)
 
 
 def check_environment(env_name):
@@ -239,20 +319,17 @@ def save_pi_weights(model, name):
         np.savez(save_path + 'models/params/attens_' + str(name),
                  A0=attens[0], A1=attens[1])
 
-def load_env(checkpoint, save_path, env_id):
+def load_env(checkpoint, save_path, env_id, run_cfg=None):
     # load a single environment for evaluation
-    env_path = save_path + f'envs/env_{checkpoint}'
-    env = vec_env(env_id, num_envs=1, norm_rew=False, load_path=env_path)
+    # the checkpoint can also be 'best' or 'latest', see scripts.common.checkpoints
+    from scripts.common.checkpoints import resolve
+    _, env_path = resolve(save_path, checkpoint)
+    env = vec_env(env_id, num_envs=1, norm_rew=False,
+                  load_path=env_path, run_cfg=run_cfg)
     # set the calculated running means for obs and rets
     # env.load(env_path)
     return env
 
-def smooth_exponential(data, alpha=0.9):
-    smoothed = np.copy(data)
-    for t in range(1, len(data)):
-        smoothed[t] = alpha * data[t] + (1-alpha) * smoothed[t-1]
-    return smoothed
-
 def numpy_ewm_alpha(a, alpha, windowSize):
     wghts = (1-alpha)**np.arange(windowSize)
     wghts /= wghts.sum()
@@ -279,46 +356,37 @@ def running_mean(label: str, new_value):
     """
     Computes the running mean, given a new value.
     Several running means can be monitored parallely by providing different labels.
+    Prefer owning a smoothing.RunningMean object instead of sharing global labels.
     :param label: give your running mean a name.
                   Will be used as a dict key to save current running mean value.
     :return: current running mean value for the provided label
     """
-
-    if label in  _running_means:
-        old_mean, num_values = _running_means[label]
-        new_mean = (old_mean * num_values + new_value) / (num_values + 1)
-        _running_means[label] = [new_mean, num_values + 1]
-    else:
-        # first value for the running mean
-        _running_means[label] = [new_value, 1]
-
-    return _running_means[label][0]
+    if label not in _running_means:
+        _running_means[label] = RunningMean()
+    return _running_means[label].update(new_value)
 
 
 def exponential_running_smoothing(label, new_value, smoothing_factor=0.9):
     """
     Implements an exponential running smoothing filter.
     Several inputs can be filtered parallely by providing different labels.
+    Prefer owning a smoothing.ExponentialSmoother object instead of sharing global labels.
     :param label: give your filtered data a name.
                   Will be used as a dict key to save current filtered value.
     :return: current filtered value for the provided label
     """
-    global _exp_weighted_averages
-
     if label not in _exp_weighted_averages:
-        _exp_weighted_averages[label] = new_value
-        return new_value
-
-    new_average = smoothing_factor * new_value + (1 - smoothing_factor) * _exp_weighted_averages[label]
-    _exp_weighted_averages[label] = new_average
-
-    return new_average
+        _exp_weighted_averages[label] = ExponentialSmoother(smoothing_factor)
+    smoother = _exp_weighted_averages[label]
+    smoother.alpha = smoothing_factor
+    return smoother.update(new_value)
 
 
 def resetExponentialRunningSmoothing(label, value=0):
     """
     Sets the current value of the exponential running smoothing identified by the label to zero.
     """
-    global _exp_weighted_averages
-    _exp_weighted_averages[label] = value
+    if label not in _exp_weighted_averages:
+        _exp_weighted_averages[label] = ExponentialSmoother()
+    _exp_weighted_averages[label].reset(value)
     return True
\ No newline at end of file
@@ -7,7 +7,7 @@ from tensorflow import keras
 from tensorflow.keras import layers
 from scripts.common.utils import import_pyplot
 from sklearn.model_selection import train_test_split
-from scripts.behavior_cloning.dataset import get_obs_and_delta_actions
+from scripts.behavior_cloning.dataset import get_obs_and_delta_actions, noisy_minibatches
 
 from scripts.common import config as cfg
 plt = import_pyplot()
@@ -22,6 +22,11 @@ HID_DIM = 1024
 EPOCHS = 250
 LEARN_RATE0 = 0.001
 LEARN_RATE1 = 0.00005
+# train a denoising autoencoder on noisy inputs streamed in minibatches
+AUGMENT_WITH_NOISE = False
+NOISE_STD = 0.1
+N_NOISY_SAMPLES_PER_EPOCH = int(1e6)
+BATCH_SIZE = 512
 notes = '' #'reproducing best results so far'
 
 hypers_string = f'HYPERS: DIM {LATENT_SPACE_DIM}, HID_DIM {HID_DIM}, LR0 {LEARN_RATE0},' \
@@ -121,9 +126,17 @@ if __name__ == '__main__':
     lr_decay_callback = keras.callbacks.LearningRateScheduler(linear_lr_schedule)
 
     # train model
-    history = model.fit(x_train, y_train, epochs=EPOCHS, verbose=1,
-                        validation_data=(x_val, y_val),
-                        callbacks=[save_best_callback, lr_decay_callback])
+    if AUGMENT_WITH_NOISE:
+        # inputs are noisy, targets the clean observations
+        train_batches = noisy_minibatches(x_train, y_train, BATCH_SIZE, NOISE_STD)
+        history = model.fit(train_batches, epochs=EPOCHS, verbose=1,
+                            steps_per_epoch=N_NOISY_SAMPLES_PER_EPOCH // BATCH_SIZE,
+                            validation_data=(x_val, y_val),
+                            callbacks=[save_best_callback, lr_decay_callback])
+    else:
+        history = model.fit(x_train, y_train, epochs=EPOCHS, verbose=1,
+                            validation_data=(x_val, y_val),
+                            callbacks=[save_best_callback, lr_decay_callback])
 
     # print the model summary
     model.summary()
@@ -1,7 +1,7 @@
 import os.path
 import glob, wandb
 import numpy as np
-from scripts.common import utils
+from scripts.common import utils, checkpoints
 from scripts.common import config as cfg
 from gym_mimic_envs.monitor import Monitor as EnvMonitor
 from gym_mimic_envs.mujoco.mimic_walker2d import MimicWalker2dEnv
@@ -30,13 +30,13 @@ checkpoint =  '999' # 'mean_rew60_12M' # 'ep_ret5500' # 999
 
 # evaluate for n episodes
 n_eps = 10
-# how many actions to record in each episode
-rec_n_steps = 1000
 
-def eval_model(from_config=True):
+def eval_model(from_config=True, run_cfg:cfg.RunConfig=None):
     """@:param from_config: if true, reloads the run_id from config file
                 before evaluation (for direct eval after training).
-                If false, uses the id specified in this script. """
+                If false, uses the id specified in this script.
+       @:param run_cfg: configuration of the evaluated run,
+                defaults to the config shared by the current process. """
 
     print('\n---------------------------\n'
               'MODEL EVALUATION STARTED'
@@ -44,30 +44,39 @@ def eval_model(from_config=True):
 
     global run_id, checkpoint
 
+    if run_cfg is None: run_cfg = cfg.default_run_config()
+
     # get model location from the config file
     if from_config:
-        run_id = cfg.run_id
+        run_id = run_cfg.run_id
         checkpoint = cfg.final_checkpoint
 
     # change save_path to specified model
     if FROM_PATH:
         save_path = PATH
     else:
-        save_path = cfg.save_path_norun + f'{run_id}/'
+        save_path = run_cfg.save_path_norun + f'{run_id}/'
 
     # load model
-    model_path = save_path + f'models/model_{checkpoint}.zip'
+    # the checkpoint can also be 'best' or 'latest', use the name it refers to
+    # for the model, the env, the metrics folder and the annotation of the index
+    checkpoint = checkpoints.resolve_name(save_path, checkpoint)
+    model_path, _ = checkpoints.resolve(save_path, checkpoint)
     model = PPO2.load(load_path=model_path)
 
     print('\nModel:\n', model_path + '\n')
 
-    env = utils.load_env(checkpoint, save_path, cfg.env_id)
+    # create the metrics folder
+    metrics_path = save_path + f'metrics/model_{checkpoint}/'
+    os.makedirs(metrics_path, exist_ok=True)
+
+    env = utils.load_env(checkpoint, save_path, run_cfg.env_id, run_cfg)
     mimic_env = env.venv.envs[0]
     mimic_env.activate_evaluation()
+    # stream all steps of the evaluation to disk, read them with TrajecReader
+    mimic_env.activate_recording(get_recording_path(metrics_path))
 
     ep_rewards, all_returns, ep_durations = [], [], []
-    all_rewards = np.zeros((n_eps, rec_n_steps))
-    all_actions = np.zeros((n_eps, env.action_space.shape[0], rec_n_steps))
 
     ep_count, ep_dur = 0, 0
     obs = env.reset()
@@ -77,8 +86,6 @@ def eval_model(from_config=True):
     while True:
         ep_dur += 1
         action, hid_states = model.predict(obs, deterministic=DETERMINISTIC_ACTIONS)
-        if ep_dur <= rec_n_steps:
-            all_actions[ep_count, :, ep_dur - 1] = action
         obs, reward, done, info = env.step(action)
         ep_rewards += [reward[0] if isinstance(reward,list) else reward]
         done_is_scalar = isinstance(done, bool) or \
@@ -89,9 +96,6 @@ def eval_model(from_config=True):
         done = done or (ep_dur > 2000)
         if done:
             ep_durations.append(ep_dur)
-            # clip ep_dur to max number of steps to save
-            ep_dur = min(ep_dur, rec_n_steps)
-            all_rewards[ep_count,:ep_dur] = np.asarray(ep_rewards)[:ep_dur].flatten()
             ep_return = np.sum(ep_rewards)
             all_returns.append(ep_return)
             if RENDER: print('ep_return: ', ep_return)
@@ -111,13 +115,7 @@ def eval_model(from_config=True):
     mean_return = np.mean(all_returns)
     print('\n\nAverage episode return was: ', mean_return)
 
-    # create the metrics folder
-    metrics_path = save_path + f'metrics/model_{checkpoint}/'
-    os.makedirs(metrics_path, exist_ok=True)
-
     np.save(metrics_path + '/{}_mean_ret_on_{}eps'.format(int(mean_return), n_eps), mean_return)
-    np.save(metrics_path + '/rewards', all_rewards)
-    np.save(metrics_path + '/actions', all_actions)
     np.save(metrics_path + '/ep_returns', all_returns)
     np.save(metrics_path + '/ep_durations_' + str(int(np.mean(ep_durations))), ep_durations)
 
@@ -150,20 +148,18 @@ def eval_model(from_config=True):
         plt.title(f"Returns of {n_eps} epochs")
         plt.show()
 
-    record_video(model, checkpoint, all_returns, relevant_eps)
+    record_video(save_path, get_recording_path(metrics_path), all_returns, relevant_eps, run_cfg)
 
 
-def record_video(model, checkpoint, all_returns, relevant_eps):
+def record_video(save_path, recording_dir, all_returns, relevant_eps, run_cfg:cfg.RunConfig=None):
     """ GENERATE VIDEOS of different performances (best, worst, mean)
 
     # The idea is to understand the agent by observing his behavior
     # during the best, worst episode and an episode with a close to average return.
-    # Therefore, we reload the environment to have same behavior as in the evaluation episodes
-    # and record the video only for the interesting episodes.
+    # The videos are rendered offline from the kinematics recorded during the evaluation,
+    # so neither the policy nor the episodes before have to be run again.
     """
-
-    # import the video recorder
-    from stable_baselines.common.vec_env import VecVideoRecorder
+    from scripts.plots.videos import render_videos
 
     utils.log("Preparing video recording!")
 
@@ -171,86 +167,32 @@ def record_video(model, checkpoint, all_returns, relevant_eps):
     relevant_eps_returns = [max(all_returns), min(all_returns), np.mean(all_returns)]
     relevant_eps_names = ['best', 'worst', 'mean']
 
-    # reload environment to replicate behavior of evaluation episodes (determinism tested)
-    if FROM_PATH:
-        save_path = PATH
-    else:
-        save_path = cfg.save_path_norun + f'{run_id}/'
-    env = utils.load_env(checkpoint, save_path, cfg.env_id)
-    obs = env.reset()
-
-    ep_count, step = 0, 0
-
-    # determine video duration
-    fps = env.venv.metadata['video.frames_per_second']
-    video_len_secs = 10
-    video_n_steps = video_len_secs * fps
+    if run_cfg is None: run_cfg = cfg.default_run_config()
 
     # build the video path
     pi_string = 'determin' if DETERMINISTIC_ACTIONS else 'stochastic'
     video_path = save_path + 'videos_' + pi_string
 
-    # repeat only as much episodes as necessary
-    while ep_count <= max(relevant_eps):
-
-        if ep_count in relevant_eps:
-            ep_index = relevant_eps.index(ep_count)
-            ep_ret = relevant_eps_returns[ep_index]
-            ep_name = relevant_eps_names[ep_index]
-
-            # create an environment that captures performance on video
-            video_env = VecVideoRecorder(env, video_path,
-                                         record_video_trigger=lambda x: x > 0,
-                                         video_length=video_n_steps,
-                                         name_prefix=f'{ep_name}_{int(ep_ret)}_')
-            # access the wrapped mimic environment
-            mimic_env = video_env.env.venv.envs[0].env
-            mimic_env.activate_evaluation()
-
-            if 'fly' in save_path:
-                mimic_env._FLY = True
-                print('flight detected')
-
-            obs = video_env.reset()
-
-            while step <= video_n_steps:
-                action, hid_states = model.predict(obs, deterministic=DETERMINISTIC_ACTIONS)
-                obs, reward, done, info = video_env.step(action)
-                step += 1
-                # only reset when agent has fallen
-                if has_fallen(mimic_env):
-                    video_env.reset()
-
-            video_env.close()
-            utils.log(f"Saved performance video after {step} steps.")
-            step = 0
-
-        # irrelevant episode, just reset the environment
-        else:
-            env.reset()
-
-        # log progress
-        if ep_count % 10 == 0:
-            print(f'{ep_count} episodes finished', flush=True)
+    episodes = {f'{name}_{int(ep_ret)}': i_ep for name, ep_ret, i_ep
+                in zip(relevant_eps_names, relevant_eps_returns, relevant_eps)}
+    videos = render_videos(recording_dir, episodes, video_path, run_cfg)
+    utils.log('Rendered performance videos:', [f'{name}: {path}' for name, path in videos.items()])
 
-        ep_count += 1
-    env.close()
-
-    # rename folder to mark it as evaluated
-    path_evaled = save_path[:-1] + f'-evaled-ret{int(np.mean(all_returns))}'
-    os.rename(save_path[:-1], path_evaled)
+    # mark the checkpoint as evaluated in the checkpoint index
+    checkpoints.annotate(save_path, checkpoint, evaluated_return=float(np.mean(all_returns)))
 
     # upload videos to wandb
-    mp4_paths_all = glob.glob(path_evaled+f'/videos_{pi_string}/*.mp4')
+    mp4_paths_all = glob.glob(video_path + '/*.mp4')
     # filter out broken videos, filesize < 1MB
     mp4_paths = [path for path in mp4_paths_all if os.path.getsize(path)>1024**2]
     utils.log('MP4 Paths:', mp4_paths)
     wandb.log({"video": wandb.Video(mp4_paths[0], fps=16, format='gif')})
     # wandb.log({"video": wandb.Video(mp4_paths[1], fps=4, format='mp4')})
 
-def has_fallen(mimic_env):
-    com_z_pos = mimic_env.data.qpos[mimic_env._get_COM_indices()[-1]]
-    return com_z_pos < 0.25
+
+def get_recording_path(metrics_path):
+    """ :returns the directory of the trajectories recorded during the evaluation """
+    return os.path.join(metrics_path, 'trajecs')
 
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
-from scripts.mocap.ref_trajecs import ReferenceTrajectories, labels as refs_labels, SAMPLE_FREQ
+from scripts.mocap.ref_trajecs import ReferenceTrajectories, SAMPLE_FREQ
+from scripts.mocap.ref_stats import calculate_refs_stats, save_distributions, N_PHASE_BINS
 from matplotlib import pyplot as plt
 import seaborn as sns
 import numpy as np
@@ -20,10 +21,11 @@ def get_refs(refs=None):
     return refs
 
 
-def get_joint_mocap_stats(refs=None, plot=False, std_only=False, save_path=None):
+def get_joint_mocap_stats(refs=None, plot=False, std_only=False, save_path=None, n_bins=N_PHASE_BINS):
     """
     Calculates the means and stds of reference joint kinematics of the MimicWalker2D.
     Statistics are computed for each leg separately for the CONSTANT SPEED TRAJECS!
+    All steps are resampled to a common phase grid of n_bins points.
 
     :return: means_left, means_right, stds_left, stds_right
     Returns the mean trajectories of a left and right step with corresponding stds.
@@ -32,37 +34,16 @@ def get_joint_mocap_stats(refs=None, plot=False, std_only=False, save_path=None)
         refs = get_refs()
 
     refs.reset()
-    data = refs.data # 30 x (19, n_step_points)
+    # extract only relevant joints (rows of the loaded file)
+    indices = refs.qpos_is + refs.qvel_is
+    stats = calculate_refs_stats(refs, indices, n_bins)
 
-    # to be able to get mean and std of each trajectory,
-    # we need to make all steps equally long (crop to min step length)
-    step_lens = [step.shape[1] for step in data]
-    min_len = np.min(step_lens)
-    data = [step[:, :min_len] for step in data]
-    data = np.array(data, dtype=np.float)
-
-    # extract only relevant joints
-    indices = qpos_indices + qvel_indices
-    data = data[:, indices, :]
-
-    # now, split data into left and right steps
-    left_indices = refs.left_step_indices
-    right_indices = np.array(left_indices) - 1
-    data_left = data[left_indices, :, :]
-    data_right = data[right_indices, :, :]
-
-    means_left = np.mean(data_left, axis=0)
-    stds_left = np.std(data_left, axis=0)
-    means_right = np.mean(data_right, axis=0)
-    stds_right = np.std(data_right, axis=0)
-
-    means_all = np.concatenate([means_right, means_left], axis=1)
-    stds_all = np.concatenate([stds_right, stds_left], axis=1)
+    means_left, stds_left = stats['means_left'], stats['stds_left']
+    means_right, stds_right = stats['means_right'], stats['stds_right']
+    means_all, stds_all = stats['means'], stats['std']
 
     if save_path is not None:
-        np.savez(save_path, means=means_all, std=stds_all,
-                 means_left=means_left, stds_left=stds_left,
-                 means_right=means_right, stds_right=stds_right)
+        save_distributions(stats, save_path)
 
     # plot figure in full screen mode (scaled down aspect ratio of my screen)
     plt.rcParams['figure.figsize'] = (19.2, 10.8)
@@ -86,7 +67,7 @@ def get_joint_mocap_stats(refs=None, plot=False, std_only=False, save_path=None)
                 # plot vels in orange
                 line_red = plt.plot(curve, 'red')
                 plt.fill_between(range(len(curve)), curve-std, curve+std, color='red', alpha=0.25)
-            plt.title(f'{i} - {refs_labels[i]}')
+            plt.title(f'{i} - {refs.labels[i]}')
 
             # plot the derivatives to easier find corresponding velocities
             if PLOT_ANGLE_DERIVS and i < 15:
@@ -131,12 +112,8 @@ def get_mocap_stds(refs=None, save_stds=False):
         refs = get_refs()
 
     refs.reset()
-    # (num_data_points x refs_dim)
-    data_matrix = np.concatenate(refs.data.tolist(), axis=1).transpose()
-    # convert to float array
-    data = np.array(data_matrix, dtype=np.float32)
     # get stds as max allowed devitations
-    stds = np.std(data, axis=0)
+    stds = calculate_refs_stats(refs)['global_std'].astype(np.float32)
     if save_stds:
         np.save('/assets/ref_trajecs/distributions/3d_mocap_stds_const_speed_400hz.npy', stds)
     return stds
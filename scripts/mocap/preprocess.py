@@ -0,0 +1,239 @@
+"""
+Offline preprocessing of the mocap reference trajectories.
+
+Packs all steps of the matlab file into a single (n_dims, n_points) array,
+applies the transforms on the packed array at once, validates the result and saves it
+as an uncompressed npz file the ReferenceTrajectories only have to load at env startup.
+- adding the trunk euler rotations (only required for raw files w/o them)
+- scaling of trajectories to adapt them to another body
+- detection of left and right steps
+- symmetric walking (replacing left steps with mirrored right steps)
+- estimation of the walking speed of each step
+
+Usage (from the project root):
+    python -m scripts.mocap.preprocess                   # settings of the default run config
+    python -m scripts.mocap.preprocess --symmetric-walk --adapt 9=1.1
+"""
+import os, argparse, hashlib, fcntl
+import numpy as np
+import scipy.io as spio
+
+from scripts.common.utils import log, smooth_exponential
+from scripts.mocap import ref_trajecs as rt
+
+# increase when the preprocessing changes to invalidate old files
+PREPROCESSING_VERSION = 1
+# preprocessed files are saved in this folder next to the source files
+PREPROCESSED_DIR = 'preprocessed'
+
+
+def load_mat(path):
+    """ :returns packed data (n_dims, n_points) and the start index of each step (n_steps+1,) """
+    # load matlab data, containing trajectories of 250 steps
+    data = spio.loadmat(path, squeeze_me=True)['Data'].flatten()
+    step_lens = [step.shape[1] for step in data]
+    step_starts = np.concatenate([[0], np.cumsum(step_lens)])
+    packed = np.concatenate([np.asarray(step, dtype=np.float64) for step in data], axis=1)
+    return packed, step_starts
+
+
+def add_trunk_euler_rotations(packed):
+    """ Appends the trunk rotation as euler angles calculated from the quaternions. """
+    from scipy.spatial.transform import Rotation as Rot
+    # quaternion in scalar-last (x, y, z, w) format
+    quats = packed[[rt.TRUNK_ROT_Q2, rt.TRUNK_ROT_Q3, rt.TRUNK_ROT_Q4, rt.TRUNK_ROT_Q1]]
+    euler_angles = Rot.from_quat(quats.T).as_euler('xyz').T
+    return np.concatenate([packed, euler_angles])
+
+
+def calculate_step_velocities(packed, step_starts):
+    """ Mean COM forward velocity of each step, smoothed as they are too noisy. """
+    step_lens = np.diff(step_starts)
+    step_speeds = np.add.reduceat(packed[rt.COM_VELX], step_starts[:-1]) / step_lens
+    return smooth_exponential(step_speeds, alpha=0.2)
+
+
+def adapt_to_other_body(packed, adaptations: dict):
+    '''The trajectories were collected from a single reference person.
+       They have to be adjusted when used with a model
+       with different body properties compared to the reference person.
+       :param adaptations: trajectory index -> scalar'''
+    if adaptations:
+        indices = list(adaptations.keys())
+        packed[indices] *= np.array(list(adaptations.values()))[:, np.newaxis]
+    return packed
+
+
+def determine_left_steps(packed, step_starts):
+    """
+    The dataset contains steps with right and left legs.
+    The side of the swing leg is the side of the step.
+    The swing leg has a higher knee angle velocity compared to the stance leg.
+    :returns boolean array, True for steps taken with the left leg.
+    """
+    max_knee_vels_l = np.maximum.reduceat(packed[rt.KNEE_ANGVEL_L], step_starts[:-1])
+    max_knee_vels_r = np.maximum.reduceat(packed[rt.KNEE_ANGVEL_R], step_starts[:-1])
+    return max_knee_vels_l > max_knee_vels_r
+
+
+def mirror_right_steps(packed, step_starts, is_left_step, mirred_indices, negate_indices):
+    """
+    Replaces each left step with the mirrored preceding right step.
+    :param mirred_indices, negate_indices: rows of the source file, see ref_trajecs.get_layout()
+    :returns the new packed data and step start indices
+    """
+    n_steps = len(is_left_step)
+    source_steps = np.arange(n_steps)
+    source_steps[is_left_step] = (source_steps[is_left_step] - 1) % n_steps
+    step_lens = np.diff(step_starts)[source_steps]
+    new_starts = np.concatenate([[0], np.cumsum(step_lens)])
+    # column of each new point in the packed source data
+    columns = np.repeat(step_starts[source_steps] - new_starts[:-1], step_lens) \
+              + np.arange(new_starts[-1])
+    mirrored = packed[:, columns]
+    is_left_point = np.repeat(is_left_step, step_lens)
+    left_points = mirrored[:, is_left_point][mirred_indices]
+    # some trajectories maintain their value but have to be negated
+    left_points[negate_indices] *= -1
+    mirrored[:, is_left_point] = left_points
+    return mirrored, new_starts
+
+
+def validate(refs, n_trajecs):
+    """ Checks the preprocessed data and raises a ValueError if it's not usable. """
+    packed, step_starts = refs['packed'], refs['step_starts']
+    n_steps = len(step_starts) - 1
+    if packed.shape[0] != n_trajecs:
+        raise ValueError(f'Expected {n_trajecs} trajectories, but got {packed.shape[0]}.')
+    if step_starts[0] != 0 or step_starts[-1] != packed.shape[1] or np.any(np.diff(step_starts) < 2):
+        raise ValueError('The step start indices do not match the packed data.')
+    if not np.all(np.isfinite(packed)):
+        raise ValueError('The reference trajectories contain NaN or infinite values.')
+    com_x_starts = packed[rt.COM_POSX, step_starts[:-1]]
+    if np.any(com_x_starts >= 0.005):
+        raise ValueError('The COM X Position on each step trajectory should start with 0.0, '
+                         f'but step {np.argmax(com_x_starts >= 0.005)} did not.')
+    for name in ['is_left_step', 'step_velocities']:
+        if len(refs[name]) != n_steps:
+            raise ValueError(f'{name} should contain a value for each of the {n_steps} steps.')
+    if np.all(refs['is_left_step']) or not np.any(refs['is_left_step']):
+        raise ValueError('The reference trajectories should contain left and right steps.')
+    quat_norms = np.linalg.norm(packed[rt.TRUNK_ROT_Q1:rt.TRUNK_ROT_Q4+1], axis=0)
+    if np.max(np.abs(quat_norms - 1)) > 0.01:
+        log(f'CAUTION! Trunk quaternions are not normalized: max deviation '
+            f'{np.max(np.abs(quat_norms - 1))}')
+
+
+def preprocess(src_path, symmetric_walk=False, adaptations={}, add_euler=False):
+    """ :returns dict with the preprocessed and validated reference trajectories """
+    # the speed ramp trajectories contain GRFs, the constant speed ones not
+    labels, mirred_indices, negate_indices = rt.get_layout(rt.is_speed_ramp_path(src_path))
+    packed, step_starts = load_mat(src_path)
+    if add_euler: packed = add_trunk_euler_rotations(packed)
+    # walking speeds are determined on the original data
+    step_velocities = calculate_step_velocities(packed, step_starts)
+    packed = adapt_to_other_body(packed, adaptations)
+    is_left_step = determine_left_steps(packed, step_starts)
+    if symmetric_walk:
+        packed, step_starts = mirror_right_steps(packed, step_starts, is_left_step,
+                                                 mirred_indices, negate_indices)
+
+    refs = {'packed': packed, 'step_starts': step_starts, 'is_left_step': is_left_step,
+            'step_velocities': step_velocities,
+            'source_mtime': os.path.getmtime(src_path), 'version': PREPROCESSING_VERSION}
+    validate(refs, len(labels))
+    return refs
+
+
+def get_preprocessed_path(src_path, symmetric_walk=False, adaptations={}, add_euler=False):
+    """ Path of the preprocessed file depending on the source file and the settings. """
+    settings = [PREPROCESSING_VERSION, symmetric_walk, sorted(adaptations.items()), add_euler]
+    key = hashlib.md5(repr(settings).encode()).hexdigest()[:10]
+    src_dir, src_name = os.path.split(src_path)
+    return os.path.join(src_dir, PREPROCESSED_DIR, f'{os.path.splitext(src_name)[0]}_{key}.npz')
+
+
+def save(refs, path):
+    """ Saves the preprocessed refs uncompressed, the file is replaced atomically. """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **refs)
+    os.replace(tmp_path, path)
+
+
+def load(path, src_path=None):
+    """
+    Loads the preprocessed refs.
+    :param src_path: if specified, returns None if the source file changed after preprocessing
+    :returns dict with the 'data' of each step as views on the packed data
+             or None if the file doesn't exist or is outdated
+    """
+    if not os.path.exists(path): return None
+    with np.load(path) as npz:
+        refs = {name: npz[name] for name in npz.files}
+    if refs['version'] != PREPROCESSING_VERSION: return None
+    if src_path is not None and refs['source_mtime'] != os.path.getmtime(src_path): return None
+    refs['data'] = split_steps(refs['packed'], refs['step_starts'])
+    return refs
+
+
+def load_or_create(src_path, symmetric_walk=False, adaptations={}):
+    """
+    Loads the preprocessed refs and preprocesses and saves them first if the file doesn't exist.
+    A file lock makes sure only one of several env processes preprocesses the refs,
+    all others wait and load the saved file.
+    """
+    path = get_preprocessed_path(src_path, symmetric_walk, adaptations)
+    refs = load(path, src_path)
+    if refs is not None: return refs
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # another process might have saved the refs while we were waiting for the lock
+        refs = load(path, src_path)
+        if refs is None:
+            log('Preprocessing the reference trajectories once. '
+                'Run python -m scripts.mocap.preprocess to do it before training:', [path])
+            save(preprocess(src_path, symmetric_walk, adaptations), path)
+            refs = load(path, src_path)
+    return refs
+
+
+def split_steps(packed, step_starts):
+    """ :returns object array of the steps (n_dims, step_len) as views on the packed data """
+    steps = np.empty(len(step_starts) - 1, dtype=object)
+    for i_step in range(len(steps)):
+        steps[i_step] = packed[:, step_starts[i_step]:step_starts[i_step+1]]
+    return steps
+
+
+def main():
+    from scripts.common.config import default_run_config
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--src', default=rt.get_refs_path(default_run_config().refs_ramp),
+                        help='matlab file with the mocap steps')
+    parser.add_argument('--out', default=None, help='output path, derived from --src if not set')
+    parser.add_argument('--symmetric-walk', dest='symmetric_walk', action='store_true',
+                        help='replace left steps with mirrored right steps')
+    parser.add_argument('--no-symmetric-walk', dest='symmetric_walk', action='store_false')
+    parser.set_defaults(symmetric_walk=default_run_config().symmetric_walk)
+    parser.add_argument('--adapt', nargs='*', default=[], metavar='INDEX=SCALAR',
+                        help='scale the trajectory at INDEX, e.g. 9=1.1')
+    parser.add_argument('--add-euler', action='store_true',
+                        help='add trunk euler rotations (raw files only)')
+    args = parser.parse_args()
+
+    adaptations = {int(index): float(scalar) for index, scalar in
+                   (adapt.split('=') for adapt in args.adapt)}
+    refs = preprocess(args.src, args.symmetric_walk, adaptations, args.add_euler)
+    out_path = args.out or get_preprocessed_path(args.src, args.symmetric_walk,
+                                                 adaptations, args.add_euler)
+    save(refs, out_path)
+    log('Saved preprocessed reference trajectories:',
+        [f'file:\t {out_path}', f'steps:\t {len(refs["step_starts"]) - 1}',
+         f'points:\t {refs["packed"].shape[1]}', f'dims:\t {refs["packed"].shape[0]}'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Statistics of the reference trajectories calculated in a single pass over the mocap steps.
+- global mean and variance of each kinematic dimension
+- phase-binned mean and std of left and right steps (mocap distributions)
+
+The distributions are saved as uncompressed npz files in assets/ref_trajecs/distributions/
+and can be loaded memory-mapped with load_distributions().
+"""
+import struct, zipfile
+import numpy as np
+
+# number of points on the common phase grid all steps are resampled to
+N_PHASE_BINS = 250
+
+
+class WelfordStats:
+    """
+    Running mean and variance updated with batches of samples
+    (Welford's algorithm with Chan's batch update) to avoid keeping all samples in memory.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self._m2 = None
+
+    def update(self, batch):
+        """ :param batch: samples stacked along the first axis """
+        batch = np.asarray(batch, dtype=np.float64)
+        n_batch = len(batch)
+        if n_batch == 0: return
+        if self.mean is None:
+            self.mean = np.zeros(batch.shape[1:])
+            self._m2 = np.zeros(batch.shape[1:])
+        batch_mean = np.mean(batch, axis=0)
+        batch_m2 = np.sum((batch - batch_mean) ** 2, axis=0)
+        count = self.count + n_batch
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * (n_batch / count)
+        self._m2 = self._m2 + batch_m2 + delta ** 2 * (self.count * n_batch / count)
+        self.count = count
+
+    @property
+    def var(self):
+        return self._m2 / self.count
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+def resample_step(step, n_bins=N_PHASE_BINS):
+    """
+    Linearly interpolates all trajectories of a step on a common phase grid.
+    The phase of position i is i/step_len as in refs.get_phase_variable().
+    :param step: (n_dims, step_len)
+    :returns (n_dims, n_bins)
+    """
+    step_len = step.shape[1]
+    positions = np.arange(n_bins) * (step_len / n_bins)
+    i_lower = np.minimum(positions.astype(int), step_len - 1)
+    i_upper = np.minimum(i_lower + 1, step_len - 1)
+    weights = positions - i_lower
+    return step[:, i_lower] * (1 - weights) + step[:, i_upper] * weights
+
+
+def get_phase_bin(phase, n_bins=N_PHASE_BINS):
+    """ :returns the index of the phase bin the phase variable belongs to """
+    return min(int(phase * n_bins), n_bins - 1)
+
+
+def calculate_refs_stats(refs, indices=None, n_bins=N_PHASE_BINS):
+    """
+    Streams once over all steps of the reference trajectories.
+    :param indices: kinematic dimensions to consider, all if None
+    :returns dict with the 'global_mean', 'global_var', 'global_std' of each dimension
+             and the phase-binned 'means_left', 'stds_left', 'means_right', 'stds_right'
+             of shape (n_dims, n_bins), as well as 'means' and 'std' of the right step
+             followed by the left step (n_dims, 2*n_bins).
+    """
+    global_stats, left_stats, right_stats = WelfordStats(), WelfordStats(), WelfordStats()
+    for i_step, step in enumerate(refs.data):
+        step = np.asarray(step, dtype=np.float64)
+        if indices is not None: step = step[indices]
+        global_stats.update(step.T)
+        step_stats = left_stats if refs._is_left_step[i_step] else right_stats
+        step_stats.update(resample_step(step, n_bins)[np.newaxis])
+
+    stats = {'global_mean': global_stats.mean, 'global_var': global_stats.var,
+             'global_std': global_stats.std,
+             'means_left': left_stats.mean, 'stds_left': left_stats.std,
+             'means_right': right_stats.mean, 'stds_right': right_stats.std}
+    stats['means'] = np.concatenate([stats['means_right'], stats['means_left']], axis=1)
+    stats['std'] = np.concatenate([stats['stds_right'], stats['stds_left']], axis=1)
+    return stats
+
+
+def save_distributions(stats, path):
+    """ Saves the statistics uncompressed, so they can be loaded memory-mapped. """
+    np.savez(path, **stats)
+
+
+def load_distributions(path, mmap=True):
+    """
+    Loads the statistics saved with save_distributions().
+    :param mmap: memory-map the arrays instead of reading them into memory
+                 (only possible for uncompressed npz files, otherwise they are read)
+    :returns dict: name -> array
+    """
+    if not mmap:
+        with np.load(path) as npz:
+            return {name: npz[name] for name in npz.files}
+
+    arrays = {}
+    with zipfile.ZipFile(path) as zip_file, open(path, 'rb') as file:
+        for info in zip_file.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zip_file.open(info) as npy_file:
+                    arrays[name] = np.lib.format.read_array(npy_file)
+                continue
+            # the array data follows the local zip file header and the npy header
+            file.seek(info.header_offset)
+            local_header = file.read(30)
+            name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+            file.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=file.tell(),
+                                     shape=shape, order='F' if fortran_order else 'C')
+    return arrays
@@ -8,10 +8,9 @@ Script to handle reference trajectories.
 '''
 import random
 import numpy as np
-import scipy.io as spio
-from scripts.common.config import is_mod, MOD_REFS_RAMP, MOD_SYMMETRIC_WALK, \
-    SKIP_N_STEPS, STEPS_PER_VEL, EVAL_N_TIMES, CTRL_FREQ
-from scripts.common.utils import log, is_remote, config_pyplot, smooth_exponential
+from scripts.common.config import SKIP_N_STEPS, STEPS_PER_VEL, EVAL_N_TIMES, default_run_config
+from scripts.common.utils import log, is_remote
+from scripts.mocap import rsi_sampler
 
 
 # relative paths to trajectories
@@ -30,20 +29,23 @@ assets_path = '/home/rustam/code/remote/' if REMOTE \
 PATH_TRAJEC_RANGES = assets_path + \
                      'assets/ref_trajecs/Trajec_Ranges_Ramp_Slow_200Hz_EulerTrunkAdded.npz'
 
-# path to the reference trajectories
-PATH_REF_TRAJECS = assets_path + \
-                   (PATH_SPEED_RAMP if is_mod(MOD_REFS_RAMP) else PATH_CONSTANT_SPEED)
-
 SAMPLE_FREQ = 400
-assert str(SAMPLE_FREQ) in PATH_REF_TRAJECS, 'Have you set the right sample frequency!?'
 
-log('Trajecs Path:\n' + PATH_REF_TRAJECS)
 
-# is the trajectory with the constant speed chosen?
-_is_constant_speed = PATH_CONSTANT_SPEED in PATH_REF_TRAJECS
+def get_refs_path(refs_ramp):
+    """ :returns the path to the reference trajectories chosen by the run config """
+    path = assets_path + (PATH_SPEED_RAMP if refs_ramp else PATH_CONSTANT_SPEED)
+    assert str(SAMPLE_FREQ) in path, 'Have you set the right sample frequency!?'
+    return path
+
+
+def is_speed_ramp_path(path):
+    return PATH_SPEED_RAMP in path
+
 
 # label every trajectory in the mocap data with the corresponding name
-labels = ['COM Pos (X)', 'COM Pos (Y)', 'COM Pos (Z)',
+# (all trajectories of the speed ramp file, the constant speed file has no GRFs)
+labels = np.array(['COM Pos (X)', 'COM Pos (Y)', 'COM Pos (Z)',
           'Trunk Rot (quat,w)', 'Trunk Rot (quat,x)', 'Trunk Rot (quat,y)', 'Trunk Rot (quat,z)',
           'Ang Hip Frontal R', 'Ang Hip Sagittal R',
           'Ang Knee R', 'Ang Ankle R',
@@ -63,13 +65,7 @@ labels = ['COM Pos (X)', 'COM Pos (Y)', 'COM Pos (Z)',
           'GRF R', 'GRF L',
 
           'Trunk Rot (euler,x)', 'Trunk Rot (euler,y)', 'Trunk Rot (euler,z)',
-          ]
-
-if _is_constant_speed:
-    labels.remove('GRF R')
-    labels.remove('GRF L')
-
-labels = np.array(labels)
+          ])
 
 # reference trajectory: joint position indices
 COM_POSX, COM_POSY, COM_POSZ = range(0,3)
@@ -84,6 +80,11 @@ TRUNK_ANGVEL_X, TRUNK_ANGVEL_Y, TRUNK_ANGVEL_Z = range(18,21)
 HIP_FRONT_ANGVEL_R, HIP_SAG_ANGVEL_R, KNEE_ANGVEL_R, ANKLE_ANGVEL_R = range(21,25)
 HIP_FRONT_ANGVEL_L, HIP_SAG_ANGVEL_L, KNEE_ANGVEL_L, ANKLE_ANGVEL_L = range(25,29)
 
+# reference trajectory: foot position, GRF and trunk euler rotation indices
+FOOT_POSX_L, FOOT_POSY_L, FOOT_POSZ_L, FOOT_POSX_R, FOOT_POSY_R, FOOT_POSZ_R = range(29,35)
+GRF_R, GRF_L = range(35, 37)
+TRUNK_ROT_X, TRUNK_ROT_Y, TRUNK_ROT_Z = range(37, 40)
+
 # mirror right step to get left step
 mirred_indices = [COM_POSX, COM_POSY, COM_POSZ,
                   TRUNK_ROT_Q1, TRUNK_ROT_Q2, TRUNK_ROT_Q3, TRUNK_ROT_Q4,
@@ -92,51 +93,81 @@ mirred_indices = [COM_POSX, COM_POSY, COM_POSZ,
                   COM_VELX, COM_VELY, COM_VELZ,
                   TRUNK_ANGVEL_X, TRUNK_ANGVEL_Y, TRUNK_ANGVEL_Z,
                   HIP_FRONT_ANGVEL_L, HIP_SAG_ANGVEL_L, KNEE_ANGVEL_L, ANKLE_ANGVEL_L,
-                  HIP_FRONT_ANGVEL_R, HIP_SAG_ANGVEL_R, KNEE_ANGVEL_R, ANKLE_ANGVEL_R]
-
-
-# reference trajectory: foot position and GRF indices
-FOOT_POSX_L, FOOT_POSY_L, FOOT_POSZ_L, FOOT_POSX_R, FOOT_POSY_R, FOOT_POSZ_R = range(29,35)
-mirred_indices += [FOOT_POSX_R, FOOT_POSY_R, FOOT_POSZ_R, FOOT_POSX_L, FOOT_POSY_L, FOOT_POSZ_L]
-if _is_constant_speed:
-    TRUNK_ROT_X, TRUNK_ROT_Y, TRUNK_ROT_Z = range(35, 38)
-    mirred_indices += [TRUNK_ROT_X, TRUNK_ROT_Y, TRUNK_ROT_Z]
-else:
-    GRF_R, GRF_L = range(35, 37)
-    TRUNK_ROT_X, TRUNK_ROT_Y, TRUNK_ROT_Z = range(37, 40)
-    mirred_indices += [GRF_L, GRF_R, TRUNK_ROT_X, TRUNK_ROT_Y, TRUNK_ROT_Z]
+                  HIP_FRONT_ANGVEL_R, HIP_SAG_ANGVEL_R, KNEE_ANGVEL_R, ANKLE_ANGVEL_R,
+                  FOOT_POSX_R, FOOT_POSY_R, FOOT_POSZ_R, FOOT_POSX_L, FOOT_POSY_L, FOOT_POSZ_L,
+                  GRF_L, GRF_R, TRUNK_ROT_X, TRUNK_ROT_Y, TRUNK_ROT_Z]
 
 negate_indices = [COM_POSY, TRUNK_ROT_X, TRUNK_ROT_Z, HIP_FRONT_ANG_R, HIP_FRONT_ANG_L,
                   COM_VELY, TRUNK_ANGVEL_X, TRUNK_ANGVEL_Z, HIP_FRONT_ANGVEL_R, HIP_FRONT_ANGVEL_L]
 
+
+def get_rows(refs_ramp):
+    """
+    The indices above are the ones of the speed ramp file.
+    :returns the row of each trajectory index in the chosen file, -1 if it's not contained
+    """
+    rows = np.arange(len(labels))
+    if not refs_ramp:
+        # the constant speed trajectories have no GRFs
+        rows[[GRF_R, GRF_L]] = -1
+        rows[TRUNK_ROT_X:] -= 2
+    return rows
+
+
+def get_layout(refs_ramp):
+    """ :returns the labels, the mirrored indices and the negated indices
+                 as rows of the chosen file (used for symmetric walking) """
+    rows = get_rows(refs_ramp)
+    contained = rows >= 0
+    file_labels = labels[contained]
+    # mirrored trajectories are permuted within the contained ones
+    file_mirred = [rows[i] for i in mirred_indices if contained[i]]
+    file_negate = [rows[i] for i in negate_indices if contained[i]]
+    return file_labels, file_mirred, file_negate
+
+
+# skipping an odd number of steps should result in a step with the other leg/side,
+# however after the step 137 with left foot the next step with left foot is 140
+STEP_SIDE_IRREGULARITY = 137
+
+# loaded reference trajectories, preprocessed file path -> refs dict
+# shared by all ReferenceTrajectories of a process and inherited by forked workers
+_refs_store = {}
+
 class ReferenceTrajectories:
 
-    def __init__(self, qpos_indices, q_vel_indices, adaptations={}):
-        self.path = PATH_REF_TRAJECS
-        self.qpos_is = qpos_indices
-        self.qvel_is = q_vel_indices
-        # setup pyplot
-        self.plt = config_pyplot(fig_size=True, font_size=12,
-                                 tick_size=12, legend_fontsize=16)
+    def __init__(self, qpos_indices, q_vel_indices, adaptations={}, run_cfg=None):
+        if run_cfg is None: run_cfg = default_run_config()
+        # each instance loads the trajectories chosen by its own run config
+        self.path = get_refs_path(run_cfg.refs_ramp)
+        self.labels = get_layout(run_cfg.refs_ramp)[0]
+        # translate the trajectory indices to the rows of the loaded file
+        self._rows = get_rows(run_cfg.refs_ramp)
+        self.qpos_is = self._get_file_rows(qpos_indices)
+        self.qvel_is = self._get_file_rows(q_vel_indices)
+        self._trunk_rot_y = self._rows[TRUNK_ROT_Y]
         # velocity ramp trajecs: 250 steps consisting of 40 trajectories (250x(n_dofs,n_timesteps)
-        self.data = self._load_trajecs()
+        # adapted to other environments and with mirrored right steps used as left steps
+        # if symmetric walking is desired (see scripts/mocap/preprocess.py)
+        refs = self._load_trajecs(adaptations, run_cfg.symmetric_walk)
+        self.data = refs['data']
         # calculate ranges needed for Early Termination
         # self.ranges = self._determine_trajectory_ranges()
-        # calculate walking speeds for each step
-        self.step_velocities = self._calculate_walking_speed()
-        # adapt trajectories to other environments
-        self._adapt_trajecs_to_other_body(adaptations)
-        # calculated and added trunk euler rotations
-        # self._add_trunk_euler_rotations()
+        # walking speeds of each step
+        self.step_velocities = refs['step_velocities']
         # some steps are done with left, some with right foot
-        self.left_step_indices = self._determine_left_steps_indices()
-        # mirror right step and use it as left step
-        if is_mod(MOD_SYMMETRIC_WALK): self._symmetric_walk()
+        # boolean lookup table to avoid searching the indices list every step
+        self._is_left_step = refs['is_left_step']
+        self.left_step_indices = np.flatnonzero(self._is_left_step).tolist()
+        # successor of each step and the distance walked during each step
+        self._build_step_transition_table()
         # current step
         self._step = self._get_random_step()
+        # interpolation coefficients, only calculated once when required
+        self._slopes = None
         # how many points to jump over when next() is called
         # to get lower sample frequency data
-        self._set_increment(int(400 / CTRL_FREQ))
+        self._set_increment(SAMPLE_FREQ / run_cfg.ctrl_freq)
         # position on the reference trajectory of the current step
         self._pos = 0
         # distance walked so far (COM X Position)
@@ -147,22 +178,18 @@ class ReferenceTrajectories:
         self.has_reached_last_step = False
         # count how many steps were taken without skipping steps
         self.count_steps_same_vel = 1
+        # adaptive RSI (see activate_adaptive_rsi()) and the cell of the current episode's init
+        self.rsi_sampler = None
+        self._rsi_cell = None
         # during evaluation we want our agent to start from different positions
         self.n_deterministic_inits = 0
 
-    def _symmetric_walk(self):
-        # print('Mirroring the mocap data to have symmetric walking!')
-        right_step_indices = np.array(self.left_step_indices) - 1
-        # replace left steps with right steps
-        self.data[self.left_step_indices] = self.data[right_step_indices]
-        test = True
-        for i_left_step in self.left_step_indices:
-            # steps at left index are right steps, but not mirrored yet
-            right_step = self.data[i_left_step]
-            mirred_right_step = right_step[mirred_indices, :]
-            # some trajectories maintain their value but have to be negated
-            mirred_right_step[negate_indices, :] *= -1
-            self.data[i_left_step] = mirred_right_step
+    def _get_file_rows(self, indices):
+        rows = self._rows[np.asarray(indices, dtype=int)].tolist()
+        assert all(row >= 0 for row in rows), \
+            f'The trajectories {labels[np.asarray(indices)][np.array(rows) < 0]} ' \
+            f'are not contained in {self.path}'
+        return rows
 
     def next(self):
         """
@@ -178,7 +205,8 @@ class ReferenceTrajectories:
         if dif > 0:
             # choose the next step
             self._step = self._get_next_step()
-            # make sure to do the required increment
+            # the first sample of the next step is the same moment as the last one
+            # of the current step, carry the remainder after it over
             self._pos = dif
 
     def _set_increment(self, increment):
@@ -186,24 +214,38 @@ class ReferenceTrajectories:
         sets how many points to skip when next() is called.
         Goal is to simulate the data being collected at a lower sample frequency.
         Original sampling frequency of the data is 400Hz.
-        Resulting frequency is 400/increment
+        Resulting frequency is 400/increment.
+        A non-integer increment (e.g. 120Hz or 300Hz) results in a continuous position
+        on the step trajectory and the kinematics are linearly interpolated between the samples.
          """
-        assert type(increment) == int, \
-            f'The increment/frameskip of the reference trajectories ' \
-            f'should be an integer but was {increment}'
-        self.increment = increment
-
+        assert increment > 0, f'The increment of the reference trajectories ' \
+                              f'should be positive but was {increment}'
+        # interpolate only if the control frequency is no divider of the sample frequency
+        self._interpolate = not float(increment).is_integer()
+        self.increment = increment if self._interpolate else int(increment)
+        if self._interpolate and self._slopes is None: self._calculate_slopes()
+
+    def _calculate_slopes(self):
+        """
+        Precomputes the linear interpolation coefficients of each step:
+        the difference between the current and the next sample.
+        The positions are within [0, step_len - 1], the slope of the last sample
+        is zero and only used at exactly that position.
+        The COM X offset added in _get_next_step() doesn't change the slopes.
+        """
+        self._slopes = np.empty(len(self.data), dtype=object)
+        for i_step, step in enumerate(self.data):
+            slopes = np.zeros(step.shape)
+            slopes[:, :-1] = np.diff(step, axis=1)
+            self._slopes[i_step] = slopes
 
     def set_sampling_frequency(self, control_freq):
         """
         Sampling frequency is controlled by the increment in next().
+        Control frequencies that are no divider of the sampling frequency
+        of the reference data are supported by interpolating the kinematics.
         """
-        increment = SAMPLE_FREQ / control_freq
-        assert increment.is_integer(), \
-            f'Please check your control frequency and the sampling frequency of the reference data!' \
-            f'The sampling frequency of the reference data should be equal to ' \
-            f'or an integer multiple of the control frequency.'
-        self._set_increment(int(increment))
+        self._set_increment(SAMPLE_FREQ / control_freq)
 
 
     def reset(self):
@@ -214,6 +256,7 @@ class ReferenceTrajectories:
         self.dist = 0
         self.ep_dur = 0
         self.has_reached_last_step = False
+        self._rsi_cell = None
 
     def get_qpos(self):
         return self._get_by_indices(self.qpos_is)
@@ -239,11 +282,10 @@ class ReferenceTrajectories:
         '''@returns: the names/labels of the corresponding kinematics
            given their relative index.
            @params: both index lists are relative to qpos_is and qvel_is'''
-        global labels
         pos_is = np.array(self.qpos_is)[pos_rel_is]
         vel_is = np.array(self.qvel_is)[vel_rel_is]
-        pos_labels = labels[pos_is]
-        vel_labels = labels[vel_is]
+        pos_labels = self.labels[pos_is]
+        vel_labels = self.labels[vel_is]
         return pos_labels, vel_labels
 
     def get_kinematics_labels(self, concat=True):
@@ -252,41 +294,15 @@ class ReferenceTrajectories:
         @param: concat: if true, return a single list containing qpos and qvel labels,
                         if false, return two lists qpos_labels and qvel_labels
         """
-        global labels
-        qpos_labels = labels[self.qpos_is]
-        qvel_labels = labels[self.qvel_is]
+        qpos_labels = self.labels[self.qpos_is]
+        qvel_labels = self.labels[self.qvel_is]
         if concat:
             return np.concatenate([qpos_labels, qvel_labels]).flatten()
         else:
             return qpos_labels, qvel_labels
 
-    def _adapt_trajecs_to_other_body(self, adapts: dict):
-        '''The trajectories were collected from a single reference person.
-           They have to be adjusted when used with a model
-           with different body properties compared to the reference person.'''
-        indices = adapts.keys()
-        for index in indices:
-            scalar = adapts[index]
-            # also adapt the kinematic ranges
-            self.ranges[index] *= np.abs(scalar)
-            for i_step in range(len(self.data)):
-                self.data[i_step][index,:] *= scalar
-
-
-    def _determine_left_steps_indices(self):
-        """
-        The dataset contains steps with right and left legs.
-        The side of the swing leg is the side of the step.
-        The swing leg has a higher knee angle velocity compared to the stance leg.
-        :return: the indices of steps taken with the left leg.
-        """
-        indices = [i for (i, step) in enumerate(self.data)
-                   if np.max(step[KNEE_ANGVEL_L]) > np.max(step[KNEE_ANGVEL_R])]
-        return indices
-
-
     def is_step_left(self):
-        return self._i_step in self.left_step_indices
+        return self._is_left_step[self._i_step]
 
     def _get_by_indices(self, indices):
         """
@@ -307,23 +323,75 @@ class ReferenceTrajectories:
         Kinematics of specified joints at the current position
         on the current step trajectory.
         """
-        joint_kinematics = self._step[indices, self._pos]
+        if not self._interpolate:
+            return self._step[indices, self._pos]
+        # linear interpolation between the two neighbouring samples
+        i_pos = int(self._pos)
+        slopes = self._slopes[self._i_step]
+        joint_kinematics = self._step[indices, i_pos] + (self._pos - i_pos) * slopes[indices, i_pos]
         return joint_kinematics
 
-    def get_random_init_state(self):
+    def get_random_init_state(self, n_phase_bins=0):
         ''' Random State Initialization:
             @returns: qpos and qvel of a random step at a random position'''
+        self.set_random_init_position(n_phase_bins)
+        return self.get_qpos(), self.get_qvel()
+
+    def set_random_init_position(self, n_phase_bins=0):
+        """ Moves to a random step and a random position on it.
+            :param n_phase_bins: if > 0, the position is snapped to a grid of n_phase_bins
+                                 per step, which allows caching the initial simulation states
+            :returns (i_step, pos) identifying the init position """
+        if self.rsi_sampler is not None:
+            return self._set_adaptive_init_position(n_phase_bins > 0)
         self._step = self._get_random_step()
-        self._pos = random.randint(0, len(self._step[0]) - 1)
+        step_len = len(self._step[0])
+        if n_phase_bins > 0:
+            self._pos = int(random.randint(0, n_phase_bins - 1) * step_len / n_phase_bins)
+        else:
+            self._pos = random.randint(0, step_len - 1)
         # reset episode duration and so far traveled distance
         self.ep_dur = 0
         self.dist = 0
-        return self.get_qpos(), self.get_qvel()
+        return self._i_step, self._pos
+
+    def activate_adaptive_rsi(self, n_phase_bins=rsi_sampler.N_PHASE_BINS, uniform_mix=0.5):
+        """ Samples the RSI positions with priority on the phases of each step
+            the episodes were terminated early most often. """
+        self.rsi_sampler = rsi_sampler.AdaptiveRSISampler(len(self.data), n_phase_bins, uniform_mix)
+
+    def _set_adaptive_init_position(self, snap_to_bins):
+        """ :param snap_to_bins: init at the beginning of the sampled phase bin
+                                 instead of a random position in it """
+        self._i_step, i_bin = self.rsi_sampler.sample()
+        self._step = self.data[self._i_step]
+        step_len = len(self._step[0])
+        offset = 0 if snap_to_bins else random.random()
+        self._pos = min(int((i_bin + offset) * step_len / self.rsi_sampler.n_phase_bins),
+                        step_len - 1)
+        self._rsi_cell = (self._i_step, i_bin)
+        self.ep_dur = 0
+        self.dist = 0
+        return self._i_step, self._pos
+
+    def record_rsi_outcome(self, terminated_early):
+        """ Reports how the episode initialized with adaptive RSI has ended. """
+        if self._rsi_cell is None: return
+        self.rsi_sampler.record(*self._rsi_cell, terminated_early)
+        self._rsi_cell = None
 
     def get_deterministic_init_state(self, i_step = 0):
         ''' Deterministic State Initialization.
             @returns: qpos and qvel on a predefined position on the ref trajecs
                       but choosing another step each time. '''
+        self.set_deterministic_init_position()
+        qpos, qvel = self.get_qpos(), self.get_qvel()
+        # print(qpos, qvel)
+        return qpos, qvel
+
+    def set_deterministic_init_position(self):
+        """ Moves to the next of the EVAL_N_TIMES predefined init positions.
+            :returns (i_step, pos) identifying the init position """
         self.reset()
 
         # choose another reference step each time
@@ -346,9 +414,7 @@ class ReferenceTrajectories:
             self._step = self.data[self._i_step]
             self._pos = int(0.85 * len(self._step[0]))
 
-        qpos, qvel = self.get_qpos(), self.get_qvel()
-        # print(qpos, qvel)
-        return qpos, qvel
+        return self._i_step, self._pos
 
     def get_com_kinematics_full(self):
         """:returns com kinematics for the current steps."""
@@ -357,10 +423,10 @@ class ReferenceTrajectories:
         return com_pos, com_vel
 
     def get_com_height(self):
-        return self._step[COM_POSZ, self._pos]
+        return self._get_by_indices(COM_POSZ)
 
     def get_trunk_ang_saggit(self):
-        return self._step[TRUNK_ROT_Y, self._pos]
+        return self._get_by_indices(self._trunk_rot_y)
 
     def get_trunk_rotation(self):
         ''':returns trunk_rot: in quaternions (4D)
@@ -387,20 +453,90 @@ class ReferenceTrajectories:
         ang_r, ang_l, vel_r, vel_l = self._step[indices]
         return ang_r, ang_l, vel_r, vel_l
 
-    def _load_trajecs(self):
-        # load matlab data, containing trajectories of 250 steps
-        data = spio.loadmat(self.path, squeeze_me=True)
-        # 250 steps, shape (250,1), where 1 is an array with kinematic data
-        data = data['Data']
-        # flatten the array to have dim (steps,)
-        data = data.flatten()
-        return data
+    def _load_trajecs(self, adaptations, symmetric_walk):
+        """
+        Loads the preprocessed reference trajectories.
+        If the preprocessed file doesn't exist yet, it is created once
+        by the first of all env processes, see preprocess.load_or_create().
+        """
+        from scripts.mocap import preprocess
+        path = preprocess.get_preprocessed_path(self.path, symmetric_walk, adaptations)
+        # all instances of a process share the loaded data, the steps are never modified
+        if path in _refs_store: return _refs_store[path]
+        log('Trajecs Path:\n' + self.path)
+        refs = preprocess.load_or_create(self.path, symmetric_walk, adaptations)
+        _refs_store[path] = refs
+        return refs
 
     def _get_random_step(self):
         # which of the 250 steps are we looking at
         self._i_step = random.randint(0, len(self.data) - 1, )
         return self.data[self._i_step]
 
+    def _build_step_transition_table(self):
+        """
+        Precomputes the successor of each step for all counts of steps at the same velocity
+        as well as the COM X distance walked during each step.
+        The tables are indexed by [i_step, count_steps_same_vel].
+        """
+        n_steps = len(self.data)
+        for i_step, step in enumerate(self.data):
+            assert step[COM_POSX, 0] < 0.005, \
+                "The COM X Position on each new step trajectory should start with 0.0 " \
+                f"but started with {step[COM_POSX, 0]} on step {i_step}"
+        # counts start with 1, column 0 is unused
+        table_shape = (n_steps, STEPS_PER_VEL + 1)
+        self._next_step_table = np.zeros(table_shape, dtype=int)
+        self._next_count_table = np.ones(table_shape, dtype=int)
+        self._last_step_table = np.zeros(table_shape, dtype=bool)
+        for i_step in range(n_steps):
+            for count in range(1, STEPS_PER_VEL + 1):
+                self._next_step_table[i_step, count], self._next_count_table[i_step, count], \
+                self._last_step_table[i_step, count] = self._determine_next_step_index(i_step, count)
+        # COM X Position at the end of each step, the steps start at zero
+        self._step_distances = np.array([step[COM_POSX, -1] for step in self.data])
+
+    def get_next_step_index(self, i_step, count_steps_same_vel):
+        """
+        Looks up which step follows the specified one.
+        :returns: index of the next step, the updated count of steps at the same velocity
+                  and if the last step was reached and we started from the beginning.
+        """
+        return self._next_step_table[i_step, count_steps_same_vel], \
+               self._next_count_table[i_step, count_steps_same_vel], \
+               self._last_step_table[i_step, count_steps_same_vel]
+
+    def generate_step_sequence(self, n_steps, i_step=0, count_steps_same_vel=1):
+        """
+        Generates an arbitrary long walking sequence by following the step transitions,
+        starting over from the beginning of the refs when the last step was reached.
+        :returns: step indices (n_steps,) and the COM X offset at the start of each step (n_steps,)
+        """
+        step_indices = np.empty(n_steps, dtype=int)
+        for i in range(n_steps):
+            step_indices[i] = i_step
+            i_step, count_steps_same_vel, _ = self.get_next_step_index(i_step, count_steps_same_vel)
+        distances = self._step_distances[step_indices]
+        com_x_offsets = np.concatenate([[0], np.cumsum(distances[:-1])])
+        return step_indices, com_x_offsets
+
+    def _determine_next_step_index(self, i_step, count_steps_same_vel):
+        """
+        Determines which step follows the specified one.
+        Only used to build the step transition table, use get_next_step_index() instead.
+        """
+        # reset if last step was reached
+        if i_step >= len(self.data)-SKIP_N_STEPS-STEPS_PER_VEL:
+            # reset to the step with the correct foot
+            return (0 if self._is_left_step[i_step] else 1), count_steps_same_vel, True
+        # do multiple steps at the same velocity before skipping to a higher vel
+        if count_steps_same_vel < STEPS_PER_VEL:
+            return i_step + 1, count_steps_same_vel + 1, False
+        # keep the sides of the steps alternating
+        if i_step <= STEP_SIDE_IRREGULARITY and (i_step + SKIP_N_STEPS) > STEP_SIDE_IRREGULARITY:
+            i_step += 1
+        return i_step + SKIP_N_STEPS, 1, False
+
     def _get_next_step(self):
         """
         The steps are sorted. To get the next step, we just have to increase the index.
@@ -409,103 +545,20 @@ class ReferenceTrajectories:
         """
 
         # increase the step index, reset if last step was reached
-        if self._i_step >= len(self.data)-SKIP_N_STEPS-STEPS_PER_VEL:
-            self.has_reached_last_step = True
-            # reset to the step with the correct foot
-            self._i_step = 0 if self._i_step in self.left_step_indices else 1
-        else:
-            # do multiple steps at the same velocity before skipping to a higher vel
-            if self.count_steps_same_vel < STEPS_PER_VEL:
-                self._i_step += 1
-                self.count_steps_same_vel += 1
-            else:
-                # skipping an odd number of steps should result in a step with
-                # the other leg/side, however after the step 137 with left foot
-                # the next step with left foot is 140
-                if self._i_step <= 137 and (self._i_step + SKIP_N_STEPS) > 137:
-                    self._i_step += 1
-                self._i_step += SKIP_N_STEPS
-                self.count_steps_same_vel = 1
+        i_prev_step = self._i_step
+        self._i_step, self.count_steps_same_vel, reached_last_step = \
+            self.get_next_step_index(self._i_step, self.count_steps_same_vel)
+        if reached_last_step: self.has_reached_last_step = True
 
         # update the so far traveled distance
-        self.dist = self._step[COM_POSX, -1]
+        self.dist = self.dist + self._step_distances[i_prev_step]
         # choose the next step
         # copy to add the com x position only of the current local step variable
         step = np.copy(self.data[self._i_step])
-        assert step[COM_POSX, 0] < 0.005, \
-            "The COM X Position on each new step trajectory should start with 0.0 " \
-            f"but started with {step[COM_POSX, 0]}"
         # add the so far traveled distance to the x pos of the COM
         step[COM_POSX,:] += self.dist
         return step
 
-    def _add_trunk_euler_rotations(self):
-        '''Used to extend reference data with euler rotations of the trunk.
-           Before, trunk rotations were only given in unit quaternions.'''
-        from scipy.spatial.transform import Rotation as Rot
-
-        data_dict = spio.loadmat(self.path)
-        data = data_dict['Data']
-        data = data.flatten()
-        # save only the first 30 steps (constant speed)
-        data = data[:30]
-        new_data = np.ndarray(data.shape, dtype=np.object)
-
-
-        # iterate over all steps and add three more dimensions containing trunk euler rotations
-        for i, step in enumerate(data):
-            # get trunk rotation in quaternions: q1...q4
-            q1, q2 = step[TRUNK_ROT_Q1,:], step[TRUNK_ROT_Q2,:]
-            q3, q4 = step[TRUNK_ROT_Q3,:], step[TRUNK_ROT_Q4,:]
-            # quaternion in scalar-last (x, y, z, w) format.
-            old_rot_quat = np.array([q2, q3, q4, q1])
-            rot_quat = Rot.from_quat(old_rot_quat.transpose())
-            # convert to euler rotations
-            euler_x, euler_y, euler_z = rot_quat.as_euler('xyz').transpose()
-            # save the new angles in the reference trajectory data
-            dims, dur = step.shape
-            new_step = np.ndarray((dims + 3, dur), dtype=np.object)
-            new_step[0:dims,:] = step
-            new_step[dims:,:] = [euler_x, euler_y, euler_z]
-
-            new_data[i] = new_step
-
-        self.data = new_data.flatten()
-
-        data_dict['Data'] = new_data
-        print('BEFORE saved final')
-        # spio.savemat('Trajecs_Ramp_Slow_400Hz_EulerTrunkAdded.mat', data_dict, do_compression=True)
-        spio.savemat('Trajecs_Constant_Speed_400Hz.mat', data_dict, do_compression=True)
-        print('saved final')
-        raise SystemExit('This function was only used to transform '
-                         'the Trunk Quaternion to Euler Rotations.\n'
-                         'The transformed data was saved.\n'
-                         'This method is now only required for documentation.')
-
-    def _calculate_walking_speed(self):
-        step_speeds = []
-        for step in self.data:
-            com_vels = step[COM_VELX,:]
-            walk_speed = np.mean(com_vels)
-            step_speeds.append(walk_speed)
-
-            # filter speeds as are too noisy
-            speeds_filtered = smooth_exponential(step_speeds, alpha=0.2)
-
-        PLOT = False
-        if PLOT:
-            plt = self.plt
-            plt.plot(step_speeds)
-            plt.plot(speeds_filtered)
-            plt.xlabel('Step Nr. [ ]')
-            plt.ylabel('Mean COM Forward Velocity [m/s]')
-            plt.title('Changes in the walking speed of individual steps over time')
-            plt.legend([r'Original Mean Velocities', r'Exponentially Smoothed ($\alpha$=0.2)'])
-            plt.show()
-            # exit(33)
-
-        return speeds_filtered
-
     def get_step_velocity(self):
         """
         Returns the mean COM forward velocity of the current step
@@ -519,11 +572,10 @@ class ReferenceTrajectories:
            depends on the maximum range of a joint position or velocity.'''
         # load already determined and saved ranges or calculate and save if not yet happened
         try:
-            global labels
             npz = np.load(PATH_TRAJEC_RANGES)
             ranges = npz['ranges']
             if print_ranges:
-                for label, range in zip(labels, ranges):
+                for label, range in zip(self.labels, ranges):
                     print(f'{label}\t\t{range}')
             return ranges
         except FileNotFoundError:
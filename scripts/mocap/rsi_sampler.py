@@ -0,0 +1,144 @@
+"""
+Adaptive Reference State Initialization (RSI).
+
+Initial states are sampled from an online histogram over (step, phase bin) cells
+of the reference trajectories. Each cell is weighted by the rate of early terminations
+of the episodes initialized in it, so that difficult phases are trained more often.
+The prioritized distribution is mixed with the uniform RSI distribution.
+
+Each environment records the outcomes of its episodes locally. The TrainingMonitor
+periodically collects them from all environments, merges them into the global counts
+and sends these back, so all workers sample from the same distribution.
+"""
+import random
+import numpy as np
+
+# number of phase bins per step if the RSI positions are not snapped to a grid
+N_PHASE_BINS = 20
+# prior of each cell, the initial priority of all cells is PRIOR_ETS/PRIOR_INITS
+PRIOR_INITS = 2
+PRIOR_ETS = 1
+# older outcomes are discounted at each sync to track the changing policy
+COUNTS_DECAY = 0.9
+
+
+class SumTree:
+    """
+    Binary tree whose nodes contain the sum of their children.
+    The leaves hold the priorities, sampling and updating a priority are O(log n).
+    """
+    def __init__(self, n_leaves):
+        self.n_leaves = n_leaves
+        # first leaf index, the tree is complete with a power of two leaves
+        self._first_leaf = 1 << max(0, int(np.ceil(np.log2(max(1, n_leaves)))))
+        self._nodes = np.zeros(2 * self._first_leaf)
+
+    @property
+    def total(self):
+        return self._nodes[1]
+
+    def get(self, i_leaf):
+        return self._nodes[self._first_leaf + i_leaf]
+
+    def update(self, i_leaf, priority):
+        i_node = self._first_leaf + i_leaf
+        delta = priority - self._nodes[i_node]
+        while i_node >= 1:
+            self._nodes[i_node] += delta
+            i_node //= 2
+
+    def set_all(self, priorities):
+        """ Rebuilds the tree from all priorities at once, O(n). """
+        self._nodes[:] = 0
+        self._nodes[self._first_leaf:self._first_leaf + self.n_leaves] = priorities
+        # sum the children level by level up to the root
+        i_start = self._first_leaf
+        while i_start > 1:
+            children = self._nodes[i_start:2 * i_start]
+            self._nodes[i_start // 2:i_start] = children[0::2] + children[1::2]
+            i_start //= 2
+
+    def find(self, value):
+        """ :returns the index of the leaf the cumulative priority value falls in """
+        i_node = 1
+        while i_node < self._first_leaf:
+            left = 2 * i_node
+            if value < self._nodes[left] or self._nodes[left + 1] <= 0:
+                i_node = left
+            else:
+                value -= self._nodes[left]
+                i_node = left + 1
+        return min(i_node - self._first_leaf, self.n_leaves - 1)
+
+
+class AdaptiveRSISampler:
+    """
+    Samples the (step, phase bin) cells to initialize the episodes in,
+    proportional to the early termination rate of each cell.
+    """
+    def __init__(self, n_steps, n_phase_bins=N_PHASE_BINS, uniform_mix=0.5):
+        """ :param uniform_mix: probability of sampling uniformly instead of prioritized """
+        self.n_steps = n_steps
+        self.n_phase_bins = n_phase_bins
+        self.n_cells = n_steps * n_phase_bins
+        self.uniform_mix = uniform_mix
+        # merged counts of all environments
+        self.n_inits = np.zeros(self.n_cells)
+        self.n_ets = np.zeros(self.n_cells)
+        # counts of this environment since the last sync
+        self._new_inits = np.zeros(self.n_cells)
+        self._new_ets = np.zeros(self.n_cells)
+        self._tree = SumTree(self.n_cells)
+        self._tree.set_all(self.get_priorities())
+
+    def get_priorities(self):
+        """ :returns the smoothed early termination rate of each cell """
+        return (self.n_ets + self._new_ets + PRIOR_ETS) / \
+               (self.n_inits + self._new_inits + PRIOR_INITS)
+
+    def get_distribution(self):
+        """ :returns the sampling probabilities of each cell as (n_steps, n_phase_bins) """
+        priorities = self.get_priorities()
+        probs = (1 - self.uniform_mix) * priorities / np.sum(priorities) \
+                + self.uniform_mix / self.n_cells
+        return probs.reshape(self.n_steps, self.n_phase_bins)
+
+    def sample(self):
+        """ :returns (i_step, i_phase_bin) of the cell to initialize the next episode in """
+        if random.random() < self.uniform_mix:
+            i_cell = random.randrange(self.n_cells)
+        else:
+            i_cell = self._tree.find(random.random() * self._tree.total)
+        return divmod(i_cell, self.n_phase_bins)
+
+    def record(self, i_step, i_phase_bin, terminated_early):
+        """ Records the outcome of an episode initialized in the cell. """
+        i_cell = i_step * self.n_phase_bins + i_phase_bin
+        self._new_inits[i_cell] += 1
+        self._new_ets[i_cell] += terminated_early
+        self._tree.update(i_cell, (self.n_ets[i_cell] + self._new_ets[i_cell] + PRIOR_ETS) /
+                          (self.n_inits[i_cell] + self._new_inits[i_cell] + PRIOR_INITS))
+
+    def pop_new_counts(self):
+        """ :returns the counts (n_inits, n_ets) recorded since the last call and resets them """
+        counts = self._new_inits, self._new_ets
+        self._new_inits = np.zeros(self.n_cells)
+        self._new_ets = np.zeros(self.n_cells)
+        return counts
+
+    def set_counts(self, n_inits, n_ets):
+        """ Replaces the counts with the merged counts of all environments. """
+        self.n_inits = np.asarray(n_inits, dtype=np.float64)
+        self.n_ets = np.asarray(n_ets, dtype=np.float64)
+        self._tree.set_all(self.get_priorities())
+
+
+def merge_counts(n_inits, n_ets, new_counts, decay=COUNTS_DECAY):
+    """
+    Discounts the global counts and adds the new counts of all environments.
+    :param new_counts: list of (n_inits, n_ets) returned by pop_new_counts() of each env
+    :returns the merged (n_inits, n_ets)
+    """
+    n_inits = decay * n_inits + np.sum([inits for inits, _ in new_counts], axis=0)
+    n_ets = decay * n_ets + np.sum([ets for _, ets in new_counts], axis=0)
+    return n_inits, n_ets
@@ -3,9 +3,9 @@ import warnings
 warnings.filterwarnings('ignore', category=FutureWarning)
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 
-from scripts.plots.data_struct import Approach
+from scripts.plots.data_struct import Approach, get_approaches
 from scripts.plots.plot import plot_violin as violin
-from scripts.common.utils import config_pyplot, change_plot_properties
+from scripts.common.utils import config_pyplot, change_plot_properties, show_plot
 from scripts.plots import plot
 import seaborn as sns
 import numpy as np
@@ -103,7 +103,7 @@ def check_data_for_completeness(approach, mio_train_steps=16):
         subplot.title.set_text(metric_names_dict[metric.label])
         subplot.set_xticks(np.arange(5) * tick_distance_mio * 1e6)
         subplot.set_xticklabels([f'{x}M' for x in np.arange(5) * tick_distance_mio])
-    plt.show()
+    show_plot()
 
 
 def download_approach_data(approach_name, project_name, run_name=None):
@@ -135,7 +135,7 @@ def show_summary_score_advantages():
     # to show how good the summary score distinguishes between runs
     ap_names = [APD_NORM_ANGS_EXPMORE, APD_NORM_ANGS_SIGN_EXPMORE, APD_NORM_DELTA]
     metric_labels = [MET_SUM_SCORE, MET_TRAIN_EPRET, MET_STABLE_WALKS, MET_STEP_REW]
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     n_metrics = len(metric_labels)
     change_plot_properties(font_size=-2, tick_size=-2, line_width=+1)
     for i, metric_label in enumerate(metric_labels):
@@ -157,7 +157,7 @@ def show_summary_score_advantages():
             # subplot.set_yticks((np.arange(3)+1)*0.25)
             subplot.set_ylabel(metric_names_dict[metric.label])
             # subplot.set_xlabel(r'Training Timesteps [x$10^6$]')
-    plt.show()
+    show_plot()
 
 
 def compare_all_metrics():
@@ -165,7 +165,7 @@ def compare_all_metrics():
     ap_names = [APD_BSLN, APD_NORM_ANGS, APD_NORM_DELTA]
     # approach_names_dict[APT_BSLN] = 'Joint Torque'
     # approach_names_dict[APD_BSLN] = 'Target Angles'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     # metric_labels = [MET_TRAIN_EPRET, MET_STABLE_WALKS, MET_STEP_REW]
     n_metrics = len(metric_labels)
     subplots = []
@@ -197,7 +197,7 @@ def compare_all_metrics():
     # subplots[1].set_xlabel(r'Training Timesteps [x$10^6$]')
     subplots[-1].legend([approach_names_dict[ap] for ap in ap_names],
                         bbox_to_anchor=(1.2, 0.8))
-    plt.show()
+    show_plot()
 
 
 def compare_action_spaces():
@@ -207,7 +207,7 @@ def compare_action_spaces():
     approach_names_dict[APD_BSLN] = 'Target Angles'
     approach_names_dict[APD_NORM_ANGS] = 'Target Angles'
     approach_names_dict[APD_BSLN] = 'Target Angles'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     # metric_labels = [MET_TRAIN_EPRET, MET_STABLE_WALKS, MET_STEP_REW]
     n_metrics = len(metric_labels)
     subplots = []
@@ -238,14 +238,14 @@ def compare_action_spaces():
     subplots[1].set_xlabel(r'Training Timesteps [x$10^6$]')
     subplots[-1].legend([approach_names_dict[ap] for ap in ap_names],
                         bbox_to_anchor=(1.2, 0.8))
-    plt.show()
+    show_plot()
 
 
 def compare_baselines_8plots():
     ap_names = [APD_BSLN, APT_BSLN]
     approach_names_dict[APT_BSLN] = 'Joint Torque'
     approach_names_dict[APD_BSLN] = 'Target Angles'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     metric_labels = [MET_SUM_SCORE, MET_STABLE_WALKS, MET_STEP_REW,
                      MET_REW_POS, MET_REW_VEL,
                      MET_TRAIN_EPRET, MET_TRAIN_DIST, MET_TRAIN_EPLEN]
@@ -277,7 +277,7 @@ def compare_baselines_8plots():
             subplot.set_ylabel(metric_names_dict[metric.label])
     subplots[1].set_xlabel(r'Training Timesteps [x$10^6$]')
     subplots[-1].legend([approach_names_dict[ap] for ap in ap_names])
-    plt.show()
+    show_plot()
 
 def plot_return_only():
     plt = config_pyplot(fig_size=0.5)
@@ -287,7 +287,7 @@ def plot_return_only():
     approach_names_dict[APT_BSLN] = 'Joint Torques (Ours)'
     approach_names_dict[APD_NORM_ANGS] = 'Target Angles'
     approach_names_dict[APD_NORM_DELTA] = 'Angle Deltas (Ours)'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     max_dur = 1e6 * max([ap.train_duration_mio for ap in aps])
     metric_labels = [MET_STABLE_WALKS, MET_STEP_REW, MET_SUM_SCORE, MET_TRAIN_EPRET]
     # metric_labels = [MET_REW_POS, MET_REW_VEL, MET_REW_COM]
@@ -426,7 +426,7 @@ def plot_return_only():
     # else:
     #     subplots[-1].legend(subplots[2].get_lines(), legend_texts, fancybox=True, framealpha=0.6,
     #                         loc='upper left', bbox_to_anchor=(0.04, 0.42))
-    plt.show()
+    show_plot()
 
 
 def compare_main_plots():
@@ -447,7 +447,7 @@ def compare_main_plots():
     approach_names_dict[APT_BSLN] = 'Joint Torques'
     approach_names_dict[APD_NORM_ANGS] = 'Target Angles'
     approach_names_dict[APD_NORM_DELTA] = 'Angle Deltas'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     max_dur = 1e6 * max([ap.train_duration_mio for ap in aps])
     metric_labels = [MET_STABLE_WALKS, MET_STEP_REW, MET_SUM_SCORE, MET_TRAIN_EPRET]
     # metric_labels = [MET_REW_POS, MET_REW_VEL, MET_REW_COM]
@@ -590,7 +590,7 @@ def compare_main_plots():
     # plt.gcf().tight_layout(rect=[0.1, 0.5, 0.95, 1])
     fig.text(0.5, 0.04, x_label, ha='center', fontsize=font_size-1)
     plt.subplots_adjust(wspace=0.33, top=0.99, left=0.05, right=0.99, bottom=0.18)
-    plt.show()
+    show_plot()
     exit(33)
     legend_texts = [approach_names_dict[ap] for ap in ap_names]
     # assert 'ours' in ''.join(legend_texts).lower()
@@ -600,7 +600,7 @@ def compare_main_plots():
     else:
         subplots[-1].legend(subplots[2].get_lines(), legend_texts, fancybox=True, framealpha=0.6,
                             loc='upper left', bbox_to_anchor=(0.04, 0.42))
-    plt.show()
+    show_plot()
 
 
 
@@ -611,7 +611,7 @@ def compare_main_torque_plots():
     # approach_names_dict[APT_BSLN] = 'Joint Torques (Ours)'
     approach_names_dict[APD_NORM_ANGS] = 'Target Angles'
     approach_names_dict[APD_NORM_DELTA] = 'Angle Deltas (Ours)'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     train_dur = 1e6 * max([ap.train_duration_mio for ap in aps])
     metric_labels = [MET_STABLE_WALKS, MET_STEP_REW, MET_SUM_SCORE, MET_TRAIN_EPRET]
     # metric_labels = [MET_REW_POS, MET_REW_VEL, MET_REW_COM]
@@ -767,7 +767,7 @@ def compare_main_torque_plots():
     else:
         subplots[2].legend(subplots[2].get_lines(), legend_texts, fancybox=True, framealpha=0.6,
                             loc='upper left', bbox_to_anchor=(0.04, 1))
-    plt.show()
+    show_plot()
 
 
 
@@ -778,7 +778,7 @@ def compare_rewards():
     approach_names_dict[APD_NORM_ANGS] = 'Target Angles'
     approach_names_dict[APT_BSLN] = 'Joint Torques (Ours)'
     approach_names_dict[APD_NORM_DELTA] = 'Angle Deltas (Ours)'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     max_dur = 1e6 * max([ap.train_duration_mio for ap in aps])
     # metric_labels = [MET_SUM_SCORE, MET_STABLE_WALKS, MET_STEP_REW, MET_TRAIN_EPRET]
     metric_labels = [MET_REW_POS, MET_REW_VEL, MET_REW_COM]
@@ -838,14 +838,14 @@ def compare_rewards():
     legend_texts = [approach_names_dict[ap] for ap in ap_names]
     assert 'ours' in ''.join(legend_texts).lower()
     subplots[-1].legend(legend_texts, fancybox=True, framealpha=0.6)
-    plt.show()
+    show_plot()
 
 
 def compare_baselines_rews():
     ap_names = [APD_BSLN, APT_BSLN]
     approach_names_dict[APT_BSLN] = 'Joint Torque'
     approach_names_dict[APD_BSLN] = 'Target Angles'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     metric_labels = [MET_REW_POS, MET_REW_VEL, MET_REW_COM]
     n_metrics = len(metric_labels)
     font_size, tick_size, legend_size = \
@@ -879,7 +879,7 @@ def compare_baselines_rews():
     # subplots[1].set_xlabel(x_label)
     plt.subplots_adjust(wspace=0.4, top=0.99, left=0.04, right=0.99, bottom=0.18)
     subplots[-1].legend([approach_names_dict[ap] for ap in ap_names])
-    plt.show()
+    show_plot()
 
 
 def compare_baselines_training_curves():
@@ -887,7 +887,7 @@ def compare_baselines_training_curves():
     ap_names = [APD_BSLN, APT_BSLN]
     approach_names_dict[APT_BSLN] = 'Joint Torque'
     approach_names_dict[APD_BSLN] = 'Target Angles'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     metric_labels = [MET_TRAIN_EPRET, MET_TRAIN_STEPREW, MET_TRAIN_DIST, MET_TRAIN_EPLEN]
     n_metrics = len(metric_labels)
     font_size, tick_size, legend_size = \
@@ -921,7 +921,7 @@ def compare_baselines_training_curves():
     # subplots[1].set_xlabel(x_label)
     plt.subplots_adjust(wspace=0.4, top=0.99, left=0.04, right=0.99, bottom=0.18)
     subplots[-1].legend([approach_names_dict[ap] for ap in ap_names])
-    plt.show()
+    show_plot()
 
 
 def compare_baselines_violin():
@@ -929,7 +929,7 @@ def compare_baselines_violin():
     ap_names = [APD_BSLN, APT_BSLN]
     approach_names_dict[APT_BSLN] = 'Joint Torque'
     approach_names_dict[APD_BSLN] = 'Target Angles'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     metric_label = MET_STEPS_TO_CONV
     font_size, tick_size, legend_size = \
         change_plot_properties(font_size=2, tick_size=+3, legend_fontsize=-2, line_width=+1)
@@ -951,7 +951,7 @@ def compare_baselines_violin():
     plt.gca().set_yticklabels([f'{x}' for x in arange * tick_distance_mio])
 
     # plt.subplots_adjust(wspace=0.4, top=0.99, left=0.04, right=0.99, bottom=0.18)
-    plt.show()
+    show_plot()
 
 
 def compare_violins():
@@ -967,7 +967,7 @@ def compare_violins():
     approach_names_dict[APT_MRR_STEPS] = 'Mirror\nPolicy'
     approach_names_dict[APT_DUP] = 'Mirror\nExperiences'
 
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     metric_label = MET_STEPS_TO_CONV
     font_size, tick_size, legend_size = \
         change_plot_properties(font_size=5, tick_size=7, line_width=+1)
@@ -988,7 +988,7 @@ def compare_violins():
     plt.gca().set_yticks(arange * 1e6)
     plt.gca().set_yticklabels([f'{x}' for x in arange])
     # plt.subplots_adjust(wspace=0.4, top=0.99, left=0.04, right=0.99, bottom=0.18)
-    plt.show()
+    show_plot()
 
 
 def plot_metrics_table():
@@ -997,7 +997,7 @@ def plot_metrics_table():
     ap_names = [APT_BSLN, APT_BSLN_HALF_BS, APT_DUP, APT_MRR_STEPS]
     # approach_names_dict[APT_BSLN] = 'Joint Torque'
     # approach_names_dict[APD_BSLN] = 'Target Angles'
-    aps = [Approach(name) for name in ap_names]
+    aps = get_approaches(ap_names)
     for ap in aps:
         print('\nApproach:', ap.name)
         print(f'{ap.final_sum_score_mean} \pm {ap.final_sum_score_std} \n'
@@ -1008,6 +1008,14 @@ def plot_metrics_table():
               )
 
 
+# figures that can be rendered headless with: python -m scripts.plots.render --figures ...
+FIGURES = {fig.__name__: fig for fig in [
+    show_summary_score_advantages, compare_all_metrics, compare_action_spaces,
+    compare_baselines_8plots, plot_return_only, compare_main_plots, compare_main_torque_plots,
+    compare_rewards, compare_baselines_rews, compare_baselines_training_curves,
+    compare_baselines_violin, compare_violins]}
+
+
 if __name__ == '__main__':
     # download_approach_data(APT_BSLN, 'final3d_trq')
     # plot_metrics_table()
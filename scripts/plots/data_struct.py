@@ -1,8 +1,14 @@
+from functools import lru_cache
 from scripts.plots.wandb_api import Api
 from scripts.common import utils
 import numpy as np
 import os
 
+# smoothing of the metric curves over the training time
+SMOOTHING_ALPHA = 0.005
+# metric curves with less points are not smoothed
+MIN_POINTS_TO_SMOOTH = 10
+
 class Metric:
     def __init__(self, label, approach, train_duration_mio=None):
         self.label = label
@@ -21,19 +27,15 @@ class Metric:
             self.data = np.array(self.data)
             return
         # cut all lists to the same minimum length
-        # but avoid runs that failed too quickly
-        while True:
-            lens = [len(values) for values in self.data]
-            min_len = np.min(lens)
-            max_len = np.max(lens)
-            # when the minimum run length is too short, delete this run
-            if (max_len - min_len) > 0.05 * max_len:
-                # delete the run with the too short length
-                index = lens.index(min_len)
-                failed_run_data = self.data.pop(index)
-                assert min_len == len(failed_run_data)
-                print(f'Removed a run with min len of {min_len} where max is {max_len}')
-            else: break
+        # but avoid runs that failed too quickly:
+        # remove all runs that are more than 5% shorter than the longest one
+        lens = np.array([len(values) for values in self.data])
+        max_len = np.max(lens)
+        is_complete = (max_len - lens) <= 0.05 * max_len
+        for failed_len in lens[~is_complete]:
+            print(f'Removed a run with min len of {failed_len} where max is {max_len}')
+        self.data = [values for values, complete in zip(self.data, is_complete) if complete]
+        min_len = np.min(lens[is_complete])
 
         data = [values[-min_len:] for values in self.data]
         self.data = np.array(data)
@@ -43,60 +45,69 @@ class Metric:
         self.data = data
 
     def calculate_statistics(self):
-        self.mean = np.mean(self.data, axis=0)
-        self.std = np.std(self.data, axis=0)
-        if isinstance(self.mean, np.ndarray) and len(self.mean) > 10:
-            self.mean_fltrd = utils.smooth_exponential(self.mean, 0.005)
-            self.std_fltrd = utils.smooth_exponential(self.std, 0.005)
+        self.set_statistics(np.mean(self.data, axis=0), np.std(self.data, axis=0))
+
+    def set_statistics(self, mean, std, mean_fltrd=None, std_fltrd=None):
+        """ Sets the mean and std over all runs and smoothes them if not specified. """
+        self.mean, self.std = mean, std
+        if isinstance(self.mean, np.ndarray) and len(self.mean) > MIN_POINTS_TO_SMOOTH:
+            self.mean_fltrd = mean_fltrd if mean_fltrd is not None \
+                else utils.smooth_exponential(self.mean, SMOOTHING_ALPHA)
+            self.std_fltrd = std_fltrd if std_fltrd is not None \
+                else utils.smooth_exponential(self.std, SMOOTHING_ALPHA)
         else: self.mean_fltrd = self.mean
 
 
+def get_train_duration_mio(approach_name):
+    return 16 if 'pd' in approach_name else 8
+
+
+def get_metrics_path(approach_name):
+    return utils.get_absolute_project_path() + f'graphs/{approach_name}/metrics.npz'
+
+
+@lru_cache(maxsize=None)
+def load_metrics(approach_name):
+    """ Loads the saved metrics of an approach only once.
+        :returns dict: metric label -> (runs x points) or (runs,) array """
+    with np.load(get_metrics_path(approach_name)) as npz:
+        return {label: npz[label] for label in npz.files}
+
+
+@lru_cache(maxsize=None)
+def _get_approaches(approach_names):
+    stats = ApproachesStats(approach_names)
+    return tuple(Approach(name, stats=stats) for name in approach_names)
+
+
+def get_approaches(approach_names):
+    """ Approaches loaded from disc with all statistics calculated at once.
+        Memoized, repeated calls with the same approaches return the same objects. """
+    return list(_get_approaches(tuple(approach_names)))
+
+
 class Approach:
-    def __init__(self, approach_name, project_name=None, run_name=None, metrics_names=[]):
+    def __init__(self, approach_name, project_name=None, run_name=None, metrics_names=None,
+                 stats=None):
+        """:param stats: ApproachesStats containing this approach, loaded from disc if None"""
         self.name = approach_name
         self.project_name = project_name
-        self.train_duration_mio = 16 if 'pd' in approach_name else 8
+        self.train_duration_mio = get_train_duration_mio(approach_name)
         self.run_name = run_name
         self.path = utils.get_absolute_project_path() + f'graphs/{self.name}/'
-        self.metrics_names = metrics_names
-        data_on_disc = self._get_metrics_data()
-        self._calculate_statistics()
-        if data_on_disc:
-            self.get_table_metrics()
-
-    def _get_metrics_data(self):
+        self.metrics_names = list(metrics_names) if metrics_names is not None else []
         # first try to load from disc
-        metrics_path = self.path + 'metrics.npz'
-        data_is_on_disc = os.path.exists(metrics_path)
-        if data_is_on_disc:
-            from scripts.plots.compare import MET_SUM_SCORE, MET_STEPS_TO_CONV
-            from scripts.common.callback import EVAL_INTERVAL_RARE
-            self.metrics = []
-            npz = np.load(metrics_path)
-            for metric_label in npz.keys():
-                self.metrics_names.append(metric_label)
-                metric = Metric(metric_label, self, self.train_duration_mio)
-                metric_data = npz[metric_label]
-                # normalize summary score
-                if metric_label == MET_SUM_SCORE:
-                    max_score = self.train_duration_mio*1e6/EVAL_INTERVAL_RARE
-                    metric_data /= 0.5*max_score
-                    # normalize training duration to range [0,1]
-                    metric_data *= 16/self.train_duration_mio
-                    metric_data *= 100 # show in percent
-                elif metric_label == MET_STEPS_TO_CONV:
-                    self.steps_to_conv = metric_data
-                    self.steps_to_conv_mean = np.mean(metric_data)
-                    self.steps_to_conv_std = np.std(metric_data)
-                metric.set_np_data(metric_data)
-                self.metrics.append(metric)
+        if stats is None and os.path.exists(self.path + 'metrics.npz'):
+            stats = ApproachesStats([approach_name])
+        if stats is not None:
+            stats.set_approach_metrics(self)
         # fetch from wandb if not on disc
         else:
             self._api = Api(self.project_name)
             self.metrics = [Metric(name, self, self.train_duration_mio) for name in self.metrics_names]
             self._api.get_metrics(self)
             self._metrics_to_np()
-        return data_is_on_disc
+            self._calculate_statistics()
 
     def _calculate_statistics(self):
         for metric in self.metrics:
@@ -121,55 +132,137 @@ class Approach:
         print('Successfully saved approach:', self.name)
 
 
-    def get_table_metrics(self):
-        from scripts.plots.compare import MET_SUM_SCORE, MET_STEP_REW
-        for metric in self.metrics:
-            if metric.label == MET_SUM_SCORE:
-                self.final_sum_scores = metric.data[:, -1]
-                self.final_sum_score_mean = np.mean(self.final_sum_scores)
-                self.final_sum_score_std = np.std(self.final_sum_scores)
-            elif metric.label == MET_STEP_REW:
-                self.final_rews = metric.data[:, -1]
-                # Rew at convergence
-                # determine convergence timepoint as training time percentage
-                # conv_steps_frac = self.steps_to_conv / (self.train_duration_mio*1e6)
-                # conv_indices = np.array([len(rews) for rews in metric.data]) * conv_steps_frac
-                # conv_indices = conv_indices.astype(int)
-                # self.rews_at_conv = metric.data[range(len(conv_indices)),conv_indices]
-                # query only mean and std curves as we either way need to show mean and std
-                conv_steps_frac = np.mean(self.steps_to_conv) / (self.train_duration_mio*1e6)
-                conv_index = int(metric.data.shape[1] * conv_steps_frac)
-                self.rews_at_conv_mean = metric.mean_fltrd[conv_index]
-                self.rews_at_conv_std = metric.std_fltrd[conv_index]
-
-                # Rews at training end
-                self.rews_at_end_mean = metric.mean_fltrd[-1]
-                self.rews_at_end_std = metric.std_fltrd[-1]
-
-                # Steps to 75% human-likeness
-                # get indices of 75% rew and map these to training time
-                rew75_indices = np.argmax(metric.data >= 0.75, axis=1)
-                n_points = len(metric.mean)
-                rew75_indices[rew75_indices==0] = n_points
-                self.steps_to_75rew = rew75_indices / n_points * self.train_duration_mio
-                self.steps_to_75rew_mean = np.mean(self.steps_to_75rew)
-                self.steps_to_75rew_std = np.std(self.steps_to_75rew)
-
-        # print('\nApproach: ', self.name)
-        # print('Converged after percent: ', conv_steps_frac)
-        # print('indices: ', conv_index)
-        # print('Rews MEAN at CONV: ', self.rews_at_conv_mean)
-        # print('Rews STD at CONV: ', self.rews_at_conv_std)
-        # print('75 Rews reached after: ', self.steps_to_75rew)
+class ApproachesStats:
+    """
+    Saved metrics of multiple approaches in a single array (approach x run x metric x time)
+    padded with NaNs, with the statistics of all approaches and metrics calculated at once.
+    Scalar metrics (e.g. steps to convergence) are saved at time index 0.
+    """
+
+    def __init__(self, approach_names):
+        from scripts.plots.compare import MET_SUM_SCORE
+        from scripts.common.callback import EVAL_INTERVAL_RARE
+        self.approach_names = list(approach_names)
+        metrics = [load_metrics(name) for name in self.approach_names]
+        self.train_duration_mio = np.array([get_train_duration_mio(name)
+                                            for name in self.approach_names])
+        # metric labels in the order they were saved
+        self.approach_labels = [list(ap_metrics.keys()) for ap_metrics in metrics]
+        self.labels = list(dict.fromkeys(label for labels in self.approach_labels
+                                         for label in labels))
+        all_values = [values for ap_metrics in metrics for values in ap_metrics.values()]
+        max_runs = max(values.shape[0] for values in all_values)
+        max_points = max(values.shape[1] if values.ndim > 1 else 1 for values in all_values)
+
+        n_approaches, n_metrics = len(self.approach_names), len(self.labels)
+        self.data = np.full((n_approaches, max_runs, n_metrics, max_points), np.nan)
+        self.n_runs = np.zeros((n_approaches, n_metrics), dtype=int)
+        self.n_points = np.zeros((n_approaches, n_metrics), dtype=int)
+        self.is_scalar = np.zeros((n_approaches, n_metrics), dtype=bool)
+        for i_ap, ap_metrics in enumerate(metrics):
+            for label, values in ap_metrics.items():
+                i_met = self.labels.index(label)
+                # normalize summary score
+                if label == MET_SUM_SCORE:
+                    train_duration_mio = self.train_duration_mio[i_ap]
+                    max_score = train_duration_mio*1e6/EVAL_INTERVAL_RARE
+                    values = values / (0.5*max_score)
+                    # normalize training duration to range [0,1]
+                    values = values * 16/train_duration_mio
+                    values = values * 100 # show in percent
+                self.is_scalar[i_ap, i_met] = values.ndim == 1
+                values = values.reshape((values.shape[0], -1))
+                self.n_runs[i_ap, i_met], self.n_points[i_ap, i_met] = values.shape
+                self.data[i_ap, :values.shape[0], i_met, :values.shape[1]] = values
+
+        self._calculate_statistics()
+        self._calculate_table_metrics()
+
+    def _calculate_statistics(self):
+        """ Mean and std over all runs ignoring the padding and smoothed curves. """
+        is_valid = ~np.isnan(self.data)
+        counts = np.sum(is_valid, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = np.sum(np.where(is_valid, self.data, 0), axis=1) / counts
+            deviations = np.where(is_valid, self.data - self.mean[:, np.newaxis], 0)
+            self.std = np.sqrt(np.sum(deviations ** 2, axis=1) / counts)
+        self.mean_fltrd = utils.smooth_exponential(self.mean, SMOOTHING_ALPHA, axis=-1)
+        self.std_fltrd = utils.smooth_exponential(self.std, SMOOTHING_ALPHA, axis=-1)
+
+    def _calculate_table_metrics(self):
+        """ Final summary scores, steps to convergence, rewards at convergence and training end
+            and steps to reach 75% imitation reward of all approaches. """
+        from scripts.plots.compare import MET_SUM_SCORE, MET_STEP_REW, MET_STEPS_TO_CONV
+        self.has_table_metrics = all(label in self.labels for label in
+                                     [MET_SUM_SCORE, MET_STEP_REW, MET_STEPS_TO_CONV])
+        if not self.has_table_metrics: return
+        i_sum, i_rew, i_conv = [self.labels.index(label) for label in
+                                [MET_SUM_SCORE, MET_STEP_REW, MET_STEPS_TO_CONV]]
+        ap_indices = np.arange(len(self.approach_names))
+        train_steps = self.train_duration_mio * 1e6
+
+        # approaches x runs, NaN for not existing runs
+        self.steps_to_conv = self.data[:, :, i_conv, 0]
+        self.final_sum_scores = self.data[ap_indices, :, i_sum, self.n_points[:, i_sum] - 1]
+        # steps to 75% human-likeness:
+        # get indices of 75% rew and map these to training time
+        n_points = self.n_points[:, i_rew]
+        rews = self.data[:, :, i_rew, :]
+        with np.errstate(invalid='ignore'):
+            rew75_indices = np.argmax(rews >= 0.75, axis=-1)
+        rew75_indices = np.where(rew75_indices == 0, n_points[:, np.newaxis], rew75_indices)
+        self.steps_to_75rew = rew75_indices / n_points[:, np.newaxis] \
+                              * self.train_duration_mio[:, np.newaxis]
+        has_run = np.arange(self.data.shape[1]) < self.n_runs[:, i_rew, np.newaxis]
+        self.steps_to_75rew[~has_run] = np.nan
+
+        # rew at convergence: determine convergence timepoint as training time percentage
+        # query only mean and std curves as we either way need to show mean and std
+        conv_steps_frac = np.nanmean(self.steps_to_conv, axis=1) / train_steps
+        conv_indices = np.minimum((n_points * conv_steps_frac).astype(int), n_points - 1)
+        self.rews_at_conv_mean = self.mean_fltrd[ap_indices, i_rew, conv_indices]
+        self.rews_at_conv_std = self.std_fltrd[ap_indices, i_rew, conv_indices]
+        # rews at training end
+        self.rews_at_end_mean = self.mean_fltrd[ap_indices, i_rew, n_points - 1]
+        self.rews_at_end_std = self.std_fltrd[ap_indices, i_rew, n_points - 1]
+
+    def set_approach_metrics(self, approach):
+        """ Sets the metrics with their statistics and the table metrics of the approach. """
+        from scripts.plots.compare import MET_STEPS_TO_CONV, MET_SUM_SCORE
+        i_ap = self.approach_names.index(approach.name)
+        approach.metrics = []
+        for label in self.approach_labels[i_ap]:
+            if label not in approach.metrics_names: approach.metrics_names.append(label)
+            i_met = self.labels.index(label)
+            n_runs, n_points = self.n_runs[i_ap, i_met], self.n_points[i_ap, i_met]
+            metric = Metric(label, approach, approach.train_duration_mio)
+            if self.is_scalar[i_ap, i_met]:
+                metric.set_np_data(self.data[i_ap, :n_runs, i_met, 0])
+                metric.set_statistics(self.mean[i_ap, i_met, 0], self.std[i_ap, i_met, 0])
+            else:
+                metric.set_np_data(self.data[i_ap, :n_runs, i_met, :n_points])
+                metric.set_statistics(self.mean[i_ap, i_met, :n_points],
+                                      self.std[i_ap, i_met, :n_points],
+                                      self.mean_fltrd[i_ap, i_met, :n_points],
+                                      self.std_fltrd[i_ap, i_met, :n_points])
+            if label == MET_STEPS_TO_CONV:
+                approach.steps_to_conv = metric.data
+                approach.steps_to_conv_mean = np.mean(metric.data)
+                approach.steps_to_conv_std = np.std(metric.data)
+            approach.metrics.append(metric)
 
+        if not self.has_table_metrics: return
+        n_runs = self.n_runs[i_ap, self.labels.index(MET_SUM_SCORE)]
+        approach.final_sum_scores = self.final_sum_scores[i_ap, :n_runs]
+        approach.steps_to_75rew = self.steps_to_75rew[i_ap][~np.isnan(self.steps_to_75rew[i_ap])]
         # round all metrics
-        self.final_sum_score_mean = np.round(self.final_sum_score_mean, 1)
-        self.final_sum_score_std = np.round(self.final_sum_score_std, 1)
-        self.steps_to_conv_mean = int(self.steps_to_conv_mean)
-        self.steps_to_conv_std = int(self.steps_to_conv_std)
-        self.steps_to_75rew_mean = np.round(self.steps_to_75rew_mean, 1)
-        self.steps_to_75rew_std = np.round(self.steps_to_75rew_std,1)
-        self.rews_at_conv_mean = np.round(self.rews_at_conv_mean, 2)
-        self.rews_at_conv_std = np.round(self.rews_at_conv_std, 2)
-        self.rews_at_end_mean = np.round(self.rews_at_end_mean, 2)
-        self.rews_at_end_std = np.round(self.rews_at_end_std, 2)
+        approach.final_sum_score_mean = np.round(np.nanmean(approach.final_sum_scores), 1)
+        approach.final_sum_score_std = np.round(np.nanstd(approach.final_sum_scores), 1)
+        approach.steps_to_conv_mean = int(approach.steps_to_conv_mean)
+        approach.steps_to_conv_std = int(approach.steps_to_conv_std)
+        approach.steps_to_75rew_mean = np.round(np.mean(approach.steps_to_75rew), 1)
+        approach.steps_to_75rew_std = np.round(np.std(approach.steps_to_75rew), 1)
+        approach.rews_at_conv_mean = np.round(self.rews_at_conv_mean[i_ap], 2)
+        approach.rews_at_conv_std = np.round(self.rews_at_conv_std[i_ap], 2)
+        approach.rews_at_end_mean = np.round(self.rews_at_end_mean[i_ap], 2)
+        approach.rews_at_end_std = np.round(self.rews_at_end_std[i_ap], 2)
@@ -1,7 +1,7 @@
 import numpy as np
 import pandas as pd
 import seaborn as sns
-from scripts.common.utils import config_pyplot
+from scripts.common.utils import config_pyplot, show_plot
 
 sns.set_context("paper")
 plt = config_pyplot(font_size=20, tick_size=20)
@@ -51,4 +51,4 @@ if __name__ == '__main__':
 
     plot_violin(['Baseline', 'Normalized\nAngles', 'Normalized\nAngle Deltas'],
                 means, aps, '', 'Training Timesteps [$x10^6$]')
-    plt.show()
\ No newline at end of file
+    show_plot()
\ No newline at end of file
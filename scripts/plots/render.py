@@ -0,0 +1,119 @@
+"""
+Headless batch rendering of figures to files in parallel worker processes.
+The workers use the Agg backend and don't require a display.
+- the figures of compare.py declared in compare.FIGURES
+- the trajectory comparisons dumped by the Monitor during training
+
+Usage (from the project root):
+    python -m scripts.plots.render --list
+    python -m scripts.plots.render --figures compare_main_plots compare_rewards --workers 2
+    python -m scripts.plots.render --monitor-dumps graphs/monitor/ --out graphs/monitor/figures/
+"""
+import argparse, glob, os, time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# workers inherit the environment and activate the Agg backend before importing pyplot
+os.environ['HEADLESS_PLOTS'] = '1'
+
+from scripts.common.utils import log, abs_project_path, set_plot_output, show_plot, \
+    get_saved_plots, PLOT_SAVE_DPI
+
+FIGURES_OUT_PATH = abs_project_path + 'graphs/figures/'
+N_RENDER_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+
+def render_figure(name, out_dir, fmt='png', dpi=PLOT_SAVE_DPI):
+    """ Renders a figure of compare.FIGURES. :returns the paths of the saved files """
+    # imported in the worker, compare.py configures pyplot at import
+    from scripts.plots import compare
+    set_plot_output(out_dir, name, fmt, dpi)
+    try:
+        compare.FIGURES[name]()
+    except SystemExit:
+        # some figures exit after showing the first plot
+        pass
+    return get_saved_plots()
+
+
+def render_monitor_dump(path, out_dir, fmt='png', dpi=PLOT_SAVE_DPI):
+    """ Renders the trajectory comparison of a Monitor dump. :returns the paths of the saved files """
+    from scripts.plots.trajecs import load_trajecs_buffers, plot_sim_ref_trajecs
+    name = os.path.splitext(os.path.basename(path))[0]
+    set_plot_output(out_dir, name, fmt, dpi)
+    plot_sim_ref_trajecs(load_trajecs_buffers(path))
+    show_plot()
+    return get_saved_plots()
+
+
+def render_all(jobs, n_workers=N_RENDER_WORKERS):
+    """
+    Renders the figures in parallel worker processes.
+    :param jobs: list of (name, function, args) with functions of this module
+    :returns dict: name -> list of saved paths, or the exception raised while rendering
+    """
+    results = {}
+    # spawn fresh interpreters: forking a process with an initialized pyplot is not safe
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn')) as pool:
+        futures = {pool.submit(function, *args): name for name, function, args in jobs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as error:
+                results[name] = error
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--figures', nargs='*', default=[],
+                        help='names of figures in compare.FIGURES, "all" renders all of them')
+    parser.add_argument('--monitor-dumps', nargs='?', const=None, default=False, metavar='DIR',
+                        help='render the trajectory dumps of the Monitor (default dir if empty)')
+    parser.add_argument('--out', default=None, help=f'output directory, default {FIGURES_OUT_PATH}')
+    parser.add_argument('--workers', type=int, default=N_RENDER_WORKERS)
+    parser.add_argument('--format', default='png', help='file format, e.g. png, pdf, svg')
+    parser.add_argument('--dpi', type=int, default=PLOT_SAVE_DPI)
+    parser.add_argument('--list', action='store_true', help='list the declared figures and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        from scripts.plots.compare import FIGURES
+        print('\n'.join(FIGURES))
+        return
+
+    jobs = []
+    if args.figures:
+        from scripts.plots.compare import FIGURES
+        names = list(FIGURES) if args.figures == ['all'] else args.figures
+        unknown = [name for name in names if name not in FIGURES]
+        if unknown: parser.error(f'Unknown figures {unknown}, choose from {list(FIGURES)}')
+        out_dir = args.out or FIGURES_OUT_PATH
+        jobs += [(name, render_figure, (name, out_dir, args.format, args.dpi)) for name in names]
+
+    if args.monitor_dumps is not False:
+        from scripts.plots.trajecs import TRAJECS_DUMP_PATH
+        dump_dir = args.monitor_dumps or TRAJECS_DUMP_PATH
+        out_dir = args.out or os.path.join(dump_dir, 'figures')
+        dumps = sorted(glob.glob(os.path.join(dump_dir, 'trajecs_*.npz')))
+        dumps = [dump for dump in dumps if not dump.endswith('.tmp.npz')]
+        if not dumps: log(f'No Monitor dumps found in {dump_dir}')
+        jobs += [(dump, render_monitor_dump, (dump, out_dir, args.format, args.dpi))
+                 for dump in dumps]
+
+    if not jobs: parser.error('Nothing to render, specify --figures and/or --monitor-dumps.')
+
+    t_start = time.perf_counter()
+    results = render_all(jobs, args.workers)
+    failed = {name: error for name, error in results.items() if isinstance(error, Exception)}
+    log(f'Rendered {len(results) - len(failed)}/{len(results)} figures '
+        f'in {time.perf_counter() - t_start:.1f}s with {args.workers} workers:',
+        [f'{name}:\t {paths}' for name, paths in results.items() if name not in failed]
+        + [f'FAILED {name}:\t {error!r}' for name, error in failed.items()])
+    if failed: raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Comparison of simulation and reference trajectories recorded by the Monitor.
+
+The Monitor dumps its trajectory buffers as npz files into TRAJECS_DUMP_PATH
+instead of plotting them during training. The dumps are rendered offline with
+    python -m scripts.plots.render --monitor-dumps
+or shown interactively with plot_sim_ref_trajecs().
+"""
+import os
+import numpy as np
+import seaborn as sns
+from scripts.common.utils import config_pyplot, change_plot_properties, abs_project_path
+
+# the Monitor of each env process overwrites its own dump file
+TRAJECS_DUMP_PATH = abs_project_path + 'graphs/monitor/'
+
+
+def get_dump_path(name, dump_dir=TRAJECS_DUMP_PATH):
+    return os.path.join(dump_dir, f'trajecs_{name}.npz')
+
+
+def save_trajecs_buffers(buffers, path):
+    """ Saves the buffers, the file is replaced atomically
+        to never render a partially written dump. """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **buffers)
+    os.replace(tmp_path, path)
+
+
+def load_trajecs_buffers(path):
+    """ :returns dict with the buffers saved with save_trajecs_buffers() """
+    with np.load(path) as npz:
+        buffers = {name: npz[name] for name in npz.files}
+    # scalars are saved as 0-dim arrays
+    for name in ['speed_control', 'plot_ref_distrib', 'title']:
+        if name in buffers: buffers[name] = buffers[name].item()
+    return buffers
+
+
+def plot_sim_ref_trajecs(buffers, plot_torques=False, plot_actions=False, plot_rews=False):
+    """
+    Plot simulation and reference trajectories in a single figure to compare them.
+    :param buffers: dict with the Monitor buffers
+        'trajecs' (sim/ref/ref_mean/ref_std, kinem_indices, timesteps), 'dones', 'speeds',
+        'actions', 'torques', 'rewards', 'returns', 'kinem_labels', 'not_actuated_joints',
+        'speed_control', 'plot_ref_distrib' and an optional 'title'
+    :returns pyplot object with the drawn figure, call show_plot() to show or save it
+    """
+    plt = config_pyplot(fig_size=True, font_size=12, tick_size=12, legend_fontsize=16)
+    plt.rcParams.update({'figure.autolayout': False})
+    plt.rcParams['figure.figsize'] = (19.2, 6.8)
+    plt.figure()
+    plt.subplots_adjust(top=0.974, bottom=0.13, left=0.06, right=0.978, hspace=0.15, wspace=0.44)
+    font_size, _, _ = change_plot_properties(-4, -2, -2, 1)
+    sns.set_style("whitegrid", {'axes.edgecolor':'#ffffff00'})
+    names = ['Simulation'] # line names (legend)
+    second_y_axis_pos = 1.0
+
+    trajecs_buffer = buffers['trajecs']
+    kinem_labels = np.asarray(buffers['kinem_labels'])
+    dones_buf = buffers['dones']
+    speed_control = buffers['speed_control']
+    plot_ref_distrib = buffers['plot_ref_distrib']
+
+    ONLY_ACTUATED_JOINTS = True
+    if ONLY_ACTUATED_JOINTS:
+        # both legs
+        # inds = list(range(6,14)) + list(range(20, 27))
+        # right leg only
+        inds = list(range(6,10)) + list(range(20, 24))
+        trajecs_buffer = trajecs_buffer[:, inds, :]
+        kinem_labels = kinem_labels[inds]
+        plt.rcParams.update({'figure.autolayout': False})
+
+    if speed_control:
+        # plt.rcParams.update({'axes.labelsize': 14})
+        num_joints = 2
+        rows, cols = 3, 1
+        # only plot com x pos and velocity
+        inds = [0, 9]
+        trajecs_buffer = trajecs_buffer[:, inds, :]
+        kinem_labels = kinem_labels[inds]
+        y_labels = ['Moved Distance [m]', 'COM X Vel [m/s]']
+    else:
+        num_joints = len(kinem_labels)
+        cols = 5
+        rows = int((num_joints+1)/cols) + 1
+        if ONLY_ACTUATED_JOINTS:
+            cols = 4
+            rows = 2
+    # plot sim trajecs
+    trajecs = trajecs_buffer[0,:,:]
+    # collect axes to reuse them for overlaying multiple plots
+    axes = []
+    # collect different lines to place the legend in a separate subplot
+    lines = []
+    for i_joint in range(num_joints):
+        try: axes.append(plt.subplot(rows, cols, i_joint + 1, sharex=axes[i_joint-1]))
+        except: axes.append(plt.subplot(rows, cols, i_joint + 1))
+        trajec = trajecs[i_joint, :]
+        line = plt.plot(trajec)
+        # show episode ends
+        plt.rcParams['lines.linewidth'] = 1
+        plt.vlines(np.argwhere(dones_buf).flatten()+1,
+                   np.min(trajec), np.max(trajec), colors='#cccccc', linestyles='dashed')
+        plt.rcParams['lines.linewidth'] = 2
+        if speed_control:
+            plt.ylabel(y_labels[i_joint])
+        else:
+            plt.ylabel(f'{i_joint+1}. ' + kinem_labels[i_joint])
+    lines.append(line[0])
+
+    # plot ref trajec distributions (mean + 2std)
+    if plot_ref_distrib:
+        trajecs = trajecs_buffer[2,:,:]
+        stds = trajecs_buffer[3,:,:]
+        for i_joint in range(num_joints):
+            trajec = trajecs[i_joint, :]
+            std = stds[i_joint, :]
+            line = axes[i_joint].plot(trajec)
+            axes[i_joint].fill_between(range(len(trajec)), trajec+std, trajec-std,
+                                       color='orange', alpha=0.5)
+        lines.append(line[0])
+        names.append('Reference Distribution\n(mean $\pm$ 2std)')
+
+    PLOT_REFS = True
+    if PLOT_REFS:
+        trajecs = trajecs_buffer[1, :, :]
+        for i_joint in range(num_joints):
+            trajec = trajecs[i_joint, :]
+            line = axes[i_joint].plot(trajec, color='red' if plot_ref_distrib else 'orange')
+
+        lines.append(line[0])
+        names.append('Reference')
+
+    def _plot_actions(buffer, name, line_color='#777777'):
+        with sns.axes_style("white", {"axes.edgecolor": '#ffffff00',
+                                      "ytick.color":'#ffffff00'}):
+            i_not_actuated = buffers['not_actuated_joints']
+            i_actuated = 0
+            plt.rcParams['lines.linewidth'] = 1
+            for i_joint in range(num_joints):
+                if i_joint in i_not_actuated:
+                    continue
+                if i_actuated >= buffer.shape[0]:
+                    break
+                act_plt = axes[i_joint].twinx()
+                act_plt.spines['right'].set_position(('axes', second_y_axis_pos))
+                line = act_plt.plot(buffer[i_actuated, :], line_color+'77')
+                act_plt.tick_params(axis='y', labelcolor=line_color)
+                i_actuated += 1
+            plt.rcParams['lines.linewidth'] = 2
+        lines.append(line[0])
+        names.append(name)
+
+    if plot_torques:
+        _plot_actions(buffers['torques']/1000, "Joint Torque [kNm]")
+        second_y_axis_pos = 1.12
+
+    if plot_actions:
+        _plot_actions(buffers['actions'], 'PD Target', '#ff0000')
+
+    # remove x ticks from upper graphs
+    for i_graph in (range(len(axes) - cols + 1) if not ONLY_ACTUATED_JOINTS else range(4)):
+        axes[i_graph].tick_params(axis='x', which='both',
+                                  labelbottom=False)
+
+    if speed_control:
+        plt.subplot(rows, cols, 3, sharex=axes[-1])
+        plt.plot(buffers['speeds'])
+        plt.ylabel('Desired Walking Speed [m/s]')
+        plt.xlabel('Simulation Timesteps []')
+        axes[0].legend(lines, names)
+    elif ONLY_ACTUATED_JOINTS:
+        axes[-1].legend(lines, names, loc='upper right')
+        plt.gcf().text(0.5, 0.04, r'Simulation Timesteps', ha='center', fontsize=font_size+2)
+        plt.subplots_adjust(top=0.974, bottom=0.13, left=0.06, right=0.978, hspace=0.15, wspace=0.44)
+        axes[-1].set_xlim([1400, 2000])
+    else:
+        # plot the legend in a separate subplot
+        with sns.axes_style("white", {"axes.edgecolor": 'white'}):
+            legend_subplot = plt.subplot(rows, cols, num_joints + 2)
+            legend_subplot.set_xticks([])
+            legend_subplot.set_yticks([])
+            legend_subplot.legend(lines, names, bbox_to_anchor=(
+                1.2 if plot_ref_distrib else 1, 1.075 if plot_ref_distrib else 1))
+
+        if plot_rews:
+            # add rewards and returns
+            from scripts.common.config import rew_scale, alive_bonus
+            rews = np.copy(buffers['rewards'])
+            rews -= alive_bonus
+            rews /= rew_scale
+
+            rew_plot = plt.subplot(rows, cols, len(axes) + 1, sharex=axes[-1])
+            rew_plot.plot(rews)
+            # rew_plot.set_ylim(np.array([-0.075, 1.025]))
+            # plot episode terminations
+            plt.vlines(np.argwhere(dones_buf).flatten() + 1,
+                       0, 1, colors='#cccccc')
+            # plot episode returns
+            ret_plot = rew_plot.twinx().twiny()
+            ret_plot.plot(buffers['returns'], '#77777777')
+            ret_plot.tick_params(axis='y', labelcolor='#77777777')
+            ret_plot.set_xticks([])
+
+            plt.title('Rewards & Returns')
+
+    # fix title overlapping when tight_layout is true
+    plt.gcf().tight_layout() # rect=[0, 0, 1, 0.95])
+    plt.subplots_adjust(wspace=0.25, hspace=0.4)
+    if buffers.get('title'):
+        plt.suptitle(buffers['title'])
+    elif speed_control:
+        plt.suptitle('Simulation and Reference Joint Kinematics over Time')
+    return plt
@@ -0,0 +1,135 @@
+"""
+Offline rendering of videos from recorded trajectories (see scripts.common.trajec_recorder).
+
+The recorded qpos and qvel are set in the simulation of a fresh environment
+and rendered offscreen, without running the policy or the episodes before.
+Each episode is rendered and encoded in its own worker process.
+
+Usage (from the project root):
+    python -m scripts.plots.videos path/to/metrics/model_999/trajecs --relevant
+    python -m scripts.plots.videos path/to/trajecs --episodes 0 4 --out videos/ --workers 2
+"""
+import argparse, os, time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from scripts.common.utils import log
+from scripts.common.trajec_recorder import TrajecReader
+
+# videos show at most the first seconds of an episode
+VIDEO_LEN_SECS = 10
+# render every n-th step to reach this frame rate, the control frequency is much higher
+VIDEO_FPS = 50
+VIDEO_SIZE = (500, 500)
+N_VIDEO_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+
+def get_relevant_episodes(reader):
+    """ :returns dict: name -> index of the best, worst and closest to average episode """
+    returns = reader.get_episode_returns()
+    eps = {'best': int(np.argmax(returns)), 'worst': int(np.argmin(returns)),
+           'mean': int(np.argmin(np.abs(returns - np.mean(returns))))}
+    return {f'{name}_{int(returns[i_ep])}': i_ep for name, i_ep in eps.items()}
+
+
+def _open_encoder(video_path, frame_shape, fps):
+    # the same ffmpeg encoder as used by gym's video recorder, its signature changed over versions
+    from gym.wrappers.monitoring.video_recorder import ImageEncoder
+    try:
+        return ImageEncoder(video_path, frame_shape, fps, fps)
+    except TypeError:
+        return ImageEncoder(video_path, frame_shape, fps)
+
+
+def render_episode_video(env_id, recording_dir, i_episode, video_path, run_cfg=None,
+                         video_secs=VIDEO_LEN_SECS, fps=VIDEO_FPS, size=VIDEO_SIZE):
+    """ Plays the recorded kinematics of an episode back and renders them into a video.
+        :returns the path of the video """
+    import gym, gym_mimic_envs
+    env = gym.make(env_id, **({} if run_cfg is None else {'run_cfg': run_cfg}))
+    reader = TrajecReader(recording_dir)
+    control_freq = reader.meta.get('control_freq', env.control_freq)
+    # render in real time: skip steps to reach the video frame rate
+    stride = max(1, int(round(control_freq / fps)))
+    n_steps = min(reader.episodes[i_episode][1] - reader.episodes[i_episode][0],
+                  int(video_secs * control_freq))
+    qposs = reader.get_episode('qpos', i_episode)[:n_steps]
+    qvels = reader.get_episode('qvel', i_episode)[:n_steps]
+
+    width, height = size
+    os.makedirs(os.path.dirname(video_path) or '.', exist_ok=True)
+    encoder = _open_encoder(video_path, (height, width, 3), control_freq / stride)
+    try:
+        for qpos, qvel in zip(qposs[::stride], qvels[::stride]):
+            env.set_joint_kinematics_in_sim(qpos, qvel)
+            env.sim.forward()
+            encoder.capture_frame(env.render(mode='rgb_array', width=width, height=height))
+    finally:
+        encoder.close()
+        env.close()
+    return video_path
+
+
+def render_videos(recording_dir, episodes, out_dir, run_cfg=None, env_id=None,
+                  n_workers=N_VIDEO_WORKERS, **video_kwargs):
+    """
+    Renders the videos of several recorded episodes in parallel worker processes.
+    :param episodes: dict: name -> index of the episode, the name is the video file name
+    :param env_id: defaults to the env_id saved with the recording
+    :returns dict: name -> video path, or the exception raised while rendering
+    """
+    if env_id is None:
+        env_id = run_cfg.env_id if run_cfg is not None else TrajecReader(recording_dir).meta['env_id']
+    results = {}
+    # spawn fresh interpreters, every worker creates its own offscreen rendering context
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn')) as pool:
+        futures = {pool.submit(render_episode_video, env_id, recording_dir, i_episode,
+                               os.path.join(out_dir, f'{name}.mp4'), run_cfg, **video_kwargs): name
+                   for name, i_episode in episodes.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as error:
+                results[name] = error
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='directory of the recorded trajectories')
+    parser.add_argument('--episodes', nargs='*', type=int, default=[],
+                        help='indices of the episodes to render')
+    parser.add_argument('--relevant', action='store_true',
+                        help='render the best, worst and closest to average episode')
+    parser.add_argument('--env-id', default=None, help='defaults to the env_id of the recording')
+    parser.add_argument('--out', default=None, help='output directory, default RECORDING/videos')
+    parser.add_argument('--workers', type=int, default=N_VIDEO_WORKERS)
+    parser.add_argument('--secs', type=float, default=VIDEO_LEN_SECS)
+    parser.add_argument('--fps', type=int, default=VIDEO_FPS)
+    parser.add_argument('--size', type=int, nargs=2, default=VIDEO_SIZE, metavar=('WIDTH', 'HEIGHT'))
+    args = parser.parse_args()
+
+    reader = TrajecReader(args.recording)
+    episodes = {f'episode_{i_ep}': i_ep for i_ep in args.episodes}
+    if args.relevant: episodes.update(get_relevant_episodes(reader))
+    if not episodes: parser.error('Nothing to render, specify --episodes and/or --relevant.')
+    out_of_range = [i_ep for i_ep in episodes.values() if not 0 <= i_ep < reader.n_episodes]
+    if out_of_range: parser.error(f'The recording has only {reader.n_episodes} episodes: {out_of_range}')
+
+    t_start = time.perf_counter()
+    results = render_videos(args.recording, episodes, args.out or os.path.join(args.recording, 'videos'),
+                            env_id=args.env_id, n_workers=args.workers,
+                            video_secs=args.secs, fps=args.fps, size=tuple(args.size))
+    failed = {name: error for name, error in results.items() if isinstance(error, Exception)}
+    log(f'Rendered {len(results) - len(failed)}/{len(results)} videos '
+        f'in {time.perf_counter() - t_start:.1f}s with {args.workers} workers:',
+        [f'{name}:\t {path}' for name, path in results.items() if name not in failed]
+        + [f'FAILED {name}:\t {error!r}' for name, error in failed.items()])
+    if failed: raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,212 @@
-import wandb
+import os, json, time
 import numpy as np
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 
 MET_STEPS_TO_CONV = 'log_steps_to_convergence'
 
+# run histories are cached locally in one folder per run with one .npy file per metric
+HISTORY_CACHE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))) + '/graphs/wandb_cache/'
+# max number of history points to fetch per run on the first download
+HISTORY_SAMPLES = int(1e5)
+# number of runs fetched in parallel
+N_FETCH_WORKERS = 8
+
+
 class Api:
 
-    def __init__(self, project_name=None):
-        self.api = wandb.Api()
+    def __init__(self, project_name=None, api=None, cache_path=HISTORY_CACHE_PATH):
+        """:param api: wandb.Api() if None, can be replaced by a FakeApi for offline usage"""
+        if api is None:
+            import wandb
+            api = wandb.Api()
+        self.api = api
+        self.cache_path = cache_path
         if project_name is not None:
             self.set_project(project_name)
 
     def set_project(self, project_name):
         self.project_name = project_name
         self.runs = self.api.runs("rustamg/%s" % project_name)
+        self.cache = HistoryCache(self.cache_path + project_name)
+
+    def fetch_histories(self, runs, n_workers=N_FETCH_WORKERS):
+        """ Updates the cached histories of the runs in parallel.
+            :returns the cache entry of each run """
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            return list(executor.map(self.cache.update, runs))
 
     def get_metrics(self, approach):
         # get relevant runs, finished only
         runs = [run for run in self.runs if (run.name == approach.run_name)]
-        i = 1
-        for run in runs:
-            print(f'Fething run {i} of {len(runs)} runs')
-            i += 1
-            history = run.history(samples=int(1e5))
+        print(f'Fetching {len(runs)} runs')
+        for entry in self.fetch_histories(runs):
             for metric in approach.metrics:
-                sum = run.summary
-                sum_keys = list(sum.keys())
+                summary = entry.summary
                 if metric.label == MET_STEPS_TO_CONV:
-                    if MET_STEPS_TO_CONV in sum_keys:
-                        metric.append_run(sum[MET_STEPS_TO_CONV])
+                    if MET_STEPS_TO_CONV in summary:
+                        metric.append_run(summary[MET_STEPS_TO_CONV])
                     else:
                         print('WARNING! One run has not converged!')
                         metric.append_run(10e6)
                     continue
-                metric.append_run(history[metric.label].dropna().tolist())
+                values = entry.get_column(metric.label)
+                metric.append_run(values[~np.isnan(values)].tolist())
+
+
+class CachedRun:
+    """ Cached history of a single run: one .npy file per metric and a meta.json. """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = None
+        if os.path.exists(path + '/meta.json'):
+            with open(path + '/meta.json') as file:
+                self.meta = json.load(file)
+
+    @property
+    def summary(self):
+        return self.meta['summary']
+
+    @property
+    def columns(self):
+        return self.meta['columns']
+
+    def is_up_to_date(self, run):
+        return self.meta is not None and self.meta['updated_at'] == _get_updated_at(run)
+
+    def get_column(self, label):
+        """:returns all values of the metric, NaN where the metric was not logged"""
+        if label not in self.columns:
+            return np.full(self.meta['n_rows'], np.nan)
+        return np.load(self._column_path(label))
+
+    def write(self, run, columns, n_rows):
+        """ Saves the columns, the meta file is written last and marks the entry as complete. """
+        os.makedirs(self.path, exist_ok=True)
+        for label, values in columns.items():
+            np.save(self._column_path(label), values)
+        steps = columns.get('_step', np.arange(n_rows))
+        self.meta = {'run_id': run.id, 'name': run.name, 'state': run.state,
+                     'updated_at': _get_updated_at(run), 'n_rows': n_rows,
+                     'last_step': int(steps[-1]) if n_rows > 0 else -1,
+                     'columns': sorted(columns.keys()),
+                     'summary': _to_numeric_dict(run.summary)}
+        tmp_path = self.path + '/meta.json.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.meta, file)
+        os.replace(tmp_path, self.path + '/meta.json')
+
+    def _column_path(self, label):
+        return f'{self.path}/{quote(label, safe="")}.npy'
+
+
+class HistoryCache:
+    """
+    Local columnar cache of wandb run histories keyed by the run id.
+    A run is only fetched again when it was updated since it was cached
+    and then only the history rows after the last cached step are downloaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, run_id):
+        return CachedRun(f'{self.path}/{run_id}')
+
+    def update(self, run):
+        """:returns the up-to-date cache entry of the run"""
+        entry = self.get(run.id)
+        if entry.is_up_to_date(run):
+            return entry
+        if entry.meta is None:
+            rows = run.history(samples=HISTORY_SAMPLES, pandas=False)
+            columns = {}
+        else:
+            # incremental update: only fetch the rows after the last cached step
+            rows = list(run.scan_history(min_step=entry.meta['last_step'] + 1))
+            columns = {label: entry.get_column(label) for label in entry.columns}
+        n_cached = entry.meta['n_rows'] if entry.meta is not None else 0
+        columns = _append_rows(columns, n_cached, rows)
+        entry.write(run, columns, n_cached + len(rows))
+        return entry
+
+
+def _get_updated_at(run):
+    """ Time of the last update of a run, changes while the run is still running. """
+    updated_at = getattr(run, 'heartbeat_at', None)
+    return str(updated_at) + run.state
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_))
+
+
+def _to_numeric_dict(summary):
+    return {key: float(value) for key, value in dict(summary).items() if _is_number(value)}
+
+
+def _append_rows(columns, n_cached, rows):
+    """ Appends the numeric values of the history rows (dicts) to the columns. """
+    labels = set(columns.keys()) | {key for row in rows for key, value in row.items()
+                                    if _is_number(value)}
+    n_rows = n_cached + len(rows)
+    new_columns = {}
+    for label in labels:
+        values = np.full(n_rows, np.nan)
+        if label in columns: values[:n_cached] = columns[label]
+        values[n_cached:] = [row[label] if _is_number(row.get(label)) else np.nan for row in rows]
+        new_columns[label] = values
+    return new_columns
+
+
+class FakeRun:
+    """ Local stand-in of a wandb run to use the Api offline, e.g. for tests and benchmarks. """
+
+    def __init__(self, run_id, name, rows, summary={}, state='finished', latency_s=0):
+        """:param rows: history as a list of dicts containing '_step'
+           :param latency_s: simulated network delay of each request"""
+        self.id = run_id
+        self.name = name
+        self.rows = rows
+        self.summary = summary
+        self.state = state
+        self.latency_s = latency_s
+        self.heartbeat_at = time.time()
+
+    def history(self, samples=500, pandas=True):
+        time.sleep(self.latency_s)
+        rows = self.rows
+        if len(rows) > samples:
+            rows = [rows[i] for i in np.linspace(0, len(rows) - 1, samples).astype(int)]
+        if pandas:
+            import pandas as pd
+            return pd.DataFrame.from_records(rows)
+        return list(rows)
+
+    def scan_history(self, keys=None, min_step=0):
+        time.sleep(self.latency_s)
+        return [row for row in self.rows if row['_step'] >= min_step]
+
+    def log(self, row):
+        """ Simulates the run logging a new history row. """
+        self.rows.append(dict(row, _step=len(self.rows)))
+        self.heartbeat_at = time.time()
+
+
+class FakeApi:
+    """ Local stand-in of wandb.Api() serving FakeRuns. """
+
+    def __init__(self, runs):
+        self._runs = runs
+
+    def runs(self, path):
+        return list(self._runs)
 
 
 if __name__ == '__main__':
+    import wandb
     # Project is specified by <entity/project-name>
     PROJECT_NAME = "pd_approaches"
     run_names = ['BSLN, init std = 1', 'BSLN - normed target angles', 'normed deltas']
@@ -9,6 +9,7 @@ from gym_mimic_envs.monitor import Monitor
 from gym_mimic_envs.mujoco.mimic_walker2d import MimicWalker2dEnv
 from stable_baselines import PPO2
 from scripts.common.utils import load_env
+from scripts.common.checkpoints import resolve, resolve_name
 from scripts.common import config as cfg
 
 # paths
@@ -28,11 +29,6 @@ FLY = False
 DETERMINISTIC_ACTIONS = True
 RENDER = True
 
-if cfg.env_out_torque:
-    cfg.env_id = cfg.env_ids[4]
-else:
-    cfg.env_id = cfg.env_ids[2]
-
 SPEED_CONTROL = False
 
 
@@ -42,24 +38,32 @@ PATH = path_mirr_exps
 if not PATH.endswith('/'): PATH += '/'
 checkpoint = 'final' # '33_min24mean24' # 'ep_ret2000_7M' #'mean_rew60'
 
-if FLY: cfg.rew_weights = "6400"
+# configure the run without modifying the module-level config
+env_index = 4 if cfg.env_out_torque else 2
+run_cfg_overrides = {'env_id': cfg.env_ids[env_index], 'env_abbrev': cfg.env_abbrevs[env_index]}
+if FLY: run_cfg_overrides['rew_weights'] = "6400"
+run_cfg = cfg.build_run_config(**run_cfg_overrides)
+cfg.set_default_run_config(run_cfg)
 
 if FROM_PATH:
     # check if correct reference trajectories are used
-    if cfg.MOD_REFS_RAMP in PATH and not cfg.is_mod(cfg.MOD_REFS_RAMP):
+    if cfg.MOD_REFS_RAMP in PATH and not run_cfg.refs_ramp:
         raise AssertionError('Model trained on ramp-trajecs but is used with constant speed trajecs!')
 
     # load model
-    model_path = PATH + f'models/model_{checkpoint}.zip'
+    # the checkpoint can also be 'best' or 'latest',
+    # load the model and the env of the same checkpoint
+    checkpoint = resolve_name(PATH, checkpoint)
+    model_path, _ = resolve(PATH, checkpoint)
     model = PPO2.load(load_path=model_path)
     print('\nModel:\n', model_path + '\n')
 
-    env = load_env(checkpoint, PATH, cfg.env_id)
+    env = load_env(checkpoint, PATH, run_cfg.env_id, run_cfg)
 else:
-    env = gym.make(cfg.env_id)
+    env = gym.make(run_cfg.env_id, run_cfg=run_cfg)
     env = Monitor(env)
     vec_env = env
-    # env.playback_ref_trajectories(10000, pd_pos_control=True)
+    # print(env.playback_ref_trajectories(10000, pd_pos_control=True, render=True))
 
 if not isinstance(env, Monitor):
     # VecNormalize wrapped DummyVecEnv
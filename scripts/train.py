@@ -4,6 +4,7 @@ from scripts import eval
 from scripts.common import config as cfg, utils
 from scripts.common.schedules import LinearSchedule, ExponentialSchedule
 from scripts.common.callback import TrainingMonitor
+from scripts.common.checkpoints import CheckpointManager
 from scripts.common.policies import CustomPolicy
 from scripts.common.distributions import LOG_STD_MIN, LOG_STD_MAX
 
@@ -16,45 +17,43 @@ from scripts.algos.custom_ppo2 import CustomPPO2
 from stable_baselines.common.policies import MlpPolicy
 
 
-def run_tensorboard():
+def run_tensorboard(save_path):
     import os, threading
     print('You can start tensorboard with the following command:\n'
-          'tensorboard --logdir="' + cfg.save_path + 'tb_logs/"')
+          'tensorboard --logdir="' + save_path + 'tb_logs/"')
     tb_path = '/home/rustam/anaconda3/envs/drl/bin/tensorboard ' if utils.is_remote() \
         else '/home/rustam/.conda/envs/tensorflow/bin/tensorboard '
     tb_thread = threading.Thread(
-        target=lambda: os.system(tb_path + '--logdir="' + cfg.save_path + 'tb_logs/"'),
+        target=lambda: os.system(tb_path + '--logdir="' + save_path + 'tb_logs/"'),
         daemon=True)
     tb_thread.start()
 
 
-def init_wandb(model):
+def init_wandb(model, run_cfg:cfg.RunConfig):
     batch_size = model.n_steps * model.n_envs
     params = {
-        "path": cfg.save_path,
-        "mod": cfg.modification,
-        "ctrl_freq": cfg.CTRL_FREQ,
+        "path": run_cfg.save_path,
+        "mod": run_cfg.modification,
+        "ctrl_freq": run_cfg.ctrl_freq,
         "lr0": cfg.lr_start,
-        "et_rew": cfg.et_reward,
-        "ep_end_rew": cfg.ep_end_reward,
         "lr1": cfg.lr_final,
         'hid_sizes': cfg.hid_layer_sizes_vf,
         'hid_sizes_vf': cfg.hid_layer_sizes_vf,
         'hid_sizes_pi': cfg.hid_layer_sizes_pi,
         "noptepochs": cfg.noptepochs,
         "batch_size": batch_size,
-        "cfg.batch_size": cfg.batch_size,
+        "cfg.batch_size": run_cfg.batch_size,
         "n_mini_batches": model.nminibatches,
-        "cfg.minibatch_size": cfg.minibatch_size,
+        "cfg.minibatch_size": run_cfg.minibatch_size,
         "mini_batch_size": int(batch_size / model.nminibatches),
-        "mio_steps": cfg.mio_samples,
+        "mio_steps": run_cfg.mio_samples,
         "ent_coef": model.ent_coef,
-        "ep_dur": cfg.ep_dur_max,
-        "imit_rew": cfg.rew_weights,
+        "ep_dur": run_cfg.ep_dur_max,
+        "imit_rew": run_cfg.rew_weights,
         "logstd": cfg.init_logstd,
         "min_logstd": LOG_STD_MIN,
         "max_logstd": LOG_STD_MAX,
-        "env": cfg.env_abbrev,
+        "env": run_cfg.env_abbrev,
         "gam": model.gamma,
         "lam": model.lam,
         "n_envs": model.n_envs,
@@ -64,76 +63,93 @@ def init_wandb(model):
         "vf_coef": model.vf_coef,
         "max_grad_norm": model.max_grad_norm,
         "nminibatches": model.nminibatches,
-        "clip0": cfg.clip_start,
-        "clip1": cfg.clip_end,
+        "clip0": run_cfg.clip_start,
+        "clip1": run_cfg.clip_end,
         "n_cpu_tf_sess": model.n_cpu_tf_sess}
 
-    if cfg.is_mod(cfg.MOD_REFS_RAMP):
+    if run_cfg.refs_ramp:
         params['skip_n_steps'] = cfg.SKIP_N_STEPS
         params['steps_per_vel'] = cfg.STEPS_PER_VEL
 
-    if cfg.is_mod(cfg.MOD_E2E_ENC_OBS):
+    if run_cfg.e2e_enc_obs:
         params['enc_layers'] = cfg.enc_layer_sizes
 
-    wandb.init(config=params, sync_tensorboard=True, name=cfg.get_wb_run_name(),
+    wandb.init(config=params, sync_tensorboard=True, name=run_cfg.get_wb_run_name(),
                project=cfg.wb_project_name, notes=cfg.wb_run_notes)
 
 
-def train():
+def train(run_cfg:cfg.RunConfig=None):
+
+    # resolve the run configuration once and share it with all modules
+    # that still access the legacy module-level config attributes
+    if run_cfg is None: run_cfg = cfg.build_run_config()
+    cfg.set_default_run_config(run_cfg)
+    save_path = run_cfg.save_path
+
+    print('Model: ', save_path)
+    print('Modification:', run_cfg.modification)
 
     # create model directories
-    if not os.path.exists(cfg.save_path):
-        os.makedirs(cfg.save_path)
-        os.makedirs(cfg.save_path + 'metrics')
-        os.makedirs(cfg.save_path + 'models')
-        os.makedirs(cfg.save_path + 'models/params')
-        os.makedirs(cfg.save_path + 'envs')
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+        os.makedirs(save_path + 'metrics')
+        os.makedirs(save_path + 'models')
+        os.makedirs(save_path + 'models/params')
+        os.makedirs(save_path + 'envs')
 
     # setup environment
-    env = utils.vec_env(cfg.env_id, norm_rew=True, num_envs=cfg.n_envs)
+    env = utils.vec_env(run_cfg.env_id, norm_rew=True,
+                        num_envs=run_cfg.n_envs, run_cfg=run_cfg)
 
     # setup model/algorithm
-    training_timesteps = int(cfg.mio_samples * 1e6)
+    training_timesteps = int(run_cfg.mio_samples * 1e6)
     lr_start = cfg.lr_start
     lr_end = cfg.lr_final
 
     learning_rate_schedule = LinearSchedule(lr_start, lr_end).value
-    clip_schedule = ExponentialSchedule(cfg.clip_start, cfg.clip_end, cfg.clip_exp_slope).value
+    clip_schedule = ExponentialSchedule(run_cfg.clip_start, run_cfg.clip_end, cfg.clip_exp_slope).value
 
     network_args = {'net_arch': [{'vf': cfg.hid_layer_sizes_vf, 'pi': cfg.hid_layer_sizes_pi}],
-                    'act_fun': tf.nn.relu} if not cfg.is_mod(cfg.MOD_CUSTOM_POLICY) else {}
+                    'act_fun': tf.nn.relu} if not run_cfg.custom_policy \
+        else {'run_cfg': run_cfg}
 
-    model = CustomPPO2(CustomPolicy if cfg.is_mod(cfg.MOD_CUSTOM_POLICY) else MlpPolicy,
-                       env, verbose=1, n_steps=int(cfg.batch_size/cfg.n_envs),
+    model = CustomPPO2(CustomPolicy if run_cfg.custom_policy else MlpPolicy,
+                       env, verbose=1, n_steps=int(run_cfg.batch_size/run_cfg.n_envs),
                        policy_kwargs=network_args,
                        learning_rate=learning_rate_schedule, ent_coef=cfg.ent_coef,
-                       gamma=cfg.gamma, noptepochs=cfg.noptepochs,
-                       cliprange_vf=clip_schedule if cfg.is_mod(cfg.MOD_CLIPRANGE_SCHED) else cfg.cliprange,
-                       cliprange=clip_schedule if cfg.is_mod(cfg.MOD_CLIPRANGE_SCHED) else cfg.cliprange,
-                       tensorboard_log=cfg.save_path + 'tb_logs/')
+                       gamma=run_cfg.gamma, noptepochs=cfg.noptepochs,
+                       cliprange_vf=clip_schedule if run_cfg.cliprange_sched else cfg.cliprange,
+                       cliprange=clip_schedule if run_cfg.cliprange_sched else cfg.cliprange,
+                       tensorboard_log=save_path + 'tb_logs/', run_cfg=run_cfg)
 
     # init wandb
-    if not cfg.DEBUG: init_wandb(model)
+    if not run_cfg.debug: init_wandb(model, run_cfg)
 
     # automatically launch tensorboard, only if wandb is not used!
     # otherwise wandb automatically uploads all TB logs to wandb
-    # run_tensorboard()
+    # run_tensorboard(save_path)
+
+    # the init and final checkpoints are never deleted by the retention policy
+    checkpoints = CheckpointManager(save_path)
 
     # save model and weights before training
-    if not cfg.DEBUG:
-        utils.save_model(model, cfg.save_path, cfg.init_checkpoint)
+    if not run_cfg.debug:
+        checkpoints.save(model, cfg.init_checkpoint, timestep=0, pinned=True)
 
     # train model
-    model.learn(total_timesteps=training_timesteps, callback=TrainingMonitor())
+    model.learn(total_timesteps=training_timesteps,
+                callback=TrainingMonitor(run_cfg, checkpoints=checkpoints))
 
     # save model after training
-    utils.save_model(model, cfg.save_path, cfg.final_checkpoint)
+    checkpoints.save(model, cfg.final_checkpoint, timestep=model.num_timesteps, pinned=True)
+    # wait until all checkpoints are written
+    checkpoints.close()
 
     # close environment
     env.close()
 
     # evaluate last saved model
-    eval.eval_model()
+    eval.eval_model(run_cfg=run_cfg)
 
 
 if __name__ == '__main__':